@@ -0,0 +1,118 @@
+# middleware.py
+# per-request sql profiling for every app in the project
+# QueryCountMiddleware wraps each database connection for the duration of a request
+# and records the number of queries, the total time spent in them, the slowest ones,
+# and the query shapes (the sql with its values stripped out) that ran more than once,
+# which is what an N+1 pattern looks like, e.g. a template calling
+# profile.get_friends or message.get_images inside a loop
+# the summary is sent back in a Server-Timing header and written as a json log line
+# to the 'cs412.queries' logger, as a warning once a request runs more than
+# QUERY_COUNT_THRESHOLD queries
+
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('cs412.queries')
+
+# defaults for the settings read by the middleware
+DEFAULT_QUERY_COUNT_THRESHOLD = 50
+DEFAULT_QUERY_COUNT_REPORTED = 3
+
+# pieces of sql that vary between executions of the same query
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_LIST = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+def query_shape(sql):
+    '''return sql with its literal values and IN (...) list lengths removed, so repeats of one query compare equal'''
+    shape = STRING_LITERAL.sub('?', sql)
+    shape = NUMBER_LITERAL.sub('?', shape)
+    shape = PLACEHOLDER_LIST.sub('(...)', shape)
+    return WHITESPACE.sub(' ', shape).strip()
+
+class QueryStats:
+    """
+    database execute wrapper collecting the queries run while it is installed
+    (see https://docs.djangoproject.com/en/4.2/topics/db/instrumentation/)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.timings = []       # (duration in ms, sql) of every query
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.count += 1
+            self.total_ms += duration
+            self.timings.append((duration, sql))
+            self.shapes[query_shape(sql)] += 1
+
+    def slowest(self, n):
+        '''return the n slowest queries as (duration in ms, sql) pairs, slowest first'''
+        return sorted(self.timings, key=lambda timing: timing[0], reverse=True)[:n]
+
+    def duplicates(self):
+        '''return (shape, count) pairs for the query shapes that ran more than once, most repeated first'''
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > 1]
+
+class QueryCountMiddleware:
+    """
+    records the sql run by each request and reports it in a Server-Timing header
+    and a log line, flagging requests that run more than QUERY_COUNT_THRESHOLD queries
+
+    queries run while a streaming response is being consumed happen after the
+    middleware returns, so they aren't counted
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'QUERY_COUNT_THRESHOLD', DEFAULT_QUERY_COUNT_THRESHOLD)
+        self.reported = getattr(settings, 'QUERY_COUNT_REPORTED', DEFAULT_QUERY_COUNT_REPORTED)
+
+    def __call__(self, request):
+        stats = QueryStats()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(stats))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        duplicates = stats.duplicates()
+        over_threshold = stats.count > self.threshold
+
+        # append to any Server-Timing entries set by the view
+        timing = (f'sql;dur={stats.total_ms:.2f};desc="{stats.count} queries", '
+                  f'sql-duplicates;desc="{sum(count - 1 for _, count in duplicates)} repeated"')
+        if response.has_header('Server-Timing'):
+            timing = f"{response['Server-Timing']}, {timing}"
+        response['Server-Timing'] = timing
+
+        summary = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'sql_ms': round(stats.total_ms, 2),
+            'total_ms': round(total_ms, 2),
+            'over_threshold': over_threshold,
+            'slowest': [{'ms': round(ms, 2), 'sql': sql[:300]} for ms, sql in stats.slowest(self.reported)],
+            'duplicates': [{'count': count, 'shape': shape[:300]} for shape, count in duplicates[:self.reported]],
+        }
+        logger.log(logging.WARNING if over_threshold else logging.INFO, json.dumps(summary))
+
+        return response
@@ -0,0 +1,18 @@
+# models.py for the project package
+# - DataVersion: the current data version of one app, used by cs412/versioning.py
+
+from django.db import models
+
+
+class DataVersion(models.Model):
+    '''
+    model holding the data version of one app
+
+    the version lives in the database rather than the cache, so it can't be evicted
+    along with the cached pages, and it is incremented with an atomic UPDATE
+    '''
+    app_label = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.app_label} data version {self.version}"
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import importlib.util
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,9 +44,12 @@ INSTALLED_APPS = [
     'mini_fb',
     'voter_analytics',
     'figure_skating_game',
+    'cs412',
 ]
 
 MIDDLEWARE = [
+    # first, so the queries of every other middleware are counted too
+    'cs412.middleware.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,10 +87,63 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    # throwaway database filled by 'manage.py generate_voters --database synthetic';
+    # nothing reads from it unless it is pointed at explicitly
+    'synthetic': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'synthetic.sqlite3',
+    },
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# a file based cache is shared between the web server and management commands,
+# so reloading the voter data from the command line invalidates cached results
+
+# the data versions that cached results are keyed by live in the database
+# (cs412.models.DataVersion), so culling the cache never resets them
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'django_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
 
+# Per-request sql profiling (cs412/middleware.py)
+# every request is logged to 'cs412.queries' with its query count, sql time, slowest
+# queries and repeated query shapes; requests running more than QUERY_COUNT_THRESHOLD
+# queries are logged as warnings. QUERY_COUNT_REPORTED caps the queries listed per line
+# only the warnings are printed by default; set QUERY_LOG_LEVEL=INFO in the environment
+# to log every request
+
+QUERY_COUNT_THRESHOLD = 50
+QUERY_COUNT_REPORTED = 3
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'cs412.queries': {
+            'handlers': ['console'],
+            'level': os.environ.get('QUERY_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -134,6 +191,28 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static"),
 ]
 
+# serve the plotly.js bundle that ships with the plotly package as static/plotly/plotly.min.js,
+# so the voter graphs page can load it once and draw its charts in the browser
+_plotly_spec = importlib.util.find_spec('plotly')
+if _plotly_spec is not None:
+    STATICFILES_DIRS.append(
+        ('plotly', os.path.join(_plotly_spec.submodule_search_locations[0], 'package_data'))
+    )
+
+# draw the voter graphs in the browser from the json data endpoint (True),
+# or render them on the server with plotly (False)
+VOTER_GRAPHS_CLIENT_RENDERING = True
+
+# answer the voter list and graph filters from an in-memory numpy snapshot of the
+# Voter table instead of SQL (rebuilt automatically after each reload)
+VOTER_ANALYTICS_SNAPSHOT = False
+
+# write new mini_fb status messages to the news feed timelines of their author's friends
+# and read news feeds from there (run backfill_timelines after turning it on); authors
+# with more than MINI_FB_FANOUT_FRIEND_LIMIT friends have their messages pulled instead
+MINI_FB_TIMELINE = False
+MINI_FB_FANOUT_FRIEND_LIMIT = 1000
+
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 MEDIA_URL= "/media/"  
 
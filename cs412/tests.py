@@ -0,0 +1,138 @@
+# tests.py for the project package
+# - QueryShapeTests: repeats of one query normalize to the same shape
+# - QueryCountMiddlewareTests: the Server-Timing header and the over-threshold warning
+# - DataVersionTests: data versions survive cache culling and concurrent bumps
+# - VersionedCachePageTests: pages cached by versioned_cache_page are invalidated by a bump,
+#   and the pages of apps without models expire
+
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from .middleware import QueryCountMiddleware, query_shape
+from .models import DataVersion
+from .versioning import (UNVERSIONED_PAGE_TIMEOUT, bump_data_version, data_version_key, get_data_version,
+                         versioned_cache_page)
+
+# a tiny cache, so culling is easy to trigger
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                           'LOCATION': 'cs412_tests', 'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_FREQUENCY': 1}}}
+
+
+class QueryShapeTests(TestCase):
+    '''query_shape'''
+
+    def test_literals_and_placeholders_are_stripped(self):
+        self.assertEqual(query_shape("SELECT * FROM t WHERE name = 'O''Brien' AND id = 42"),
+                         query_shape("SELECT * FROM t WHERE name = 'Smith' AND id = 7"))
+        self.assertEqual(query_shape("SELECT * FROM t WHERE id IN (%s, %s, %s)"),
+                         query_shape("SELECT *\n  FROM t WHERE id IN (%s)"))
+        self.assertEqual(query_shape("SELECT * FROM t WHERE id IN (%s, %s)"), "SELECT * FROM t WHERE id IN (...)")
+
+    def test_different_queries_keep_different_shapes(self):
+        self.assertNotEqual(query_shape("SELECT * FROM t1 WHERE id = 1"), query_shape("SELECT * FROM t2 WHERE id = 1"))
+        self.assertNotEqual(query_shape("SELECT a FROM t"), query_shape("SELECT b FROM t"))
+
+
+@override_settings(QUERY_COUNT_THRESHOLD=3, QUERY_COUNT_REPORTED=2)
+class QueryCountMiddlewareTests(TestCase):
+    '''QueryCountMiddleware around views running a given number of queries'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f'user{i}') for i in range(5)]
+
+    def run_view(self, queries):
+        '''return the response of a view that looks up queries users one at a time'''
+        def view(request):
+            for user in self.users[:queries]:
+                User.objects.get(pk=user.pk)
+            response = HttpResponse('ok')
+            response['Server-Timing'] = 'view;dur=1'
+            return response
+        return QueryCountMiddleware(view)(RequestFactory().get('/somewhere'))
+
+    def test_server_timing_reports_queries_and_repeats(self):
+        with self.assertNoLogs('cs412.queries', level='WARNING'):
+            response = self.run_view(3)
+        timing = response['Server-Timing']
+        self.assertTrue(timing.startswith('view;dur=1, sql;dur='), timing)
+        self.assertIn('desc="3 queries"', timing)
+        self.assertIn('sql-duplicates;desc="2 repeated"', timing)
+
+    def test_requests_over_the_threshold_are_logged_as_warnings(self):
+        with self.assertLogs('cs412.queries', level='WARNING') as logs:
+            self.run_view(4)
+        summary = json.loads(logs.records[0].getMessage())
+        self.assertEqual((summary['path'], summary['queries'], summary['over_threshold']), ('/somewhere', 4, True))
+        self.assertEqual(len(summary['slowest']), 2)
+        self.assertEqual([duplicate['count'] for duplicate in summary['duplicates']], [4])
+
+    def test_requests_under_the_threshold_are_logged_as_info(self):
+        with self.assertLogs('cs412.queries', level='INFO') as logs:
+            self.run_view(1)
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        self.assertFalse(json.loads(logs.records[0].getMessage())['over_threshold'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DataVersionTests(TestCase):
+    '''get_data_version and bump_data_version'''
+
+    def setUp(self):
+        cache.clear()
+
+    def test_version_survives_culling(self):
+        version = get_data_version('quotes')
+        for i in range(50):
+            cache.set(f'page:{i}', i)
+        self.assertIsNone(cache.get(data_version_key('quotes')))
+        self.assertEqual(get_data_version('quotes'), version)
+
+    def test_every_bump_counts(self):
+        version = get_data_version('quotes')
+        # a bump from another process doesn't see this process's cached copy
+        cache.set(data_version_key('quotes'), version)
+        DataVersion.objects.filter(app_label='quotes').update(version=version + 1)
+        self.assertEqual(bump_data_version('quotes'), version + 2)
+        self.assertEqual(get_data_version('quotes'), version + 2)
+
+    def test_bump_without_a_version_creates_one(self):
+        version = bump_data_version('restaurant')
+        self.assertEqual(DataVersion.objects.get(app_label='restaurant').version, version)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class VersionedCachePageTests(TestCase):
+    '''versioned_cache_page'''
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+        @versioned_cache_page('quotes')
+        def view(request):
+            self.calls += 1
+            return HttpResponse(str(self.calls))
+
+        self.view = view
+        self.request = RequestFactory().get('/quotes/show_all')
+
+    def test_cached_until_bumped(self):
+        self.assertEqual(self.view(self.request).content, b'1')
+        self.assertEqual(self.view(self.request).content, b'1')
+        bump_data_version('quotes')
+        self.assertEqual(self.view(self.request).content, b'2')
+
+    def test_pages_of_apps_without_models_expire(self):
+        for url in (reverse('show_all'), reverse('restaurant')):
+            with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            page_sets = [c for c in cache_set.call_args_list if c.args[0].startswith('page:')]
+            self.assertEqual(len(page_sets), 1, url)
+            self.assertEqual(page_sets[0].args[2], UNVERSIONED_PAGE_TIMEOUT, url)
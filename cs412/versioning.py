@@ -0,0 +1,127 @@
+# versioning.py
+# per-app data versions and response caching keyed by them
+# every app has a monotonically increasing data version stored in the DataVersion table.
+# cached values are keyed by the versions of the apps they were built from, so
+# bumping an app's version invalidates everything cached for it at once, without
+# time-based expiry and without tracking down the individual keys
+# the versions are read through the cache for VERSION_CACHE_TIMEOUT seconds, so a
+# version that is bumped from another process is picked up within that time
+# apps call track_data_version(self) in AppConfig.ready() to bump their version
+# whenever one of their models is saved or deleted, and views are cached with
+# versioned_cache_page('app_label', ...); pages of apps without models, whose version
+# never changes, also pass a timeout so a deploy is picked up
+
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from .models import DataVersion
+
+# seconds a data version read from the database is reused from the cache
+VERSION_CACHE_TIMEOUT = 5
+
+# seconds the pages of apps without models are cached: nothing ever bumps their
+# version, so they only change with the code and have to expire on their own
+UNVERSIONED_PAGE_TIMEOUT = 60 * 60
+
+def data_version_key(app_label):
+    '''return the cache key holding app_label's data version'''
+    return f'{app_label}:data_version'
+
+def read_data_version(app_label):
+    '''return app_label's data version from the database, creating it if there is none'''
+    version = DataVersion.objects.filter(app_label=app_label).values_list('version', flat=True).first()
+    if version is None:
+        # start from the current time rather than 1, so a new database can never
+        # reuse a version that cached values from an older one are keyed by
+        data_version, _ = DataVersion.objects.get_or_create(
+            app_label=app_label, defaults={'version': int(time.time() * 1000)})
+        version = data_version.version
+    return version
+
+def get_data_version(app_label):
+    '''return the current data version of app_label'''
+    key = data_version_key(app_label)
+    version = cache.get(key)
+    if version is None:
+        version = read_data_version(app_label)
+        cache.add(key, version, timeout=VERSION_CACHE_TIMEOUT)
+    return version
+
+def bump_data_version(app_label):
+    '''move app_label to a new data version, invalidating everything cached for the old one'''
+    # the increment happens in the database, so concurrent bumps are never lost
+    if not DataVersion.objects.filter(app_label=app_label).update(version=F('version') + 1):
+        read_data_version(app_label)
+    cache.delete(data_version_key(app_label))
+    return get_data_version(app_label)
+
+def track_data_version(app_config):
+    '''
+    bump app_config's data version whenever one of its models is saved, deleted or
+    has a many-to-many relation changed, once the surrounding transaction commits
+
+    bulk_create, bulk_update and QuerySet.update() don't send these signals, so code
+    writing that way has to call bump_data_version itself
+    '''
+    app_label = app_config.label
+
+    def bump(**kwargs):
+        transaction.on_commit(lambda: bump_data_version(app_label))
+
+    def bump_m2m(action, **kwargs):
+        if action.startswith('post_'):
+            bump()
+
+    # the receivers are closures, so they are connected with strong references
+    for model in app_config.get_models(include_auto_created=True):
+        uid = f'data_version:{model._meta.label}'
+        post_save.connect(bump, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(bump, sender=model, weak=False, dispatch_uid=uid)
+        if model._meta.auto_created:
+            # the auto-created through tables of ManyToManyFields
+            m2m_changed.connect(bump_m2m, sender=model, weak=False, dispatch_uid=uid)
+
+def versioned_cache_page(*app_labels, timeout=None):
+    '''
+    view decorator caching successful GET and HEAD responses until the data version
+    of one of app_labels changes (or timeout seconds pass, when given)
+
+    responses are keyed by the full url, including the query string, so only use it
+    on pages that look the same for every visitor. apps without models never bump
+    their version, so their pages should pass timeout=UNVERSIONED_PAGE_TIMEOUT
+    '''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            versions = '.'.join(str(get_data_version(app_label)) for app_label in app_labels)
+            url = hashlib.sha1(request.get_full_path().encode('utf-8')).hexdigest()
+            key = f"page:{'+'.join(app_labels)}:{versions}:{url}"
+
+            response = cache.get(key)
+            if response is not None:
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming or response.cookies:
+                return response
+
+            def store(response):
+                cache.set(key, response, timeout)
+
+            if hasattr(response, 'render') and not response.is_rendered:
+                # template responses are cached once they have been rendered
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+        return wrapper
+    return decorator
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class FigureSkatingGameConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'figure_skating_game'
+
+    def ready(self):
+        # invalidate the cached skater and competition pages whenever the data changes
+        from cs412.versioning import track_data_version
+        track_data_version(self)
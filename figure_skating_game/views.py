@@ -6,6 +6,7 @@ from django.core.paginator import Paginator
 from django.db.models import Avg, Case, Count, Max, Prefetch, Q, When
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
 from django.views.generic import DetailView, FormView, ListView, UpdateView, DeleteView
 from django.views.generic.edit import CreateView
 
@@ -15,12 +16,15 @@ import plotly.express as px
 import plotly.graph_objects as go
 
 # local application
+from cs412.versioning import versioned_cache_page
 from .forms import CompetitionForm, ProgramForm, SelectProgramsForm, SkaterForm
 from .models import *
 
+@method_decorator(versioned_cache_page('figure_skating_game'), name='dispatch')
 class ShowAllSkaters(ListView):
     """
     view to display a paginated list of all skaters
+    pages are cached until a figure skating model is saved or deleted
     """
     model = Skater
     template_name = 'figure_skating_game/skaters_list.html' 
@@ -28,9 +32,11 @@ class ShowAllSkaters(ListView):
     paginate_by = 9  # show 9 skaters per page
 
 
+@method_decorator(versioned_cache_page('figure_skating_game'), name='dispatch')
 class ShowAllCompetitions(ListView):
     """
     view to display a paginated list of all competitions
+    pages are cached until a figure skating model is saved or deleted
     """
     model = Competition
     template_name = 'figure_skating_game/show_all_comps.html' 
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class MiniFbConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mini_fb'
+
+    def ready(self):
+        # keep the precomputed friend suggestions up to date as friendships change,
+        # and the news feed timelines as status messages are posted and friendships change
+        from .models import Friend, FriendSuggestion, StatusMessage, TimelineEntry
+        from .suggestions import track_friend_suggestions
+        from .timeline import track_timelines
+        track_friend_suggestions(Friend, FriendSuggestion)
+        track_timelines(Friend, StatusMessage, TimelineEntry)
@@ -0,0 +1,43 @@
+# backfill_timelines.py
+# management command that rebuilds the mini_fb news feed timelines
+# new status messages and friendships keep the timelines up to date on their own while
+# MINI_FB_TIMELINE is on, so this is for messages and friendships written before it was
+# turned on, bulk loaded, or written while it was off, and for re-deciding which authors
+# are fanned out after MINI_FB_FANOUT_FRIEND_LIMIT changes
+# usage: python manage.py backfill_timelines [profile_id ...] [--limit 50] [--batch-size 50]
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mini_fb.models import Friend, Profile, StatusMessage, TimelineEntry
+from mini_fb.timeline import BACKFILL_BATCH_SIZE, FEED_LIMIT, backfill_timelines
+
+
+class Command(BaseCommand):
+    """rebuild the news feed timelines of some or all profiles from the messages already posted"""
+    help = "Rebuild the news feed timelines of the given profiles, or of every profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_ids', nargs='*', type=int,
+                            help='profiles to rebuild (default: every profile)')
+        parser.add_argument('--limit', type=int, default=FEED_LIMIT,
+                            help='number of most recent messages written to each timeline')
+        parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE,
+                            help='number of timelines built per statement')
+
+    def handle(self, *args, **options):
+        if options['limit'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--limit and --batch-size must be positive integers')
+
+        profile_ids = options['profile_ids'] or Profile.objects.values_list('pk', flat=True)
+        profile_ids = list(profile_ids)
+
+        start = time.perf_counter()
+        written = backfill_timelines(Friend, StatusMessage, TimelineEntry, profile_ids,
+                                     limit=options['limit'], batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} timeline entries for {len(profile_ids)} profiles in {elapsed:.2f}s"
+        ))
@@ -0,0 +1,42 @@
+# refresh_friend_suggestions.py
+# management command that recomputes the precomputed mini_fb friend suggestions
+# friendships created or deleted through the ORM refresh the suggestions around them
+# on their own, so this is for rebuilding everything, e.g. from a periodic job after
+# friendships were bulk loaded, or for repairing a few profiles
+# usage: python manage.py refresh_friend_suggestions [profile_id ...] [--limit 50] [--batch-size 50]
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mini_fb.models import Friend, FriendSuggestion, Profile
+from mini_fb.suggestions import REFRESH_BATCH_SIZE, SUGGESTIONS_PER_PROFILE, refresh_suggestions
+
+
+class Command(BaseCommand):
+    """recompute the stored friend suggestions of some or all profiles"""
+    help = "Recompute the precomputed friend suggestions of the given profiles, or of every profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_ids', nargs='*', type=int,
+                            help='profiles to refresh (default: every profile)')
+        parser.add_argument('--limit', type=int, default=SUGGESTIONS_PER_PROFILE,
+                            help='number of suggestions kept per profile')
+        parser.add_argument('--batch-size', type=int, default=REFRESH_BATCH_SIZE,
+                            help='number of profiles recomputed per statement')
+
+    def handle(self, *args, **options):
+        if options['limit'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--limit and --batch-size must be positive integers')
+
+        profile_ids = options['profile_ids'] or Profile.objects.values_list('pk', flat=True)
+        profile_ids = list(profile_ids)
+
+        start = time.perf_counter()
+        stored = refresh_suggestions(Friend, FriendSuggestion, profile_ids,
+                                     limit=options['limit'], batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {stored} suggestions for {len(profile_ids)} profiles in {elapsed:.2f}s"
+        ))
@@ -0,0 +1,38 @@
+# Rewrites the existing friendships into the canonical form required by the
+# constraints added in 0008: one row per pair, lower profile id first, no self-friendships
+
+from django.db import migrations
+
+
+def canonicalize_friends(apps, schema_editor):
+    '''swap reversed friendships, and delete self-friendships and duplicates (keeping the oldest)'''
+    db_alias = schema_editor.connection.alias
+    friends = apps.get_model('mini_fb', 'Friend').objects.using(db_alias)
+
+    seen = set()
+    duplicates = []
+    reversed_rows = []
+    for friend in friends.order_by('timestamp', 'pk').only('pk', 'profile1_id', 'profile2_id'):
+        edge = tuple(sorted((friend.profile1_id, friend.profile2_id)))
+        if edge[0] == edge[1] or edge in seen:
+            duplicates.append(friend.pk)
+            continue
+        seen.add(edge)
+        if friend.profile1_id > friend.profile2_id:
+            friend.profile1_id, friend.profile2_id = edge
+            reversed_rows.append(friend)
+
+    for i in range(0, len(duplicates), 500):
+        friends.filter(pk__in=duplicates[i:i + 500]).delete()
+    friends.bulk_update(reversed_rows, ['profile1', 'profile2'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_fb', '0006_profile_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(canonicalize_friends, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_fb', '0007_canonical_friend_edges'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='friend',
+            constraint=models.CheckConstraint(check=models.Q(('profile1__lt', models.F('profile2'))), name='friend_ordered_edge'),
+        ),
+        migrations.AddConstraint(
+            model_name='friend',
+            constraint=models.UniqueConstraint(fields=('profile1', 'profile2'), name='friend_unique_edge'),
+        ),
+    ]
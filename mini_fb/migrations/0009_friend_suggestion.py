@@ -0,0 +1,70 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# a frozen copy of the query in mini_fb.suggestions as it was when the table was added,
+# so later changes to that module can't change what this migration does
+SUGGESTIONS_SQL = """
+    WITH friends AS (
+        SELECT profile1_id AS source, profile2_id AS id FROM mini_fb_friend WHERE profile1_id IN ({placeholders})
+        UNION ALL
+        SELECT profile2_id AS source, profile1_id AS id FROM mini_fb_friend WHERE profile2_id IN ({placeholders})
+    ),
+    friends_of_friends AS (
+        SELECT friends.source, edge.profile2_id AS id FROM friends JOIN mini_fb_friend AS edge ON edge.profile1_id = friends.id
+        UNION ALL
+        SELECT friends.source, edge.profile1_id AS id FROM friends JOIN mini_fb_friend AS edge ON edge.profile2_id = friends.id
+    ),
+    counted AS (
+        SELECT source, id, COUNT(*) AS mutual_friends
+        FROM friends_of_friends
+        WHERE id <> source
+          AND NOT EXISTS (SELECT 1 FROM friends AS own WHERE own.source = friends_of_friends.source AND own.id = friends_of_friends.id)
+        GROUP BY source, id
+    ),
+    ranked AS (
+        SELECT source, id, mutual_friends,
+               ROW_NUMBER() OVER (PARTITION BY source ORDER BY mutual_friends DESC, id) AS position
+        FROM counted
+    )
+    INSERT INTO mini_fb_friendsuggestion (profile_id, suggested_id, mutual_friends)
+    SELECT source, id, mutual_friends FROM ranked WHERE position <= 50
+"""
+
+
+def build_friend_suggestions(apps, schema_editor):
+    '''compute the suggestions of every profile that already has friends, 50 profiles per statement'''
+    Profile = apps.get_model('mini_fb', 'Profile')
+    profile_ids = list(Profile.objects.using(schema_editor.connection.alias).order_by('pk').values_list('pk', flat=True))
+    with schema_editor.connection.cursor() as cursor:
+        for start in range(0, len(profile_ids), 50):
+            batch = profile_ids[start:start + 50]
+            cursor.execute(SUGGESTIONS_SQL.format(placeholders=', '.join(['%s'] * len(batch))), batch + batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_fb', '0008_friend_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mutual_friends', models.IntegerField()),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friend_suggestions', to='mini_fb.profile')),
+                ('suggested', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='suggested_to', to='mini_fb.profile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['profile', '-mutual_friends', 'suggested'], name='friend_suggestion_rank_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='friendsuggestion',
+            constraint=models.UniqueConstraint(fields=('profile', 'suggested'), name='friend_suggestion_unique'),
+        ),
+        migrations.RunPython(build_friend_suggestions, migrations.RunPython.noop),
+    ]
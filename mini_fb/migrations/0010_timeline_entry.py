@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_fb', '0009_friend_suggestion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='statusmessage',
+            name='fanned_out',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='statusmessage',
+            index=models.Index(condition=models.Q(('fanned_out', False)), fields=['profile', '-timestamp'], name='statusmessage_pulled_idx'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to='mini_fb.profile'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='status_message',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='mini_fb.statusmessage'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['owner', '-timestamp'], name='timeline_owner_recent_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('owner', 'status_message'), name='timeline_entry_unique'),
+        ),
+    ]
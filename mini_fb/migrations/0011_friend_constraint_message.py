@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_fb', '0010_timeline_entry'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='friend',
+            name='friend_ordered_edge',
+        ),
+        migrations.AddConstraint(
+            model_name='friend',
+            constraint=models.CheckConstraint(check=models.Q(('profile1__lt', models.F('profile2'))), name='friend_ordered_edge', violation_error_message='A friendship must be between two different profiles.'),
+        ),
+    ]
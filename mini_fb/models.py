@@ -3,19 +3,26 @@
 # - StatusMessage: represents a user's posted status with a message and timestamp, and links to related images
 # - Image: represents an uploaded image associated with a profile, linked to status messages through a relationship model
 # - StatusImage: a relationship model linking images to specific status messages
-# - Friend: represents a friendship relationship between two profiles, with methods for adding and checking friendships
+# - Friend: represents a friendship relationship between two profiles, stored once as (lower id, higher id), with methods for adding and checking friendships
+# - TimelineEntry: a status message written to the news feed timeline of its author or one of the author's friends (see mini_fb/timeline.py)
+# - FriendSuggestion: a precomputed friend suggestion for a profile with its mutual friend count, kept up to date by mini_fb/suggestions.py
 
 # Functions:
 # - add_friend: adds a friendship between two profiles, ensuring no self-friendship or duplicate relationships
-# - get_friends: retrieves a list of friends for a given profile
-# - get_friend_suggestions: suggests potential friends based on mutual connections
-# - get_news_feed: retrieves status messages for a profile and its friends, sorted by most recent
+# - is_friends_with: checks whether two profiles are friends
+# - get_friends: retrieves the friends of a given profile as a QuerySet, in one query
+# - get_friend_suggestions: suggests potential friends based on mutual connections, ranked by mutual friend count in one query
+# - get_stored_friend_suggestions: reads the precomputed friend suggestions from the FriendSuggestion table with one indexed query
+# - get_news_feed: retrieves the most recent status messages of a profile and its friends, from its timeline when MINI_FB_TIMELINE is on
 
 from django.db import models
 from django.urls import reverse
 from django.core.exceptions import ValidationError
 from django.db.models import Q
 from django.contrib.auth.models import User 
+from itertools import chain
+
+from .timeline import FEED_LIMIT, timeline_enabled
 
 class Profile(models.Model):
     """Model representing a user profile with basic personal information"""
@@ -38,23 +45,28 @@ class Profile(models.Model):
         '''return the URl to display the profile that was just created'''
         return reverse('profile', kwargs={'pk':self.pk})
     
-    def get_friends(self):
-        """returns a list of friends associated with this profile"""
-        # query the Friend model for records where this profile is either profile1 or profile2
-        friends = Friend.objects.filter(
-            models.Q(profile1=self) | models.Q(profile2=self)
-        )
+    def get_friends(self, use_memo=True):
+        """
+        returns the profiles this profile is friends with, as a QuerySet
 
-        # create a list of friends profiles by checking both profile1 and profile2
-        friends_profiles = []
-        for friend in friends:
-            if friend.profile1 != self:
-                friends_profiles.append(friend.profile1)
-            if friend.profile2 != self:
-                friends_profiles.append(friend.profile2)
+        friendships are stored once, with the lower profile id as profile1, so the friends are
+        the profile2 side of the rows where this profile is profile1 plus the profile1 side of
+        the rows where it is profile2, selected with one query however many friends there are
+
+        the QuerySet is memoized on this instance, so a template that checks and then loops
+        over profile.get_friends during one request runs the query only once
+        """
+        if use_memo and '_friends_memo' in self.__dict__:
+            return self._friends_memo
+
+        friends = Profile.objects.filter(
+            Q(pk__in=Friend.objects.filter(profile1=self).values('profile2'))
+            | Q(pk__in=Friend.objects.filter(profile2=self).values('profile1'))
+        )
+        if use_memo:
+            self._friends_memo = friends
+        return friends
 
-        return friends_profiles
-    
     def add_friend(self, other):
         """
         adds a friend relationship between the current profile and another profile
@@ -67,50 +79,96 @@ class Profile(models.Model):
         if self == other:
             raise ValidationError("You can't friend yourself")
         
-        # check if a friend relation already exists b/t self and the other profile
-        if not Friend.objects.filter(
-            (Q(profile1=self) & Q(profile2=other)) | (Q(profile1=other) & Q(profile2=self))
-        ).exists():
-            Friend.objects.create(profile1=self, profile2=other)
+        # friendships are stored once, as (lower id, higher id), and the unique constraint
+        # on that pair makes get_or_create safe when two requests add the same friend at once
+        low, high = Friend.edge(self, other)
+        friend, created = Friend.objects.get_or_create(profile1_id=low, profile2_id=high)
+        if created:
+            # the memoized friends of either profile no longer include the new friend
+            self.__dict__.pop('_friends_memo', None)
+            other.__dict__.pop('_friends_memo', None)
         else:
             print("they are already friends")
 
+    def is_friends_with(self, other):
+        """returns True if this profile and other are friends, with one probe of the friendship index"""
+        low, high = Friend.edge(self, other)
+        return Friend.objects.filter(profile1_id=low, profile2_id=high).exists()
 
-    def get_friend_suggestions(self):
+    def get_friend_suggestions(self, limit=20, offset=0):
         """
-        returns friend suggestions as a QuerySet by finding friends of the current profile's friends who 
-        are not already friends with the current profile
-        """
-        # get a list of all profiles excluding the current one
-        all_profiles = Profile.objects.exclude(id=self.id)
-        
-        # get the list of profiles already friends with the current profile
-        friends = self.get_friends()
+        returns friend suggestions as a RawQuerySet of profiles: friends of the current profile's
+        friends who are not already friends with it, most mutual friends first
 
-        # get friends of friends by iterating over the current profile's friends
-        friends_of_friends = []
-        for friend in friends:
-            friends_of_friends.extend(friend.get_friends())
+        the whole second-degree network is walked in one query. friendships are stored once as
+        (lower id, higher id), so both directions are read with UNION ALL: first this profile's
+        friends, then the friendship table joined to them to reach their friends, each step
+        using the index on profile1 or profile2. each suggested profile has a mutual_friends
+        attribute with the number of friends in common
+        """
+        friend_table = Friend._meta.db_table
+        profile_table = Profile._meta.db_table
+        sql = f"""
+            WITH friends AS (
+                SELECT profile2_id AS id FROM {friend_table} WHERE profile1_id = %s
+                UNION ALL
+                SELECT profile1_id AS id FROM {friend_table} WHERE profile2_id = %s
+            ),
+            friends_of_friends AS (
+                SELECT edge.profile2_id AS id FROM friends JOIN {friend_table} AS edge ON edge.profile1_id = friends.id
+                UNION ALL
+                SELECT edge.profile1_id AS id FROM friends JOIN {friend_table} AS edge ON edge.profile2_id = friends.id
+            )
+            SELECT suggested.*, ranked.mutual_friends
+            FROM (
+                SELECT id, COUNT(*) AS mutual_friends
+                FROM friends_of_friends
+                WHERE id <> %s AND id NOT IN (SELECT id FROM friends)
+                GROUP BY id
+            ) AS ranked
+            JOIN {profile_table} AS suggested ON suggested.id = ranked.id
+            ORDER BY ranked.mutual_friends DESC, suggested.id
+            LIMIT %s OFFSET %s
+        """
+        return Profile.objects.raw(sql, [self.pk, self.pk, self.pk, limit, offset])
 
-        # filter out the current profile and existing friends from the friends of friends list
-        friend_suggestions = [profile for profile in friends_of_friends if profile != self and profile not in friends]
+    def get_stored_friend_suggestions(self, limit=20, offset=0):
+        """
+        returns the precomputed friend suggestions for this profile as a QuerySet of profiles,
+        most mutual friends first, each with a mutual_friends attribute like get_friend_suggestions
 
-        # return the non friends as friend suggestions
-        return Profile.objects.filter(id__in=[profile.id for profile in friend_suggestions])
+        only the top SUGGESTIONS_PER_PROFILE suggestions are stored, read with one range scan of
+        the (profile, -mutual_friends, suggested) index
+        """
+        return (
+            Profile.objects
+            .filter(suggested_to__profile=self)
+            .annotate(mutual_friends=models.F('suggested_to__mutual_friends'))
+            .order_by('-mutual_friends', 'pk')
+        )[offset:offset + limit]
     
-    def get_news_feed(self):
+    def get_news_feed(self, limit=FEED_LIMIT):
         """
-        returns a list of StatusMessages as a QuerySet for the current profile and all of its friends sorted by the most recent
+        returns a list of the limit most recent StatusMessages of the current profile and all of its friends,
+        most recent first, with their profiles and images loaded
+
+        with MINI_FB_TIMELINE on, the messages that were fanned out are read from this profile's timeline
+        with one range scan of the (owner, -timestamp) index, and the messages of friends with too many
+        friends to fan out to are pulled from those friends, then both are merged
         """
-        # get StatusMessages for the current profile
-        profile_messages = StatusMessage.objects.filter(profile=self).order_by('-timestamp')
+        messages = (StatusMessage.objects.select_related('profile').prefetch_related('status_images__image')
+                    .order_by('-timestamp', '-pk'))
 
-        # get StatusMessages for all friends of the current profile
-        friends = self.get_friends()
-        friend_messages = StatusMessage.objects.filter(profile__in=friends).order_by('-timestamp')
+        if not timeline_enabled():
+            # get StatusMessages for the current profile and all friends of the current profile
+            return list(messages.filter(Q(profile=self) | Q(profile__in=self.get_friends()))[:limit])
 
-        # combine both sets of messages (profile + friends) and return them ordered by when they were created
-        return profile_messages | friend_messages
+        pushed = messages.filter(timeline_entries__owner=self).order_by('-timeline_entries__timestamp', '-pk')[:limit]
+        pulled = messages.filter(fanned_out=False, profile__in=self.get_friends())[:limit]
+
+        # combine both sets of messages and return the most recent ones
+        feed = sorted(chain(pushed, pulled), key=lambda message: (message.timestamp, message.pk), reverse=True)
+        return feed[:limit]
 
 
 
@@ -119,9 +177,19 @@ class StatusMessage(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True) # timestamp of message creation
     message = models.TextField()    # the actual status emssage content
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="status_messages")  # link the status message to the associated profile
+    fanned_out = models.BooleanField(default=True)  # False when the message is pulled into friends' news feeds instead of written to their timelines
+
+    class Meta:
+        indexes = [
+            # the messages pulled into news feeds at read time, see mini_fb/timeline.py
+            models.Index(fields=['profile', '-timestamp'], condition=Q(fanned_out=False), name='statusmessage_pulled_idx'),
+        ]
 
     def get_images(self):
         '''returns all of the images associated with the status message'''
+        if 'status_images' in getattr(self, '_prefetched_objects_cache', {}):
+            # the images were loaded along with the message, e.g. by Profile.get_news_feed
+            return [status_image.image for status_image in self.status_images.all()]
         return Image.objects.filter(status_images__status_message=self)
 
 
@@ -150,10 +218,97 @@ class StatusImage(models.Model):
 
 
 class Friend(models.Model):
-    '''model representing the relationship between 2 profiles'''
+    '''
+    model representing the relationship between 2 profiles
+
+    each friendship is stored as one row with the lower profile id as profile1 and the
+    higher one as profile2, so checking a friendship is one probe of the unique index
+    '''
     profile1 = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="profile1")
     profile2 = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="profile2")
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=Q(profile1__lt=models.F('profile2')), name='friend_ordered_edge',
+                violation_error_message="A friendship must be between two different profiles.",
+            ),
+            models.UniqueConstraint(fields=['profile1', 'profile2'], name='friend_unique_edge'),
+        ]
+
+    @staticmethod
+    def edge(profile, other):
+        '''return the (profile1_id, profile2_id) pair a friendship between two profiles is stored as'''
+        return tuple(sorted((profile.pk, other.pk)))
+
+    def _order_profiles(self):
+        '''put the profiles in their canonical direction, lower profile id first'''
+        if self.profile1_id is not None and self.profile2_id is not None and self.profile1_id > self.profile2_id:
+            self.profile1, self.profile2 = self.profile2, self.profile1
+
+    def clean(self):
+        '''
+        reject self-friendships and order the profiles before validation
+
+        full_clean (used by the admin and model forms) runs clean before it validates the
+        constraints, so a friendship entered as (higher id, lower id) passes friend_ordered_edge
+        '''
+        if self.profile1_id is not None and self.profile1_id == self.profile2_id:
+            raise ValidationError("You can't friend yourself")
+        self._order_profiles()
+
+    def save(self, *args, **kwargs):
+        '''store the friendship in its canonical direction, also when it wasn't validated first'''
+        self._order_profiles()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.profile1.first_name} {self.profile1.last_name} is friends with {self.profile2.first_name} {self.profile2.last_name}"
+
+
+class TimelineEntry(models.Model):
+    '''
+    model representing a status message in the news feed timeline of one profile (the owner):
+    the message's author or one of the author's friends
+
+    the timestamp is copied from the message so a news feed is read from the (owner, -timestamp)
+    index alone. the rows are written by mini_fb/timeline.py
+    '''
+    owner = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="timeline")
+    status_message = models.ForeignKey(StatusMessage, on_delete=models.CASCADE, related_name="timeline_entries")
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'status_message'], name='timeline_entry_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-timestamp'], name='timeline_owner_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"Status {self.status_message_id} in the timeline of {self.owner}"
+
+
+class FriendSuggestion(models.Model):
+    '''
+    model representing a precomputed friend suggestion: a friend of one of profile's friends
+    who isn't its friend yet, with the number of friends they have in common
+
+    the rows are written by mini_fb/suggestions.py, never edited one at a time
+    '''
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="friend_suggestions")
+    suggested = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="suggested_to")
+    mutual_friends = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'suggested'], name='friend_suggestion_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['profile', '-mutual_friends', 'suggested'], name='friend_suggestion_rank_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.profile1.first_name} {self.profile1.last_name} is friends with {self.profile2.first_name} {self.profile2.last_name}"
\ No newline at end of file
+        return f"{self.suggested} suggested to {self.profile} ({self.mutual_friends} mutual friends)"
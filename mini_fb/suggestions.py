@@ -0,0 +1,125 @@
+# suggestions.py
+# precomputed friend suggestions for mini_fb
+# the top SUGGESTIONS_PER_PROFILE friends-of-friends of every profile are stored in the
+# FriendSuggestion table with their mutual friend counts, so the suggestions page is
+# one indexed read instead of a walk over the second-degree network
+# adding or removing a friendship only changes the suggestions of the two profiles
+# involved and of their friends, so only those are recomputed, once the transaction
+# commits. refresh_friend_suggestions (the management command) rebuilds every profile
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+
+# number of suggestions kept for each profile
+SUGGESTIONS_PER_PROFILE = 50
+
+# number of profiles recomputed per statement; small batches keep the temporary
+# b-trees used for counting and ranking small
+REFRESH_BATCH_SIZE = 50
+
+def affected_profiles(friend_model, profile_ids):
+    '''
+    return the ids of profile_ids and of all their friends: the profiles whose
+    suggestions change when a friendship between profiles in profile_ids changes
+    '''
+    profile_ids = set(profile_ids)
+    edges = friend_model.objects.filter(Q(profile1__in=profile_ids) | Q(profile2__in=profile_ids))
+    for profile1_id, profile2_id in edges.values_list('profile1', 'profile2').iterator():
+        profile_ids.add(profile1_id)
+        profile_ids.add(profile2_id)
+    return profile_ids
+
+def suggestions_sql(friend_model, suggestion_model, source_count, limit):
+    '''
+    return an INSERT statement storing the top limit suggestions of source_count profiles,
+    whose ids are passed as parameters twice (once per friendship direction)
+
+    it is the query behind Profile.get_friend_suggestions run for many profiles at once:
+    the friends of each source, their friends in turn, minus the source and its own
+    friends, counted and ranked per source
+    '''
+    friend_table = friend_model._meta.db_table
+    suggestion_table = suggestion_model._meta.db_table
+    placeholders = ', '.join(['%s'] * source_count)
+    return f"""
+        WITH friends AS (
+            SELECT profile1_id AS source, profile2_id AS id FROM {friend_table} WHERE profile1_id IN ({placeholders})
+            UNION ALL
+            SELECT profile2_id AS source, profile1_id AS id FROM {friend_table} WHERE profile2_id IN ({placeholders})
+        ),
+        friends_of_friends AS (
+            SELECT friends.source, edge.profile2_id AS id FROM friends JOIN {friend_table} AS edge ON edge.profile1_id = friends.id
+            UNION ALL
+            SELECT friends.source, edge.profile1_id AS id FROM friends JOIN {friend_table} AS edge ON edge.profile2_id = friends.id
+        ),
+        counted AS (
+            SELECT source, id, COUNT(*) AS mutual_friends
+            FROM friends_of_friends
+            WHERE id <> source
+              AND NOT EXISTS (SELECT 1 FROM friends AS own WHERE own.source = friends_of_friends.source AND own.id = friends_of_friends.id)
+            GROUP BY source, id
+        ),
+        ranked AS (
+            SELECT source, id, mutual_friends,
+                   ROW_NUMBER() OVER (PARTITION BY source ORDER BY mutual_friends DESC, id) AS position
+            FROM counted
+        )
+        INSERT INTO {suggestion_table} (profile_id, suggested_id, mutual_friends)
+        SELECT source, id, mutual_friends FROM ranked WHERE position <= {int(limit)}
+    """
+
+def rebuild_rows(model, key_field, keys, insert_sql, batch_size):
+    '''
+    replace the rows of model whose key_field is one of keys, batch_size keys at a time:
+    delete them, run the INSERT ... SELECT returned by insert_sql(batch) as (sql, params)
+    to write them again, and return the number of rows written, all in one transaction
+
+    shared by refresh_suggestions and timeline.backfill_timelines
+    '''
+    keys = sorted(keys)
+    using = router.db_for_write(model)
+    rows = model.objects.using(using)
+    written = 0
+    with transaction.atomic(using=using):
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            rows.filter(**{f'{key_field}__in': batch}).delete()
+            with connections[using].cursor() as cursor:
+                cursor.execute(*insert_sql(batch))
+            # sqlite doesn't report a row count for an INSERT with a WITH clause
+            written += rows.filter(**{f'{key_field}__in': batch}).count()
+    return written
+
+def refresh_suggestions(friend_model, suggestion_model, profile_ids, limit=SUGGESTIONS_PER_PROFILE,
+                        batch_size=REFRESH_BATCH_SIZE):
+    '''
+    replace the stored suggestions of profile_ids with freshly computed ones, batch_size
+    profiles per statement, and return the number of suggestions stored
+    '''
+    def insert_sql(batch):
+        return suggestions_sql(friend_model, suggestion_model, len(batch), limit), batch + batch
+
+    return rebuild_rows(suggestion_model, 'profile', profile_ids, insert_sql, batch_size)
+
+def track_friend_suggestions(friend_model, suggestion_model):
+    '''
+    recompute the suggestions around a friendship whenever one is created or deleted,
+    after the surrounding transaction commits
+
+    bulk_create and QuerySet.update() don't send these signals, so code writing
+    friendships that way has to call refresh_suggestions itself
+    '''
+    def refresh(instance, **kwargs):
+        ids = (instance.profile1_id, instance.profile2_id)
+        transaction.on_commit(
+            lambda: refresh_suggestions(friend_model, suggestion_model, affected_profiles(friend_model, ids))
+        )
+
+    def refresh_created(instance, created, raw=False, **kwargs):
+        # fixtures are loaded raw, and existing friendships that are saved again don't change anything
+        if created and not raw:
+            refresh(instance)
+
+    post_save.connect(refresh_created, sender=friend_model, weak=False, dispatch_uid='friend_suggestions:save')
+    post_delete.connect(refresh, sender=friend_model, weak=False, dispatch_uid='friend_suggestions:delete')
@@ -1,3 +1,206 @@
-from django.test import TestCase
+# tests.py for Mini FB
+# - FriendValidationTests: friendships entered through model forms (and so the admin) are stored in canonical order
+# - FriendListTests: get_friends runs one query however many friends, and its memo follows add_friend
+# - FriendSuggestionTests: the precomputed suggestions stay equal to the live query as friendships change
+# - NewsFeedTests: fan-out, pull and hybrid news feeds return the same ordered messages
 
-# Create your tests here.
+import io
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.forms import modelform_factory
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Friend, FriendSuggestion, Profile, StatusMessage, TimelineEntry
+from .suggestions import refresh_suggestions
+from .timeline import backfill_timelines
+
+
+def make_profiles(count):
+    '''create count profiles, each with its own user'''
+    profiles = []
+    for i in range(count):
+        user = User.objects.create(username=f'user{i}')
+        profiles.append(Profile.objects.create(first_name=f'First{i}', last_name='Last', city='Boston',
+                                               email=f'user{i}@example.com', image_file='profile.jpg', user=user))
+    return profiles
+
+
+class FriendValidationTests(TestCase):
+    '''friendships validated with full_clean, as the admin and model forms do'''
+
+    def setUp(self):
+        self.low, self.high = make_profiles(2)
+        self.FriendForm = modelform_factory(Friend, fields=['profile1', 'profile2'])
+
+    def test_reversed_pair_is_stored_in_canonical_order(self):
+        form = self.FriendForm(data={'profile1': self.high.pk, 'profile2': self.low.pk})
+        self.assertTrue(form.is_valid(), form.errors)
+        friend = form.save()
+        self.assertEqual((friend.profile1_id, friend.profile2_id), (self.low.pk, self.high.pk))
+
+    def test_self_friendship_has_a_readable_error(self):
+        form = self.FriendForm(data={'profile1': self.low.pk, 'profile2': self.low.pk})
+        self.assertFalse(form.is_valid())
+        self.assertIn("You can't friend yourself", form.non_field_errors())
+
+    def test_duplicate_pair_in_either_order_is_rejected(self):
+        Friend.objects.create(profile1=self.low, profile2=self.high)
+        form = self.FriendForm(data={'profile1': self.high.pk, 'profile2': self.low.pk})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(Friend.objects.count(), 1)
+
+
+class FriendListTests(TestCase):
+    '''Profile.get_friends and the profile page listing the friends'''
+
+    def setUp(self):
+        self.profiles = make_profiles(12)
+        self.profile = self.profiles[5]
+
+    def page_queries(self):
+        '''return the number of queries run by self.profile's page'''
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile', args=[self.profile.pk]))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_profile_page_queries_do_not_grow_with_friends(self):
+        # friends on both sides of the canonical (lower id, higher id) pair
+        self.profile.add_friend(self.profiles[0])
+        self.profile.add_friend(self.profiles[11])
+        few = self.page_queries()
+        for other in self.profiles[1:11]:
+            if other != self.profile:
+                self.profile.add_friend(other)
+        response = self.client.get(reverse('profile', args=[self.profile.pk]))
+        self.assertEqual(self.page_queries(), few)
+        for other in self.profiles:
+            if other != self.profile:
+                self.assertContains(response, other.first_name)
+
+    def test_get_friends_is_one_query(self):
+        for other in self.profiles[:5] + self.profiles[6:]:
+            self.profile.add_friend(other)
+        profile = Profile.objects.get(pk=self.profile.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(profile.get_friends()), 11)
+            # the template checks and then loops over the memoized queryset
+            self.assertTrue(profile.get_friends())
+            list(profile.get_friends())
+
+    def test_add_friend_drops_the_memo(self):
+        other = self.profiles[8]
+        self.assertEqual(list(self.profile.get_friends()), [])
+        self.assertEqual(list(other.get_friends()), [])
+        self.profile.add_friend(other)
+        self.assertEqual(list(self.profile.get_friends()), [other])
+        self.assertEqual(list(other.get_friends()), [self.profile])
+        with self.assertNumQueries(0):
+            self.assertEqual(list(self.profile.get_friends()), [other])
+        # adding an existing friend keeps the memo
+        self.profile.add_friend(other)
+        with self.assertNumQueries(0):
+            list(self.profile.get_friends())
+
+
+class FriendSuggestionTests(TestCase):
+    '''the FriendSuggestion table against Profile.get_friend_suggestions'''
+
+    def setUp(self):
+        self.profiles = make_profiles(12)
+        # a ring, so everyone has two friends and several friends of friends
+        for a, b in zip(self.profiles, self.profiles[1:] + self.profiles[:1]):
+            Friend.objects.create(profile1=a, profile2=b)
+        refresh_suggestions(Friend, FriendSuggestion, [p.pk for p in self.profiles])
+
+    def assertSuggestionsMatch(self):
+        for profile in self.profiles:
+            live = [(p.pk, p.mutual_friends) for p in profile.get_friend_suggestions(limit=50)]
+            stored = [(p.pk, p.mutual_friends) for p in profile.get_stored_friend_suggestions(limit=50)]
+            self.assertEqual(stored, live, profile)
+
+    def test_refresh_matches_live_query(self):
+        self.assertTrue(FriendSuggestion.objects.exists())
+        self.assertSuggestionsMatch()
+
+    def test_adding_and_removing_friends_refreshes_neighbourhoods(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profiles[0].add_friend(self.profiles[6])
+            self.profiles[3].add_friend(self.profiles[9])
+        self.assertSuggestionsMatch()
+        with self.captureOnCommitCallbacks(execute=True):
+            Friend.objects.get(profile1=self.profiles[0], profile2=self.profiles[1]).delete()
+        self.assertSuggestionsMatch()
+
+
+class NewsFeedTests(TestCase):
+    '''
+    Profile.get_news_feed read from the timelines (MINI_FB_TIMELINE on) against the
+    pull query over all friends (off), which is the reference
+    '''
+
+    def setUp(self):
+        self.profiles = make_profiles(8)
+        self.hub = self.profiles[0]
+        # the hub is friends with everyone, the others with their neighbours too
+        for other in self.profiles[1:]:
+            self.hub.add_friend(other)
+        for a, b in zip(self.profiles[1:], self.profiles[2:]):
+            a.add_friend(b)
+
+    def post_messages(self, rounds=4):
+        '''post rounds messages from every profile, interleaved'''
+        for i in range(rounds):
+            for profile in self.profiles:
+                StatusMessage.objects.create(profile=profile, message=f'{profile.first_name} {i}')
+
+    def feeds(self, timeline, limit=10):
+        '''return every profile's news feed as a list of message ids'''
+        with self.settings(MINI_FB_TIMELINE=timeline):
+            return {profile.pk: [message.pk for message in profile.get_news_feed(limit=limit)]
+                    for profile in self.profiles}
+
+    def assertFeedsMatch(self):
+        for limit in (5, 50):
+            self.assertEqual(self.feeds(True, limit), self.feeds(False, limit))
+
+    @override_settings(MINI_FB_TIMELINE=True, MINI_FB_FANOUT_FRIEND_LIMIT=100)
+    def test_fan_out_feed_matches_pull_feed(self):
+        self.post_messages()
+        self.assertFalse(StatusMessage.objects.filter(fanned_out=False).exists())
+        self.assertFeedsMatch()
+
+    @override_settings(MINI_FB_TIMELINE=True, MINI_FB_FANOUT_FRIEND_LIMIT=3)
+    def test_hybrid_feed_matches_pull_feed(self):
+        self.post_messages()
+        # only the hub has more friends than the limit, so only its messages are pulled
+        pulled = StatusMessage.objects.filter(fanned_out=False)
+        self.assertEqual(set(pulled.values_list('profile', flat=True)), {self.hub.pk})
+        self.assertFalse(TimelineEntry.objects.filter(status_message__in=pulled).exclude(owner=self.hub).exists())
+        self.assertFeedsMatch()
+
+    @override_settings(MINI_FB_TIMELINE=True, MINI_FB_FANOUT_FRIEND_LIMIT=3)
+    def test_friendship_changes_update_the_timelines(self):
+        self.post_messages()
+        self.profiles[1].add_friend(self.profiles[5])
+        Friend.objects.get(profile1=self.profiles[2], profile2=self.profiles[3]).delete()
+        self.assertFeedsMatch()
+
+    @override_settings(MINI_FB_FANOUT_FRIEND_LIMIT=3)
+    def test_backfill_after_posting_with_the_timeline_off(self):
+        self.post_messages()
+        self.assertFalse(TimelineEntry.objects.exists())
+        backfill_timelines(Friend, StatusMessage, TimelineEntry, [profile.pk for profile in self.profiles])
+        self.assertFeedsMatch()
+
+    @override_settings(MINI_FB_FANOUT_FRIEND_LIMIT=3)
+    def test_backfill_command_when_turning_the_timeline_on(self):
+        # the migration leaves the timelines empty; the command fills them
+        self.post_messages()
+        call_command('backfill_timelines', stdout=io.StringIO())
+        self.assertTrue(StatusMessage.objects.filter(fanned_out=False).exists())
+        self.assertFeedsMatch()
@@ -0,0 +1,157 @@
+# timeline.py
+# fan-out-on-write news feeds for mini_fb
+# when MINI_FB_TIMELINE is on, every new status message is written to a TimelineEntry
+# row for its author and for each of the author's friends, so a news feed is one range
+# scan of the (owner, -timestamp) index instead of a query over all of a profile's friends
+# hybrid mode: an author with more than MINI_FB_FANOUT_FRIEND_LIMIT friends would write
+# that many rows per message, so their messages are only written to their own timeline
+# and marked fanned_out=False; their friends' feeds pull those messages at read time
+# friendships that are created or deleted copy or remove the two profiles' recent
+# messages between their timelines. the backfill_timelines management command builds
+# the timelines of messages that were posted before any of this, and has to be run
+# when MINI_FB_TIMELINE is turned on
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Count, Q
+from django.db.models.signals import post_delete, post_save
+
+from .suggestions import rebuild_rows
+
+# defaults for the settings read by the timeline
+DEFAULT_FANOUT_FRIEND_LIMIT = 1000
+
+# number of messages shown in a news feed, and copied into a timeline by a backfill
+# or a new friendship
+FEED_LIMIT = 50
+
+# number of timelines built per statement by a backfill
+BACKFILL_BATCH_SIZE = 50
+
+def timeline_enabled():
+    '''return True when news feeds are written to and read from the timeline table'''
+    return getattr(settings, 'MINI_FB_TIMELINE', False)
+
+def fanout_friend_limit():
+    '''return the number of friends above which an author's messages are pulled instead of fanned out'''
+    return getattr(settings, 'MINI_FB_FANOUT_FRIEND_LIMIT', DEFAULT_FANOUT_FRIEND_LIMIT)
+
+def friend_ids(friend_model, profile_id):
+    '''return the ids of profile_id's friends'''
+    edges = friend_model.objects.filter(Q(profile1=profile_id) | Q(profile2=profile_id))
+    return [profile2_id if profile1_id == profile_id else profile1_id
+            for profile1_id, profile2_id in edges.values_list('profile1', 'profile2')]
+
+def friend_counts(friend_model, profile_ids):
+    '''return a dict of the number of friends of each of profile_ids that has any'''
+    counts = {}
+    for field in ('profile1', 'profile2'):
+        rows = (friend_model.objects.filter(**{f'{field}__in': profile_ids})
+                .values_list(field).annotate(friends=Count('pk')).order_by())
+        for profile_id, friends in rows:
+            counts[profile_id] = counts.get(profile_id, 0) + friends
+    return counts
+
+def fan_out(message_model, entry_model, friend_model, message):
+    '''
+    write message to its author's timeline and, unless the author has more than the
+    fan-out limit of friends, to each friend's timeline as well
+    '''
+    owners = friend_ids(friend_model, message.profile_id)
+    if len(owners) > fanout_friend_limit():
+        message_model.objects.filter(pk=message.pk).update(fanned_out=False)
+        message.fanned_out = False
+        owners = []
+    owners.append(message.profile_id)
+    entry_model.objects.bulk_create(
+        [entry_model(owner_id=owner, status_message=message, timestamp=message.timestamp) for owner in owners],
+        ignore_conflicts=True,
+    )
+
+def share_recent_messages(message_model, entry_model, author_id, owner_id, limit=FEED_LIMIT):
+    '''copy author_id's limit most recent fanned-out messages into owner_id's timeline'''
+    messages = (message_model.objects.filter(profile=author_id, fanned_out=True)
+                .order_by('-timestamp', '-pk').values_list('pk', 'timestamp')[:limit])
+    entry_model.objects.bulk_create(
+        [entry_model(owner_id=owner_id, status_message_id=pk, timestamp=timestamp) for pk, timestamp in messages],
+        ignore_conflicts=True,
+    )
+
+def backfill_sql(friend_model, message_model, entry_model, owner_count, limit):
+    '''
+    return an INSERT statement writing the timelines of owner_count profiles, whose ids
+    are passed as parameters three times: each owner's own messages and its friends'
+    fanned-out ones, the limit most recent per owner
+    '''
+    profile_table = friend_model._meta.get_field('profile1').related_model._meta.db_table
+    friend_table = friend_model._meta.db_table
+    message_table = message_model._meta.db_table
+    entry_table = entry_model._meta.db_table
+    placeholders = ', '.join(['%s'] * owner_count)
+    return f"""
+        WITH authors AS (
+            SELECT id AS owner, id AS author FROM {profile_table} WHERE id IN ({placeholders})
+            UNION ALL
+            SELECT profile1_id AS owner, profile2_id AS author FROM {friend_table} WHERE profile1_id IN ({placeholders})
+            UNION ALL
+            SELECT profile2_id AS owner, profile1_id AS author FROM {friend_table} WHERE profile2_id IN ({placeholders})
+        ),
+        feed AS (
+            SELECT authors.owner, message.id, message.timestamp,
+                   ROW_NUMBER() OVER (PARTITION BY authors.owner ORDER BY message.timestamp DESC, message.id DESC) AS position
+            FROM authors JOIN {message_table} AS message ON message.profile_id = authors.author
+            WHERE message.fanned_out OR authors.author = authors.owner
+        )
+        INSERT INTO {entry_table} (owner_id, status_message_id, timestamp)
+        SELECT owner, id, timestamp FROM feed WHERE position <= {int(limit)}
+    """
+
+def backfill_timelines(friend_model, message_model, entry_model, profile_ids, limit=FEED_LIMIT,
+                       batch_size=BACKFILL_BATCH_SIZE):
+    '''
+    rebuild the timelines of profile_ids from the messages already posted, batch_size
+    profiles per statement, and return the number of entries written
+
+    the messages of authors in profile_ids are first marked fanned out or not by their
+    current number of friends
+    '''
+    with transaction.atomic(using=router.db_for_write(entry_model)):
+        counts = friend_counts(friend_model, profile_ids)
+        pulled = [profile_id for profile_id, friends in counts.items() if friends > fanout_friend_limit()]
+        message_model.objects.filter(profile__in=profile_ids).update(fanned_out=True)
+        message_model.objects.filter(profile__in=pulled).update(fanned_out=False)
+
+        def insert_sql(batch):
+            return backfill_sql(friend_model, message_model, entry_model, len(batch), limit), batch * 3
+
+        return rebuild_rows(entry_model, 'owner', profile_ids, insert_sql, batch_size)
+
+def track_timelines(friend_model, message_model, entry_model):
+    '''
+    fan new status messages out to the timelines, and copy or remove messages between
+    two profiles' timelines when their friendship is created or deleted, in the same
+    transaction as the change, while MINI_FB_TIMELINE is on
+
+    deleted messages and profiles take their timeline entries with them (on_delete=CASCADE).
+    bulk_create doesn't send these signals, so code writing messages or friendships
+    that way has to call backfill_timelines itself
+    '''
+    def message_created(instance, created, raw=False, **kwargs):
+        if created and not raw and timeline_enabled():
+            fan_out(message_model, entry_model, friend_model, instance)
+
+    def friendship_created(instance, created, raw=False, **kwargs):
+        if created and not raw and timeline_enabled():
+            share_recent_messages(message_model, entry_model, instance.profile1_id, instance.profile2_id)
+            share_recent_messages(message_model, entry_model, instance.profile2_id, instance.profile1_id)
+
+    def friendship_deleted(instance, **kwargs):
+        if timeline_enabled():
+            entry_model.objects.filter(
+                Q(owner=instance.profile1_id, status_message__profile=instance.profile2_id)
+                | Q(owner=instance.profile2_id, status_message__profile=instance.profile1_id)
+            ).delete()
+
+    post_save.connect(message_created, sender=message_model, weak=False, dispatch_uid='timeline:message')
+    post_save.connect(friendship_created, sender=friend_model, weak=False, dispatch_uid='timeline:friend_save')
+    post_delete.connect(friendship_deleted, sender=friend_model, weak=False, dispatch_uid='timeline:friend_delete')
@@ -200,11 +200,13 @@ class ShowFriendSuggestionsView(BaseView, LoginRequiredMixin, DetailView):
     
     This view fetches and displays a list of suggested friends for the profile 
     based on the profile's current friends and their connections. The suggestions
-    are generated by a method in the Profile model called get_friend_suggestions
+    are precomputed into the FriendSuggestion table and read with the Profile
+    method get_stored_friend_suggestions
     """
     model = Profile
     template_name = 'mini_fb/friend_suggestions.html'
     context_object_name = 'profile'
+    suggestions_per_page = 20   # show 20 suggestions per page
 
     def get_login_url(self) -> str:
         return reverse('login')
@@ -219,9 +221,18 @@ class ShowFriendSuggestionsView(BaseView, LoginRequiredMixin, DetailView):
         # Get the profile instance
         context = super().get_context_data(**kwargs)
         
-        # Get the friend suggestions for the current profile
-        profile = self.get_object()
-        context['friend_suggestions'] = profile.get_friend_suggestions()
+        # Get one page of friend suggestions for the current profile, ranked by mutual friends;
+        # one extra suggestion is fetched to know whether there is a next page
+        try:
+            page = max(int(self.request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        offset = (page - 1) * self.suggestions_per_page
+        suggestions = list(self.object.get_stored_friend_suggestions(limit=self.suggestions_per_page + 1, offset=offset))
+
+        context['friend_suggestions'] = suggestions[:self.suggestions_per_page]
+        context['previous_page'] = page - 1 if page > 1 else None
+        context['next_page'] = page + 1 if len(suggestions) > self.suggestions_per_page else None
         
         return context
     
@@ -234,7 +245,7 @@ class ShowNewsFeedView(BaseView, LoginRequiredMixin, DetailView):
     Displays the news feed for a given profile
     
     The news feed consists of the status messages from the profile and its friends
-    The status messages are fetched using the get_news_feed method in the Profile model
+    The most recent status messages are fetched using the get_news_feed method in the Profile model
     """
     model = Profile
     template_name = 'mini_fb/news_feed.html'
@@ -251,10 +262,9 @@ class ShowNewsFeedView(BaseView, LoginRequiredMixin, DetailView):
         added to the context for rendering in the template
         """
         context = super().get_context_data(**kwargs)
-        profile = self.get_object()  # get the profile object
 
-        # get the news feed for the profile
-        context['news_feed'] = profile.get_news_feed()
+        # get the most recent messages of the news feed for the profile
+        context['news_feed'] = self.object.get_news_feed()
         return context
 
 
@@ -2,6 +2,8 @@ from django.shortcuts import render
 from django.http import HttpRequest, HttpResponse
 import random
 
+from cs412.versioning import UNVERSIONED_PAGE_TIMEOUT, versioned_cache_page
+
 
 
 # lists for quotes and images
@@ -41,8 +43,9 @@ def quote(request):
     }
     return render(request, template_name, context)
 
+@versioned_cache_page('quotes', timeout=UNVERSIONED_PAGE_TIMEOUT)
 def show_all(request):
-    """display all quotes and images"""
+    """display all quotes and images, cached for an hour since the lists only change with the code"""
     
     template_name = "quotes/show_all.html"
     
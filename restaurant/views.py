@@ -16,9 +16,12 @@ import random
 from django.shortcuts import render
 from datetime import datetime, timedelta
 
+from cs412.versioning import UNVERSIONED_PAGE_TIMEOUT, versioned_cache_page
 
+
+@versioned_cache_page('restaurant', timeout=UNVERSIONED_PAGE_TIMEOUT)
 def main(request):
-    """display information about the restaurant"""
+    """display information about the restaurant, cached for an hour since it only changes with the code"""
     template_name = "restaurant/main.html"
     return render(request, template_name)
 
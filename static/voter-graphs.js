@@ -0,0 +1,74 @@
+// voter-graphs.js
+// draws the voter analytics charts in the browser from the aggregated series
+// returned by the graphs data endpoint, instead of shipping rendered plotly html
+
+function showNoData(element) {
+    element.innerHTML = '<p>No data available.</p>';
+}
+
+function drawVoterGraphs(data) {
+    // voter distribution by year of birth (bar chart)
+    const birthYears = document.getElementById('birth-year-graph');
+    if (data.birth_years.labels.length) {
+        Plotly.newPlot(birthYears, [{type: 'bar', x: data.birth_years.labels, y: data.birth_years.counts}], {
+            title: 'Voter Distribution by Year of Birth',
+            xaxis: {title: 'Year of Birth'},
+            yaxis: {title: 'Count'}
+        });
+    } else {
+        showNoData(birthYears);
+    }
+
+    // voter distribution by party affiliation (pie chart)
+    const parties = document.getElementById('party-pie-chart');
+    if (data.parties.labels.length) {
+        Plotly.newPlot(parties, [{type: 'pie', labels: data.parties.labels, values: data.parties.counts}], {
+            title: 'Voter Distribution by Party Affiliation',
+            width: 900,
+            height: 700
+        });
+    } else {
+        showNoData(parties);
+    }
+
+    // voter participation in elections (histogram), one colored bar per election
+    const elections = document.getElementById('election-histogram');
+    if (data.elections.counts.some(count => count > 0)) {
+        Plotly.newPlot(elections, [{
+            type: 'bar',
+            x: data.elections.labels,
+            y: data.elections.counts,
+            text: data.elections.counts,
+            marker: {color: ['#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A']}
+        }], {
+            title: 'Voter Participation in Elections',
+            xaxis: {title: 'Election'},
+            yaxis: {title: 'Number of Voters'}
+        });
+    } else {
+        showNoData(elections);
+    }
+
+    // voters by age band and by voter score bucket, binned by the server
+    drawHistogram('age-band-histogram', data.age_bands, 'Voters by Age Band', 'Age');
+    drawHistogram('voter-score-histogram', data.voter_scores, 'Voters by Voter Score', 'Voter Score');
+}
+
+function drawHistogram(id, series, title, axisTitle) {
+    const element = document.getElementById(id);
+    if (series.labels.length) {
+        Plotly.newPlot(element, [{type: 'bar', x: series.labels, y: series.counts}], {
+            title: title,
+            xaxis: {title: axisTitle, type: 'category'},
+            yaxis: {title: 'Count'}
+        });
+    } else {
+        showNoData(element);
+    }
+}
+
+function loadVoterGraphs(url) {
+    fetch(url, {headers: {'Accept': 'application/json'}})
+        .then(response => response.json())
+        .then(drawVoterGraphs);
+}
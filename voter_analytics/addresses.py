@@ -0,0 +1,52 @@
+# addresses.py
+# normalization of voter street addresses into household keys
+# two voters live in the same household when their normalized street number,
+# street name, apartment and 5 digit zip code are equal, so differences in case,
+# spacing, punctuation, street suffix spelling and apartment prefixes don't split a household
+
+import re
+
+# common street suffix spellings, mapped to the usps abbreviations
+STREET_SUFFIXES = {
+    'AVENUE': 'AVE', 'AV': 'AVE',
+    'BOULEVARD': 'BLVD',
+    'CIRCLE': 'CIR',
+    'COURT': 'CT',
+    'DRIVE': 'DR',
+    'HIGHWAY': 'HWY',
+    'LANE': 'LN',
+    'PARKWAY': 'PKWY',
+    'PLACE': 'PL',
+    'ROAD': 'RD',
+    'SQUARE': 'SQ',
+    'STREET': 'ST', 'STR': 'ST',
+    'TERRACE': 'TER', 'TERR': 'TER',
+}
+
+# words that only label the apartment number, e.g. 'APT 2B', 'UNIT 2B' or '#2B'
+APARTMENT_LABELS = {'APT', 'APARTMENT', 'UNIT', 'STE', 'SUITE', 'NO'}
+
+def address_words(value):
+    '''split an address field into uppercase words, dropping punctuation'''
+    return re.findall(r'[A-Z0-9]+', (value or '').upper())
+
+def normalize_street_name(street_name):
+    '''uppercase the street name and abbreviate its suffix, e.g. 'Beacon Street.' -> 'BEACON ST' '''
+    words = address_words(street_name)
+    if words:
+        words[-1] = STREET_SUFFIXES.get(words[-1], words[-1])
+    return ' '.join(words)
+
+def normalize_apartment(apt_num):
+    '''drop apartment labels and leading zeros, e.g. 'Apt. #02b' -> '2B' '''
+    words = [word for word in address_words(apt_num) if word not in APARTMENT_LABELS]
+    return ''.join(words).lstrip('0') or ('0' if words else '')
+
+def address_key(street_num, street_name, apt_num, zip_code):
+    '''return the normalized household key for one voter's address'''
+    return '|'.join([
+        ''.join(address_words(street_num)).lstrip('0') or '0',
+        normalize_street_name(street_name),
+        normalize_apartment(apt_num),
+        ''.join(re.findall(r'\d', zip_code or ''))[:5],
+    ])
@@ -0,0 +1,284 @@
+# aggregates.py
+# database-side summaries of a Voter queryset used to build the voter charts
+# every function runs a single GROUP BY or conditional aggregate query, so only
+# the aggregated counts are sent back to python, never the individual voter rows
+# the functions accept either a Voter queryset or a VoterRollup queryset; with the
+# rollup, groups are counted by summing their precomputed number of voters
+
+import re
+from datetime import date
+
+from django.db.models import Case, Count, F, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, ExtractYear
+
+from .cache import get_or_compute, versioned_key
+from .models import Voter, VoterRollup
+
+# the election participation flags on Voter, in the order they are displayed
+ELECTIONS = ['v20state', 'v21town', 'v21primary', 'v22general', 'v23town']
+
+def voter_count(queryset, condition=None):
+    '''return an expression counting the voters in queryset, optionally only those matching condition'''
+    if queryset.model is VoterRollup:
+        return Coalesce(Sum('voters', filter=condition), 0)
+    return Count('id', filter=condition)
+
+def birth_year(queryset):
+    '''return an expression for the year of birth of the voters in queryset'''
+    if queryset.model is VoterRollup:
+        return F('birth_year')
+    return ExtractYear('dob')
+
+def birth_year_counts(queryset):
+    '''return a list of (year, count) pairs for the voters in queryset, sorted by year'''
+    rows = (queryset.order_by()
+            .annotate(year=birth_year(queryset))
+            .values('year')
+            .annotate(count=voter_count(queryset))
+            .order_by('year')
+            .values_list('year', 'count'))
+    return [(year, count) for year, count in rows if year is not None]
+
+def party_counts(queryset):
+    '''return a list of (party, count) pairs for the voters in queryset, largest party first'''
+    rows = (queryset.order_by()
+            .exclude(party='')
+            .values('party')
+            .annotate(count=voter_count(queryset))
+            .order_by('-count', 'party')
+            .values_list('party', 'count'))
+    return list(rows)
+
+def election_counts(queryset):
+    '''return a dict of election -> number of voters in queryset who voted in it, in one query'''
+    totals = queryset.aggregate(**{
+        election: voter_count(queryset, Q(**{election: True})) for election in ELECTIONS
+    })
+    return {election: totals[election] for election in ELECTIONS}
+
+# the fields that can be binned into a histogram, with their default bin widths
+HISTOGRAM_FIELDS = {'age': 10, 'voter_score': 1}
+
+# the query parameter choosing the bin width of each histogram field
+BIN_WIDTH_PARAMS = {'age': 'age_bin_width', 'voter_score': 'score_bin_width'}
+
+def parse_bin_width(value, default):
+    '''return value as a bin width between 1 and 100, or default if it isn't a number'''
+    try:
+        return min(max(int(value), 1), 100)
+    except (TypeError, ValueError):
+        return default
+
+def histogram_bins(params):
+    '''return a dict of histogram field -> bin width read from request parameters'''
+    return {
+        field: parse_bin_width(params.get(BIN_WIDTH_PARAMS[field]), default)
+        for field, default in HISTOGRAM_FIELDS.items()
+    }
+
+def histogram(queryset, field, bin_width):
+    '''
+    return a list of (bin start, count) pairs for the voters in queryset, sorted by bin
+
+    the values are binned by integer division inside the database, so only one row
+    per bin is returned. field is 'age' (from the birth year) or 'voter_score'
+    '''
+    if field not in HISTOGRAM_FIELDS:
+        raise ValueError(f'cannot build a histogram of {field!r}')
+
+    value = age(queryset) if field == 'age' else F('voter_score')
+    rows = (queryset.order_by()
+            .annotate(bin=bin_start(value, bin_width))
+            .values('bin')
+            .annotate(count=voter_count(queryset))
+            .order_by('bin')
+            .values_list('bin', 'count'))
+    return [(start, count) for start, count in rows if start is not None]
+
+def get_filter_metadata():
+    '''
+    return the values used to build the voter filter dropdowns:
+    the distinct parties, the min/max birth years and the list of years between them
+
+    the result only changes when the voter file is reloaded, so it is cached until
+    the loader bumps the data version
+    '''
+    return get_or_compute(versioned_key('filter_metadata'), _compute_filter_metadata)
+
+def _compute_filter_metadata():
+    '''run the (whole table) queries behind get_filter_metadata'''
+    parties = list(Voter.objects.order_by('party').values_list('party', flat=True).distinct())
+    dob_range = Voter.objects.aggregate(Min('dob'), Max('dob'))
+
+    if dob_range['dob__min'] is None:
+        # no voters loaded yet
+        return {'parties': parties, 'min_birth_year': None, 'max_birth_year': None, 'years': []}
+
+    min_birth_year = dob_range['dob__min'].year
+    max_birth_year = dob_range['dob__max'].year
+    return {
+        'parties': parties,
+        'min_birth_year': min_birth_year,
+        'max_birth_year': max_birth_year,
+        'years': list(range(min_birth_year, max_birth_year + 1)),
+    }
+
+def voter_score_total(queryset):
+    '''return an expression summing the voter scores of the voters in queryset'''
+    if queryset.model is VoterRollup:
+        return Coalesce(Sum(F('voter_score') * F('voters')), 0)
+    return Coalesce(Sum('voter_score'), 0)
+
+def precinct_sort_key(precinct_num):
+    '''sort precincts by ward number, then letter, so 2A comes before 10A'''
+    match = re.match(r'(\d*)(.*)', precinct_num)
+    return (int(match.group(1)) if match.group(1) else 0, match.group(2))
+
+def precinct_stats(queryset=None):
+    '''
+    return a list of per-precinct statistics, one dict per precinct with:
+    - registered: number of voters
+    - turnout: dict of election -> share of the precinct's voters who voted in it
+    - mean_voter_score: average voter score
+    - party_mix: list of (party, count, share), largest party first
+
+    everything comes from one query grouped by precinct and party, which the
+    precinct totals are then summed from. by default the VoterRollup table is used
+    '''
+    if queryset is None:
+        queryset = VoterRollup.objects.all()
+
+    rows = (queryset.order_by()
+            .values('precinct_num', 'party')
+            .annotate(
+                registered=voter_count(queryset),
+                score_total=voter_score_total(queryset),
+                **{f'{election}_votes': voter_count(queryset, Q(**{election: True})) for election in ELECTIONS}
+            ))
+
+    precincts = {}
+    for row in rows:
+        stats = precincts.setdefault(row['precinct_num'], {
+            'precinct_num': row['precinct_num'],
+            'registered': 0,
+            'score_total': 0,
+            'votes': dict.fromkeys(ELECTIONS, 0),
+            'parties': {},
+        })
+        stats['registered'] += row['registered']
+        stats['score_total'] += row['score_total']
+        for election in ELECTIONS:
+            stats['votes'][election] += row[f'{election}_votes']
+        stats['parties'][row['party']] = stats['parties'].get(row['party'], 0) + row['registered']
+
+    results = []
+    for precinct_num in sorted(precincts, key=precinct_sort_key):
+        stats = precincts[precinct_num]
+        registered = stats['registered']
+        results.append({
+            'precinct_num': precinct_num,
+            'registered': registered,
+            'turnout': {election: votes / registered for election, votes in stats['votes'].items()},
+            'mean_voter_score': stats['score_total'] / registered,
+            'party_mix': [
+                (party, count, count / registered)
+                for party, count in sorted(stats['parties'].items(), key=lambda item: (-item[1], item[0]))
+            ],
+        })
+    return results
+
+def get_precinct_stats():
+    '''return precinct_stats() for all voters, cached until the next data reload'''
+    return get_or_compute(versioned_key('precinct_stats'), precinct_stats)
+
+# the dimensions participation patterns can be crossed with
+CROSSTAB_DIMENSIONS = ['party', 'age_band']
+
+def participation_pattern():
+    '''
+    return an expression encoding a voter's election participation as a bit pattern:
+    bit i is set when the voter took part in ELECTIONS[i], giving 32 possible patterns
+    '''
+    bits = [Case(When(**{election: True}, then=Value(1 << i)), default=Value(0))
+            for i, election in enumerate(ELECTIONS)]
+    pattern = bits[0]
+    for bit in bits[1:]:
+        pattern = pattern + bit
+    return pattern
+
+def pattern_elections(pattern):
+    '''return the names of the elections set in a participation bit pattern'''
+    return [election for i, election in enumerate(ELECTIONS) if pattern & (1 << i)]
+
+def age(queryset):
+    '''return an expression for the age each voter turns this year'''
+    return Value(date.today().year) - birth_year(queryset)
+
+def bin_start(value, width):
+    '''return an expression rounding an integer expression down to a multiple of width, using integer division'''
+    return (value / Value(width)) * Value(width)
+
+def bin_label(start, width):
+    '''return the label of the bin starting at start, e.g. '30-39' for width 10'''
+    return str(start) if width == 1 else f'{start}-{start + width - 1}'
+
+def age_band(queryset, width):
+    '''return an expression for the lower bound of each voter's age band, e.g. 30 for ages 30-39'''
+    return bin_start(age(queryset), width)
+
+def participation_crosstab(queryset, by='party', band_width=10):
+    '''
+    return the number of voters per participation pattern, crossed with party or age band
+
+    everything is computed in one query grouped by (pattern, column). the result is a dict:
+    - columns: the party codes or age band labels, in display order
+    - rows: one dict per pattern seen, with the pattern, its elections, the counts
+      per column (aligned with columns) and the row total, most common pattern first
+    '''
+    if by not in CROSSTAB_DIMENSIONS:
+        raise ValueError(f'cannot cross participation patterns with {by!r}')
+
+    column = F('party') if by == 'party' else age_band(queryset, band_width)
+    groups = (queryset.order_by()
+              .annotate(pattern=participation_pattern(), column=column)
+              .values('pattern', 'column')
+              .annotate(count=voter_count(queryset)))
+
+    counts = {}
+    for group in groups:
+        counts[(group['pattern'], group['column'])] = group['count']
+
+    if by == 'party':
+        column_keys = sorted({key for _, key in counts})
+        labels = column_keys
+    else:
+        column_keys = sorted({key for _, key in counts if key is not None})
+        labels = [bin_label(low, band_width) for low in column_keys]
+
+    rows = []
+    for pattern in sorted({pattern for pattern, _ in counts}):
+        row_counts = [counts.get((pattern, key), 0) for key in column_keys]
+        rows.append({
+            'pattern': pattern,
+            'elections': pattern_elections(pattern),
+            'counts': row_counts,
+            'total': sum(row_counts),
+        })
+    rows.sort(key=lambda row: (-row['total'], row['pattern']))
+
+    return {'by': by, 'band_width': band_width, 'columns': labels, 'rows': rows}
+
+def get_participation_crosstab(voter_filter, by='party', band_width=10, use_cache=True):
+    '''
+    return participation_crosstab() for the voters matching voter_filter, read from the
+    VoterRollup table when possible and cached until the next data reload unless use_cache is False
+    '''
+    def compute():
+        source = voter_filter.rollup_queryset()
+        if source is None:
+            source = voter_filter.queryset()
+        return participation_crosstab(source, by=by, band_width=band_width)
+
+    if not use_cache:
+        return compute()
+    return get_or_compute(versioned_key('crosstab', by, band_width, voter_filter.cache_key), compute)
@@ -0,0 +1,33 @@
+# cache.py
+# helpers for caching voter analytics results in django's cache framework
+# every cached value is stored under a key that includes the current data version,
+# which the voter loader bumps after each reload, so a reload invalidates every
+# cached result at once without having to track down the individual keys
+# the version is the voter_analytics app's data version from cs412.versioning
+
+from django.core.cache import cache
+
+from cs412 import versioning
+
+APP_LABEL = 'voter_analytics'
+DATA_VERSION_KEY = versioning.data_version_key(APP_LABEL)
+
+def get_data_version():
+    '''return the current voter data version, creating it if the cache has none'''
+    return versioning.get_data_version(APP_LABEL)
+
+def bump_data_version():
+    '''move to a new data version, invalidating everything cached for the old one'''
+    return versioning.bump_data_version(APP_LABEL)
+
+def versioned_key(*parts):
+    '''build a cache key for parts that is only valid for the current data version'''
+    return ':'.join(['voter_analytics', str(get_data_version()), *map(str, parts)])
+
+def get_or_compute(key, compute):
+    '''return the cached value for key, calling compute() to fill the cache on a miss'''
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout=None)
+    return value
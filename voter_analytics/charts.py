@@ -0,0 +1,225 @@
+# charts.py
+# builds and caches the plotly charts shown on the voter graphs page
+# the aggregated counts for a filter are cached in django's cache framework, and the
+# rendered html fragments are kept in a size-bounded in-process LRU cache keyed by
+# the data version, the canonical filter and the histogram bin widths, so repeat views of a popular filter
+# skip both the database and plotly entirely
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import plotly
+import plotly.graph_objects as go
+from django.conf import settings
+from django.utils.safestring import mark_safe
+
+from .aggregates import HISTOGRAM_FIELDS, bin_label, birth_year_counts, election_counts, histogram, party_counts
+from .cache import get_data_version, get_or_compute, versioned_key
+from .snapshot import get_snapshot
+
+NO_DATA = "<p>No data available.</p>"
+
+# upper bound on the total size of the cached chart html, in bytes
+DEFAULT_CHART_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+class ChartCache:
+    """
+    thread-safe LRU cache of rendered chart fragments, bounded by their total size
+
+    entries are keyed by (data version, filter key). once a newer data version is
+    seen, every entry from the older versions is dropped since it can't be hit again
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(fragments):
+        return sum(len(fragment) for fragment in fragments.values())
+
+    def get(self, version, key):
+        '''return the cached fragments for key, or None, marking them as recently used'''
+        with self._lock:
+            if version != self.version:
+                return None
+            fragments = self._entries.get(key)
+            if fragments is not None:
+                self._entries.move_to_end(key)
+            return fragments
+
+    def set(self, version, key, fragments):
+        '''store fragments for key, evicting the least recently used entries to stay in bounds'''
+        size = self._size(fragments)
+        with self._lock:
+            if version != self.version:
+                self.clear_locked()
+                self.version = version
+            if key in self._entries:
+                self.current_bytes -= self._size(self._entries.pop(key))
+            if size > self.max_bytes:
+                return  # too big to ever fit, don't flush the whole cache for it
+            self._entries[key] = fragments
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self._size(evicted)
+
+    def clear_locked(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def clear(self):
+        with self._lock:
+            self.clear_locked()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+chart_cache = ChartCache(getattr(settings, 'VOTER_CHART_CACHE_MAX_BYTES', DEFAULT_CHART_CACHE_MAX_BYTES))
+
+@lru_cache(maxsize=1)
+def plotly_js():
+    '''return a script tag with the plotly.js library, included once per graphs page'''
+    return mark_safe(f'<script type="text/javascript">{plotly.offline.get_plotlyjs()}</script>')
+
+def get_chart_data(voter_filter, queryset, bins=None):
+    '''
+    return the aggregated series behind the charts for the voters in queryset,
+    cached per canonical filter and histogram bin widths until the next data reload
+
+    the counts come from the in-memory snapshot when it is enabled, otherwise from
+    the VoterRollup table whenever the filters can be expressed against it, so the
+    work scales with the number of groups, not voters
+
+    bins maps each histogram field to its bin width, defaulting to HISTOGRAM_FIELDS
+    '''
+    bins = {**HISTOGRAM_FIELDS, **(bins or {})}
+
+    def compute():
+        snapshot = get_snapshot()
+        if snapshot is not None and snapshot.supports(voter_filter):
+            return snapshot.chart_data(voter_filter, bins)
+
+        source = voter_filter.rollup_queryset()
+        if source is None:
+            source = queryset
+        return {
+            'birth_years': birth_year_counts(source),
+            'parties': party_counts(source),
+            'elections': election_counts(source),
+            'bins': bins,
+            'age_bands': histogram(source, 'age', bins['age']),
+            'voter_scores': histogram(source, 'voter_score', bins['voter_score']),
+        }
+    key = versioned_key('chart_data', voter_filter.cache_key, bins['age'], bins['voter_score'])
+    return get_or_compute(key, compute)
+
+def render_charts(data):
+    '''render the aggregated chart data into html fragments (without the plotly.js library)'''
+    fragments = {}
+
+    # --- voter distribution by year of birth (bar chart) ---
+    if data['birth_years']:
+        years_x, counts_y = zip(*data['birth_years'])
+        fig_bar = go.Figure(go.Bar(x=years_x, y=counts_y))
+        fig_bar.update_layout(
+            title="Voter Distribution by Year of Birth",
+            xaxis_title='Year of Birth',
+            yaxis_title='Count'
+        )
+        fragments['birth_year_graph'] = fig_bar.to_html(full_html=False, include_plotlyjs=False)
+    else:
+        fragments['birth_year_graph'] = NO_DATA
+
+    # --- voter distribution by party affiliation (pie chart) ---
+    if data['parties']:
+        party_names, party_values = zip(*data['parties'])
+        fig_pie = go.Figure(go.Pie(labels=party_names, values=party_values))
+        fig_pie.update_layout(
+            title="Voter Distribution by Party Affiliation",
+            width=900,
+            height=700
+        )
+        fragments['party_pie_chart'] = fig_pie.to_html(full_html=False, include_plotlyjs=False)
+    else:
+        fragments['party_pie_chart'] = NO_DATA
+
+    # --- voter participation in elections (histogram) ---
+    elections = data['elections']
+    if any(elections.values()):
+        # one colored bar per election
+        fig_hist = go.Figure(go.Bar(
+            x=list(elections.keys()),
+            y=list(elections.values()),
+            text=list(elections.values()),
+            marker_color=plotly.colors.qualitative.Plotly[:len(elections)]
+        ))
+        fig_hist.update_layout(
+            title="Voter Participation in Elections",
+            xaxis_title='Election',
+            yaxis_title='Number of Voters'
+        )
+        fragments['election_histogram'] = fig_hist.to_html(full_html=False, include_plotlyjs=False)
+    else:
+        fragments['election_histogram'] = NO_DATA
+
+    # --- voters by age band and by voter score bucket (histograms) ---
+    histograms = [
+        ('age_band_histogram', 'age_bands', 'age', "Voters by Age Band", 'Age'),
+        ('voter_score_histogram', 'voter_scores', 'voter_score', "Voters by Voter Score", 'Voter Score'),
+    ]
+    for name, series, field, title, axis_title in histograms:
+        if data[series]:
+            width = data['bins'][field]
+            fig = go.Figure(go.Bar(
+                x=[bin_label(start, width) for start, _ in data[series]],
+                y=[count for _, count in data[series]],
+            ))
+            fig.update_layout(title=title, xaxis_title=axis_title, yaxis_title='Count')
+            fragments[name] = fig.to_html(full_html=False, include_plotlyjs=False)
+        else:
+            fragments[name] = NO_DATA
+
+    return {name: mark_safe(fragment) for name, fragment in fragments.items()}
+
+def get_chart_fragments(voter_filter, queryset, bins=None):
+    '''return the rendered chart fragments for a filter, from the LRU cache when possible'''
+    version = get_data_version()
+    bins = {**HISTOGRAM_FIELDS, **(bins or {})}
+    key = (voter_filter.cache_key, bins['age'], bins['voter_score'])
+    fragments = chart_cache.get(version, key)
+    if fragments is None:
+        fragments = render_charts(get_chart_data(voter_filter, queryset, bins))
+        chart_cache.set(version, key, fragments)
+    return fragments
+
+def chart_series(data):
+    '''convert the aggregated chart data into the label/count series returned as json'''
+    return {
+        'birth_years': {
+            'labels': [year for year, _ in data['birth_years']],
+            'counts': [count for _, count in data['birth_years']],
+        },
+        'parties': {
+            'labels': [party for party, _ in data['parties']],
+            'counts': [count for _, count in data['parties']],
+        },
+        'elections': {
+            'labels': list(data['elections'].keys()),
+            'counts': list(data['elections'].values()),
+        },
+        'age_bands': {
+            'labels': [bin_label(start, data['bins']['age']) for start, _ in data['age_bands']],
+            'counts': [count for _, count in data['age_bands']],
+        },
+        'voter_scores': {
+            'labels': [bin_label(start, data['bins']['voter_score']) for start, _ in data['voter_scores']],
+            'counts': [count for _, count in data['voter_scores']],
+        },
+    }
@@ -0,0 +1,120 @@
+# export.py
+# streams a filtered set of voters as csv or parquet without loading it into memory
+# rows are read with values_list(...).iterator(chunk_size=...) and written out one
+# chunk at a time, so memory use stays constant however many voters are exported
+
+import csv
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:     # parquet export is optional
+    pa = pq = None
+
+# the Voter columns included in an export, in output order
+EXPORT_FIELDS = [
+    'voter_id', 'last_name', 'first_name', 'street_num', 'street_name', 'apt_num',
+    'zip_code', 'dob', 'reg_date', 'party', 'precinct_num',
+    'v20state', 'v21town', 'v21primary', 'v22general', 'v23town', 'voter_score',
+]
+
+# number of rows fetched from the database (and written to parquet) at a time
+EXPORT_CHUNK_SIZE = 2000
+
+def parquet_available():
+    '''return True if pyarrow is installed so parquet exports can be offered'''
+    return pq is not None
+
+def export_rows(queryset):
+    '''iterate over the export columns of every voter in queryset, in a stable order'''
+    return queryset.order_by('pk').values_list(*EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+class Echo:
+    """file-like object whose write() hands the written value back instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset):
+    '''yield the voters in queryset as csv text, one line at a time'''
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in export_rows(queryset):
+        yield writer.writerow(row)
+
+
+class StreamSink:
+    """
+    write-only file-like object that buffers bytes until they are drained
+
+    parquet writers record file offsets with tell(), so tell() keeps counting the
+    total bytes written even after the buffer has been drained
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def drain(self):
+        '''return and forget everything written since the last drain'''
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema():
+    '''return the arrow schema of a parquet voter export'''
+    strings = ['voter_id', 'last_name', 'first_name', 'street_num', 'street_name', 'apt_num',
+               'zip_code', 'party', 'precinct_num']
+    types = {name: pa.string() for name in strings}
+    types.update({'dob': pa.date32(), 'reg_date': pa.date32(), 'voter_score': pa.int32()})
+    types.update({election: pa.bool_() for election in ['v20state', 'v21town', 'v21primary', 'v22general', 'v23town']})
+    return pa.schema([(name, types[name]) for name in EXPORT_FIELDS])
+
+def stream_parquet(queryset):
+    '''yield the voters in queryset as a parquet file, one row group per chunk of rows'''
+    schema = parquet_schema()
+    sink = StreamSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+
+    def write_chunk(rows):
+        columns = list(zip(*rows))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema,
+        ))
+
+    rows = []
+    for row in export_rows(queryset):
+        rows.append(row)
+        if len(rows) >= EXPORT_CHUNK_SIZE:
+            write_chunk(rows)
+            rows = []
+            yield sink.drain()
+    if rows:
+        write_chunk(rows)
+    writer.close()
+    yield sink.drain()
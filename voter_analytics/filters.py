@@ -0,0 +1,158 @@
+# filters.py
+# the voter filter shared by VoterListView and GraphsView
+# VoterFilter turns the GET parameters of a request into a canonical set of filters,
+# builds the matching Voter queryset, and memoizes the number of matching voters
+# under a cache key derived from the canonical filters until the next data reload
+
+import hashlib
+from datetime import date
+
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from django.utils.http import urlencode
+
+from .aggregates import ELECTIONS
+from .cache import get_or_compute, versioned_key
+from .models import Voter, VoterRollup
+from .search import search_terms, search_voters
+
+# the values a filter can take; anything outside is clamped, so every consumer of the
+# filter gets values that fit in a date and in a database integer
+MIN_YEAR, MAX_YEAR = 1, 9999
+MIN_VOTER_SCORE, MAX_VOTER_SCORE = -2**31, 2**31 - 1
+
+class VoterFilter:
+    """
+    canonical form of the voter filters available on the list and graph pages
+
+    filters available:
+    - party: party affiliation
+    - min_dob / max_dob: first and last year of birth (inclusive)
+    - voter_score: exact voter score
+    - elections: voted in every one of the listed elections
+    - q: words matched against the voter's first name, last name and street name
+
+    invalid values are ignored, the same way the views always ignored them, so two
+    requests that filter the same voters always produce the same cache key
+    """
+
+    def __init__(self, params):
+        self.party = params.get('party') or None
+        self.min_dob = self._parse_int(params.get('min_dob'), MIN_YEAR, MAX_YEAR)
+        self.max_dob = self._parse_int(params.get('max_dob'), MIN_YEAR, MAX_YEAR)
+        self.voter_score = self._parse_int(params.get('voter_score'), MIN_VOTER_SCORE, MAX_VOTER_SCORE)
+        self.elections = tuple(election for election in ELECTIONS if params.get(election))
+        # normalize the search to lowercase words so equivalent searches share a cache key
+        self.q = ' '.join(search_terms(params.get('q'))) or None
+
+    @staticmethod
+    def _parse_int(value, low, high):
+        '''return value as an int clamped to low..high, or None if it is missing or not a number'''
+        try:
+            return min(max(int(value), low), high)
+        except (TypeError, ValueError):
+            return None
+
+    @property
+    def params(self):
+        '''return the active filters as a sorted list of (name, value) pairs'''
+        params = []
+        if self.party is not None:
+            params.append(('party', self.party))
+        if self.min_dob is not None:
+            params.append(('min_dob', self.min_dob))
+        if self.max_dob is not None:
+            params.append(('max_dob', self.max_dob))
+        if self.voter_score is not None:
+            params.append(('voter_score', self.voter_score))
+        params.extend((election, 'on') for election in self.elections)
+        if self.q is not None:
+            params.append(('q', self.q))
+        return sorted(params)
+
+    @property
+    def querystring(self):
+        '''return the active filters encoded as a query string, e.g. for pagination links'''
+        return urlencode(self.params)
+
+    @cached_property
+    def cache_key(self):
+        '''return a short key identifying this combination of filters'''
+        return hashlib.sha1(self.querystring.encode('utf-8')).hexdigest()
+
+    def queryset(self):
+        '''return the queryset of voters matching the filters'''
+        queryset = Voter.objects.all()
+
+        if self.party is not None:
+            queryset = queryset.filter(party=self.party)
+        if self.min_dob is not None:
+            queryset = queryset.filter(dob__gte=self._year_start(self.min_dob))
+        if self.max_dob is not None:
+            queryset = queryset.filter(dob__lte=self._year_end(self.max_dob))
+        if self.voter_score is not None:
+            queryset = queryset.filter(voter_score=self.voter_score)
+        for election in self.elections:
+            queryset = queryset.filter(**{election: True})
+        if self.q is not None:
+            queryset = search_voters(queryset, self.q)
+
+        return queryset
+
+    def rollup_queryset(self):
+        '''
+        return the VoterRollup rows matching the filters, or None when the filters
+        can't be answered from the rollup table
+
+        every filter except the name search is on a rollup column, and the birth year
+        filters always cover whole years, so the rollup gives the same counts as the Voter table
+        '''
+        if self.q is not None:
+            return None     # names and streets aren't part of the rollup
+
+        queryset = VoterRollup.objects.all()
+
+        if self.party is not None:
+            queryset = queryset.filter(party=self.party)
+        if self.min_dob is not None:
+            queryset = queryset.filter(birth_year__gte=self._clamp_year(self.min_dob))
+        if self.max_dob is not None:
+            queryset = queryset.filter(birth_year__lte=self._clamp_year(self.max_dob))
+        if self.voter_score is not None:
+            queryset = queryset.filter(voter_score=self.voter_score)
+        for election in self.elections:
+            queryset = queryset.filter(**{election: True})
+
+        return queryset
+
+    @staticmethod
+    def _clamp_year(year):
+        '''return year clamped to the range of dates python supports'''
+        return min(max(year, MIN_YEAR), MAX_YEAR)
+
+    @classmethod
+    def _year_start(cls, year):
+        '''return the first day of year, clamped to the range of dates python supports'''
+        return date(cls._clamp_year(year), 1, 1)
+
+    @classmethod
+    def _year_end(cls, year):
+        '''return the last day of year, clamped to the range of dates python supports'''
+        return date(cls._clamp_year(year), 12, 31)
+
+    def count(self):
+        '''return the number of matching voters, cached until the next data reload'''
+        return get_or_compute(versioned_key('count', self.cache_key), lambda: self.queryset().count())
+
+
+class VoterFilterPaginator(Paginator):
+    """paginator that takes its total count from VoterFilter's cache instead of running COUNT(*)"""
+
+    def __init__(self, object_list, per_page, voter_filter, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.voter_filter = voter_filter
+
+    @cached_property
+    def count(self):
+        '''return the (cached) total number of voters matching the filter'''
+        return self.voter_filter.count()
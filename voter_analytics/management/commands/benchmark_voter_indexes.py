@@ -0,0 +1,103 @@
+# benchmark_voter_indexes.py
+# management command that measures the Voter filter indexes on a synthetic table
+# it builds a throwaway test database, fills it with synthetic voters, and runs the
+# filter combinations used by VoterListView and GraphsView with the indexes dropped
+# and then recreated, printing the query plan and median timings for each
+# usage: python manage.py benchmark_voter_indexes [--rows 100000] [--repeat 5]
+
+import statistics
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from voter_analytics.models import Voter
+from voter_analytics.synthetic import generate_voters
+
+
+def benchmark_queries():
+    '''return (label, queryset) pairs mirroring the filters offered by the voter views'''
+    voters = Voter.objects.all()
+    return [
+        ('party', voters.filter(party='R ')),
+        ('party + dob range', voters.filter(party='D ', dob__gte=date(1960, 1, 1), dob__lte=date(1969, 12, 31))),
+        ('dob range', voters.filter(dob__gte=date(1990, 1, 1), dob__lte=date(1995, 12, 31))),
+        ('voter_score', voters.filter(voter_score=5)),
+        ('voter_score + dob range', voters.filter(voter_score=4, dob__gte=date(1980, 1, 1))),
+        ('v21primary', voters.filter(v21primary=True)),
+        ('v21primary + v23town', voters.filter(v21primary=True, v23town=True)),
+        ('v21town + dob range', voters.filter(v21town=True, dob__gte=date(1950, 1, 1), dob__lte=date(1959, 12, 31))),
+    ]
+
+
+class Command(BaseCommand):
+    """compare query plans and timings with and without the Voter filter indexes"""
+    help = "Benchmark the Voter filter indexes against a synthetic voter table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000, help='number of synthetic voters')
+        parser.add_argument('--repeat', type=int, default=5, help='timed runs per query')
+        parser.add_argument('--seed', type=int, default=412, help='random seed for the synthetic data')
+
+    def handle(self, *args, **options):
+        # run against a throwaway test database so real voter data is never touched
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.fill(options['rows'], options['seed'])
+            indexes = Voter._meta.indexes
+
+            with connection.schema_editor() as editor:
+                for index in indexes:
+                    editor.remove_index(Voter, index)
+            before = self.run_queries(options['repeat'])
+
+            with connection.schema_editor() as editor:
+                for index in indexes:
+                    editor.add_index(Voter, index)
+            after = self.run_queries(options['repeat'])
+
+            self.report(before, after)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def fill(self, rows, seed):
+        '''insert the synthetic voters in batches'''
+        start = time.perf_counter()
+        batch = []
+        for voter in generate_voters(rows, seed=seed):
+            batch.append(voter)
+            if len(batch) >= 5000:
+                Voter.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Voter.objects.bulk_create(batch)
+        self.stdout.write(f'Inserted {rows} synthetic voters in {time.perf_counter() - start:.2f}s')
+
+    def run_queries(self, repeat):
+        '''time a COUNT and a first page fetch for each query, returning plans and medians'''
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        results = {}
+        for label, queryset in benchmark_queries():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                queryset.count()
+                list(queryset[:100])
+                timings.append((time.perf_counter() - start) * 1000)
+            results[label] = (queryset.explain(), statistics.median(timings))
+        return results
+
+    def report(self, before, after):
+        '''print the plan and timing of every query before and after indexing'''
+        for label, (plan_before, ms_before) in before.items():
+            plan_after, ms_after = after[label]
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{label}'))
+            self.stdout.write(f'  without indexes: {ms_before:8.2f} ms')
+            self.stdout.write('    ' + plan_before.replace('\n', '\n    '))
+            self.stdout.write(f'  with indexes:    {ms_after:8.2f} ms')
+            self.stdout.write('    ' + plan_after.replace('\n', '\n    '))
+            speedup = ms_before / ms_after if ms_after else float('inf')
+            self.stdout.write(self.style.SUCCESS(f'  speedup: {speedup:.1f}x'))
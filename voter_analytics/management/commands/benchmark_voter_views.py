@@ -0,0 +1,207 @@
+# benchmark_voter_views.py
+# management command that measures the voter_analytics views at scale
+# it builds a throwaway test database, fills it with synthetic voters, and requests
+# VoterListView, VoterDetailView and the graphs pages through the django test client
+# under common filter mixes, reporting p50/p95 latency, query counts and peak memory
+# by default every request runs with caching disabled, so the numbers measure the
+# work a cache miss does; --warm keeps an in-memory cache between requests instead
+# to gate regressions, save a baseline once with --save-baseline and compare later runs
+# against it with --baseline, and/or cap every scenario with --max-queries: the command
+# exits with an error when a scenario fails, runs more queries than allowed, or is slower
+# than the baseline's p95 by more than --tolerance
+# usage: python manage.py benchmark_voter_views [--rows 100000] [--repeat 20] [--warm] [--json]
+#        [--baseline FILE] [--save-baseline FILE] [--tolerance 0.5] [--max-queries N]
+
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from voter_analytics.charts import chart_cache
+from voter_analytics.models import Voter
+from voter_analytics.synthetic import load_synthetic_voters
+
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                           'LOCATION': 'benchmark_voter_views'}}
+
+
+def benchmark_scenarios(voter_ids, per_page=100):
+    '''
+    return (label, urls, settings) tuples mirroring how the voter pages are used
+    each run of a scenario requests the next url in urls, with settings overridden
+    '''
+    voters = reverse('voters')
+    graphs = reverse('graphs')
+    graphs_data = reverse('graphs_data')
+    last_page = max(len(voter_ids) // per_page, 1)
+    server_rendering = {'VOTER_GRAPHS_CLIENT_RENDERING': False}
+
+    def url(path, **params):
+        return f'{path}?{urlencode(params)}' if params else path
+
+    return [
+        ('list: no filters', [url(voters)], {}),
+        ('list: party', [url(voters, party='D ')], {}),
+        ('list: party + dob range', [url(voters, party='R ', min_dob=1960, max_dob=1969)], {}),
+        ('list: voter score + elections', [url(voters, voter_score=3, v20state='on', v22general='on')], {}),
+        ('list: name search', [url(voters, q='smith'), url(voters, q='mary beacon')], {}),
+        ('list: last page', [url(voters, page=last_page)], {}),
+        ('list: keyset by name', [url(voters, pagination='keyset')], {}),
+        ('detail', [reverse('voter', args=[pk]) for pk in voter_ids[::max(len(voter_ids) // 50, 1)]], {}),
+        ('graphs: client rendering', [url(graphs)], {}),
+        ('graphs: server rendering', [url(graphs)], server_rendering),
+        ('graphs: server rendering + filters', [url(graphs, party='D ', min_dob=1950, v21town='on')], server_rendering),
+        ('graphs data: no filters', [url(graphs_data)], {}),
+        ('graphs data: party + elections', [url(graphs_data, party='U ', v20state='on', v23town='on')], {}),
+    ]
+
+
+def percentile(values, fraction):
+    '''return the value at the given fraction of the sorted values (nearest rank)'''
+    ordered = sorted(values)
+    index = min(max(round(fraction * len(ordered)) - 1, 0), len(ordered) - 1)
+    return ordered[index]
+
+
+def find_regressions(results, baseline=None, tolerance=0.5, max_queries=None):
+    '''
+    return a description of every way results fall short: a status other than 200,
+    more queries than max_queries or than the baseline run, or a p95 latency more than
+    tolerance (a fraction) above the baseline's. scenarios missing from the baseline
+    are only checked against max_queries
+    '''
+    baseline = {result['scenario']: result for result in baseline or []}
+    regressions = []
+    for result in results:
+        scenario = result['scenario']
+        if result['status'] != [200]:
+            regressions.append(f"{scenario}: status {','.join(map(str, result['status']))}")
+        if max_queries is not None and result['queries'] > max_queries:
+            regressions.append(f"{scenario}: {result['queries']} queries, over the budget of {max_queries}")
+
+        previous = baseline.get(scenario)
+        if previous is None:
+            continue
+        if result['queries'] > previous['queries']:
+            regressions.append(f"{scenario}: {result['queries']} queries, up from {previous['queries']}")
+        allowed_ms = previous['p95_ms'] * (1 + tolerance)
+        if result['p95_ms'] > allowed_ms:
+            regressions.append(f"{scenario}: p95 {result['p95_ms']:.2f} ms, over {allowed_ms:.2f} ms "
+                               f"(baseline {previous['p95_ms']:.2f} ms + {tolerance:.0%})")
+    return regressions
+
+
+class Command(BaseCommand):
+    """report latency, query counts and peak memory of the voter views on synthetic data"""
+    help = "Benchmark the voter_analytics views against a synthetic voter table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000, help='number of synthetic voters')
+        parser.add_argument('--repeat', type=int, default=20, help='timed requests per scenario')
+        parser.add_argument('--seed', type=int, default=412, help='random seed for the synthetic data')
+        parser.add_argument('--warm', action='store_true',
+                            help='keep an in-memory cache between requests instead of disabling caching')
+        parser.add_argument('--json', action='store_true', help='print the results as json')
+        parser.add_argument('--baseline', help='json results of an earlier run to compare against')
+        parser.add_argument('--save-baseline', help='write the results to this file as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='fraction by which a p95 latency may exceed the baseline (default 0.5)')
+        parser.add_argument('--max-queries', type=int, help='fail when a scenario runs more queries than this')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"can't read the baseline {options['baseline']}: {e}")
+
+        # run against a throwaway test database so real voter data is never touched,
+        # and against a separate cache so the real cached analytics aren't either
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=LOCAL_CACHE if options['warm'] else NO_CACHE):
+                chart_cache.clear()
+                start = time.perf_counter()
+                load_synthetic_voters(options['rows'], seed=options['seed'])
+                if not options['json']:
+                    self.stdout.write(f"Inserted {options['rows']} synthetic voters in {time.perf_counter() - start:.2f}s")
+
+                voter_ids = list(Voter.objects.order_by('pk').values_list('pk', flat=True))
+                results = [
+                    self.run_scenario(label, urls, overrides, options['repeat'], options['warm'])
+                    for label, urls, overrides in benchmark_scenarios(voter_ids)
+                ]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            chart_cache.clear()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.report(results)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        regressions = find_regressions(results, baseline, options['tolerance'], options['max_queries'])
+        if regressions:
+            raise CommandError('performance regressions:\n  ' + '\n  '.join(regressions))
+
+    def run_scenario(self, label, urls, overrides, repeat, warm):
+        '''request the scenario's urls repeat times, returning its latency, query and memory figures'''
+        client = Client()
+        timings = []
+        queries = []
+        statuses = set()
+
+        with override_settings(**overrides):
+            for i in range(repeat):
+                if not warm:
+                    chart_cache.clear()
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    response = client.get(urls[i % len(urls)])
+                    timings.append((time.perf_counter() - start) * 1000)
+                statuses.add(response.status_code)
+                queries.append(len(context.captured_queries))
+
+            # measure memory in a separate request, since tracing slows the timed ones down
+            if not warm:
+                chart_cache.clear()
+            tracemalloc.start()
+            client.get(urls[0])
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        return {
+            'scenario': label,
+            'status': sorted(statuses),
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'queries': max(queries),
+            'peak_kb': round(peak / 1024),
+        }
+
+    def report(self, results):
+        '''print one row per scenario'''
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\n{'scenario':<36} {'status':>8} {'p50 ms':>9} {'p95 ms':>9} {'queries':>8} {'peak KB':>9}"
+        ))
+        for result in results:
+            status = ','.join(map(str, result['status']))
+            line = (f"{result['scenario']:<36} {status:>8} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                    f"{result['queries']:>8} {result['peak_kb']:>9}")
+            self.stdout.write(line if result['status'] == [200] else self.style.ERROR(line))
@@ -0,0 +1,56 @@
+# generate_voters.py
+# management command that fills a throwaway database with synthetic voters, for trying
+# the analytics pages and queries at scale without the real voter file
+# the target database has to be named explicitly and can't be the default one, so the
+# real voter data is never replaced; it is migrated first if needed
+# usage: python manage.py generate_voters 100000 --database synthetic [--seed 412] [--batch-size N]
+
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from voter_analytics.models import DEFAULT_BATCH_SIZE
+from voter_analytics.synthetic import load_synthetic_voters
+
+
+class Command(BaseCommand):
+    """fill the Voter table of a throwaway database with synthetic voters and report the load rate"""
+    help = "Replace all voters in a non-default database with N synthetic voters with realistic distributions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help='number of synthetic voters to generate')
+        parser.add_argument('--database', required=True,
+                            help="alias of the throwaway database to fill (any alias in DATABASES except 'default')")
+        parser.add_argument('--seed', type=int, default=412, help='random seed for the synthetic data')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='number of voters per INSERT statement')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if using == DEFAULT_DB_ALIAS:
+            raise CommandError("refusing to replace the voters in the default database; "
+                               "pass the alias of a throwaway database with --database")
+        if using not in settings.DATABASES:
+            raise CommandError(f"unknown database alias '{using}', choose one of: "
+                               f"{', '.join(alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS)}")
+        if options['count'] < 0:
+            raise CommandError('count must not be negative')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive integer')
+
+        call_command('migrate', database=using, verbosity=0)
+
+        start = time.perf_counter()
+        rows = load_synthetic_voters(options['count'], seed=options['seed'], batch_size=options['batch_size'],
+                                     using=using)
+        elapsed = time.perf_counter() - start
+
+        # guard against a zero division on tiny counts
+        rate = rows / elapsed if elapsed > 0 else float(rows)
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {rows} synthetic voters in {settings.DATABASES[using]['NAME']} "
+            f"in {elapsed:.2f}s ({rate:,.0f} rows/s)"
+        ))
@@ -0,0 +1,55 @@
+# load_voters.py
+# management command that loads the newton voter file into the Voter table
+# usage: python manage.py load_voters path/to/newton_voters.csv [--batch-size N] [--upsert]
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from voter_analytics.models import DEFAULT_BATCH_SIZE, load_data, upsert_data
+
+
+class Command(BaseCommand):
+    """stream a voter csv file into the database and report the load rate"""
+    help = "Load voters from a csv file using batched bulk inserts in one transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help='path to the voter csv file')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='number of voters per INSERT statement')
+        parser.add_argument('--upsert', action='store_true',
+                            help='only write new, changed and removed voters instead of reloading everything')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive integer')
+
+        start = time.perf_counter()
+        try:
+            if options['upsert']:
+                counts = upsert_data(options['csv_path'], batch_size=batch_size)
+                rows = counts['created'] + counts['updated'] + counts['unchanged']
+            else:
+                counts = load_data(options['csv_path'], batch_size=batch_size)
+                rows = counts['created']
+        except FileNotFoundError:
+            raise CommandError(f"csv file not found: {options['csv_path']}")
+        elapsed = time.perf_counter() - start
+
+        # guard against a zero division on tiny files
+        rate = rows / elapsed if elapsed > 0 else float(rows)
+        if options['upsert']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Upserted {rows} voters in {elapsed:.2f}s ({rate:,.0f} rows/s): "
+                f"{counts['created']} created, {counts['updated']} updated, "
+                f"{counts['unchanged']} unchanged, {counts['deleted']} deleted"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Loaded {rows} voters in {elapsed:.2f}s ({rate:,.0f} rows/s)'
+            ))
+        if counts['duplicates']:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {counts['duplicates']} rows repeating a voter id already in the file (kept the first)"
+            ))
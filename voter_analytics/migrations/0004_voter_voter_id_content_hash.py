@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0003_alter_voter_precinct_num'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voter',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='voter',
+            name='voter_id',
+            field=models.CharField(blank=True, max_length=20, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0004_voter_voter_id_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['party', 'dob'], name='voter_party_dob_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['dob'], name='voter_dob_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['voter_score', 'dob'], name='voter_score_dob_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(condition=models.Q(('v20state', True)), fields=['dob'], name='voter_v20state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(condition=models.Q(('v21town', True)), fields=['dob'], name='voter_v21town_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(condition=models.Q(('v21primary', True)), fields=['dob'], name='voter_v21primary_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(condition=models.Q(('v22general', True)), fields=['dob'], name='voter_v22general_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(condition=models.Q(('v23town', True)), fields=['dob'], name='voter_v23town_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0005_voter_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['last_name', 'first_name', 'id'], name='voter_name_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:22
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+
+
+def build_rollup(apps, schema_editor):
+    '''fill the new rollup table from the voters that are already loaded'''
+    db_alias = schema_editor.connection.alias
+    Voter = apps.get_model('voter_analytics', 'Voter')
+    VoterRollup = apps.get_model('voter_analytics', 'VoterRollup')
+    dimensions = ['party', 'precinct_num', 'voter_score',
+                  'v20state', 'v21town', 'v21primary', 'v22general', 'v23town']
+    groups = (Voter.objects.using(db_alias).order_by()
+              .values(*dimensions)
+              .annotate(birth_year=ExtractYear('dob'), voters=Count('id')))
+    VoterRollup.objects.using(db_alias).bulk_create((VoterRollup(**group) for group in groups.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0006_voter_name_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoterRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('party', models.CharField(max_length=2)),
+                ('birth_year', models.IntegerField()),
+                ('precinct_num', models.CharField(max_length=5)),
+                ('voter_score', models.IntegerField()),
+                ('v20state', models.BooleanField(default=False)),
+                ('v21town', models.BooleanField(default=False)),
+                ('v21primary', models.BooleanField(default=False)),
+                ('v22general', models.BooleanField(default=False)),
+                ('v23town', models.BooleanField(default=False)),
+                ('voters', models.IntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['party', 'birth_year'], name='rollup_party_year_idx'), models.Index(fields=['voter_score', 'birth_year'], name='rollup_score_year_idx')],
+            },
+        ),
+        migrations.RunPython(build_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Creates the name and address search index used by voter_analytics.search
+# sqlite gets an external-content FTS5 table kept in sync by triggers, postgres gets
+# pg_trgm trigram indexes. other databases have no search index
+
+from django.db import migrations
+
+FTS_TABLE = 'voter_analytics_voter_fts'
+VOTER_TABLE = 'voter_analytics_voter'
+
+SQLITE_FORWARD = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        first_name, last_name, street_name,
+        content='{VOTER_TABLE}', content_rowid='id', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON {VOTER_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, first_name, last_name, street_name)
+        VALUES (new.id, new.first_name, new.last_name, new.street_name);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON {VOTER_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, first_name, last_name, street_name)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.street_name);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF first_name, last_name, street_name ON {VOTER_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, first_name, last_name, street_name)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.street_name);
+        INSERT INTO {FTS_TABLE}(rowid, first_name, last_name, street_name)
+        VALUES (new.id, new.first_name, new.last_name, new.street_name);
+    END""",
+    # index the voters that are already loaded
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+POSTGRES_FORWARD = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+    f"CREATE INDEX IF NOT EXISTS voter_{field}_trgm_idx ON {VOTER_TABLE} USING gin ({field} gin_trgm_ops)"
+    for field in ['first_name', 'last_name', 'street_name']
+]
+
+POSTGRES_BACKWARD = [
+    f"DROP INDEX IF EXISTS voter_{field}_trgm_idx"
+    for field in ['first_name', 'last_name', 'street_name']
+]
+
+
+def run_statements(statements):
+    '''return a RunPython function executing the statements for the matching database vendor'''
+    def run(apps, schema_editor):
+        vendor_statements = statements.get(schema_editor.connection.vendor, [])
+        for statement in vendor_statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0007_voterrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_statements({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+    ]
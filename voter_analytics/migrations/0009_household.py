@@ -0,0 +1,105 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+import re
+from collections import defaultdict
+
+
+# a frozen copy of voter_analytics.addresses as it was when households were introduced,
+# so this migration keeps computing the keys existing databases were built with even
+# if the live normalization changes later
+
+STREET_SUFFIXES = {
+    'AVENUE': 'AVE', 'AV': 'AVE',
+    'BOULEVARD': 'BLVD',
+    'CIRCLE': 'CIR',
+    'COURT': 'CT',
+    'DRIVE': 'DR',
+    'HIGHWAY': 'HWY',
+    'LANE': 'LN',
+    'PARKWAY': 'PKWY',
+    'PLACE': 'PL',
+    'ROAD': 'RD',
+    'SQUARE': 'SQ',
+    'STREET': 'ST', 'STR': 'ST',
+    'TERRACE': 'TER', 'TERR': 'TER',
+}
+
+APARTMENT_LABELS = {'APT', 'APARTMENT', 'UNIT', 'STE', 'SUITE', 'NO'}
+
+
+def address_words(value):
+    return re.findall(r'[A-Z0-9]+', (value or '').upper())
+
+
+def address_key(street_num, street_name, apt_num, zip_code):
+    street_words = address_words(street_name)
+    if street_words:
+        street_words[-1] = STREET_SUFFIXES.get(street_words[-1], street_words[-1])
+    apartment_words = [word for word in address_words(apt_num) if word not in APARTMENT_LABELS]
+    return '|'.join([
+        ''.join(address_words(street_num)).lstrip('0') or '0',
+        ' '.join(street_words),
+        ''.join(apartment_words).lstrip('0') or ('0' if apartment_words else ''),
+        ''.join(re.findall(r'\d', zip_code or ''))[:5],
+    ])
+
+
+def build_households(apps, schema_editor):
+    '''group the voters that are already loaded into households'''
+    db_alias = schema_editor.connection.alias
+    Voter = apps.get_model('voter_analytics', 'Voter')
+    Household = apps.get_model('voter_analytics', 'Household')
+    members = defaultdict(list)
+    addresses = {}
+    voters = Voter.objects.using(db_alias).order_by('pk').values_list(
+        'pk', 'street_num', 'street_name', 'apt_num', 'zip_code', 'precinct_num')
+    for pk, street_num, street_name, apt_num, zip_code, precinct_num in voters.iterator():
+        key = address_key(street_num, street_name, apt_num, zip_code)
+        members[key].append(pk)
+        addresses.setdefault(key, dict(street_num=street_num, street_name=street_name, apt_num=apt_num,
+                                       zip_code=zip_code, precinct_num=precinct_num))
+
+    households = Household.objects.using(db_alias).bulk_create(
+        [Household(address_key=key, size=len(pks), **addresses[key]) for key, pks in members.items()],
+        batch_size=1000,
+    )
+    # one UPDATE ... CASE per batch of voters rather than one UPDATE per household
+    Voter.objects.using(db_alias).bulk_update(
+        [Voter(pk=pk, household_id=household.pk) for household in households for pk in members[household.address_key]],
+        ['household'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_analytics', '0008_voter_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Household',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address_key', models.CharField(max_length=250, unique=True)),
+                ('street_num', models.CharField(max_length=10)),
+                ('street_name', models.CharField(max_length=200)),
+                ('apt_num', models.CharField(blank=True, max_length=20, null=True)),
+                ('zip_code', models.CharField(max_length=10)),
+                ('precinct_num', models.CharField(max_length=5)),
+                ('size', models.IntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['precinct_num', 'size'], name='household_precinct_size_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='voter',
+            name='household',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='voters', to='voter_analytics.household'),
+        ),
+        migrations.RunPython(build_households, migrations.RunPython.noop),
+    ]
@@ -3,10 +3,56 @@
 # the 'Voter' model represents a voter, with fields for personal details,
 # address, election participation, and voter score
 # the 'load_data' function is responsible for loading voter data from a csv file into the database
-# 'print_all_voters' prints out all voter records stored in the database.from django.db import models
-from django.db import models
+# 'VoterRows' reads the csv rows for both loaders, keeping the first row of a repeated voter id
+# 'upsert_data' reloads the csv incrementally, writing only new, changed or removed voters
+# the 'VoterRollup' model is a summary table of voter counts per combination of the filterable
+# fields, rebuilt by 'rebuild_voter_rollup' whenever the loader changes the voter data
+# the 'Household' model groups the voters living at the same normalized address; the loader
+# assigns each voter's household with 'HouseholdIndex' and recounts them with 'update_household_sizes'
+# 'print_all_voters' prints out all voter records stored in the database.
+import csv
+import hashlib
+
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, ExtractYear
+
+from .addresses import address_key
+from .cache import bump_data_version
+
+class Household(models.Model):
+    """
+    the voters registered at one address, identified by the normalized address key
+    built by addresses.address_key from the street number, street name, apartment and zip code
+    """
+    address_key = models.CharField(max_length=250, unique=True)
+
+    # address as written on the first voter row seen for the household
+    street_num = models.CharField(max_length=10)
+    street_name = models.CharField(max_length=200)
+    apt_num = models.CharField(max_length=20, null=True, blank=True)
+    zip_code = models.CharField(max_length=10)
+    precinct_num = models.CharField(max_length=5)
+
+    # number of voters in the household
+    size = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            # households by size per precinct
+            models.Index(fields=['precinct_num', 'size'], name='household_precinct_size_idx'),
+        ]
+
+    def __str__(self):
+        apartment = f' Apt. {self.apt_num}' if self.apt_num else ''
+        return f'{self.street_num} {self.street_name}{apartment}, {self.zip_code} ({self.size} voters)'
 
 class Voter(models.Model):
+    # stable identifier from the voter file, used to match rows across reloads
+    voter_id = models.CharField(max_length=20, unique=True, null=True, blank=True)
+    # hash of the csv row contents, used to skip unchanged voters on reload
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+
     # personal information of the voter
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
@@ -29,47 +75,307 @@ class Voter(models.Model):
     # voter score, an integer value
     voter_score = models.IntegerField()
 
+    # the voters sharing this voter's address, assigned by the loader
+    household = models.ForeignKey(Household, on_delete=models.SET_NULL, null=True, blank=True, related_name='voters')
+
+    class Meta:
+        # indexes matching the filter combinations used by VoterListView and GraphsView
+        indexes = [
+            models.Index(fields=['party', 'dob'], name='voter_party_dob_idx'),
+            models.Index(fields=['dob'], name='voter_dob_idx'),
+            models.Index(fields=['voter_score', 'dob'], name='voter_score_dob_idx'),
+            # ordering used by keyset pagination on the voter list
+            models.Index(fields=['last_name', 'first_name', 'id'], name='voter_name_idx'),
+            # partial indexes only cover the voters who took part in each election
+            models.Index(fields=['dob'], condition=models.Q(v20state=True), name='voter_v20state_idx'),
+            models.Index(fields=['dob'], condition=models.Q(v21town=True), name='voter_v21town_idx'),
+            models.Index(fields=['dob'], condition=models.Q(v21primary=True), name='voter_v21primary_idx'),
+            models.Index(fields=['dob'], condition=models.Q(v22general=True), name='voter_v22general_idx'),
+            models.Index(fields=['dob'], condition=models.Q(v23town=True), name='voter_v23town_idx'),
+        ]
+
+    def get_co_residents(self):
+        '''return the other voters in this voter's household'''
+        if self.household_id is None:
+            return Voter.objects.none()
+        return (Voter.objects.filter(household_id=self.household_id)
+                .exclude(pk=self.pk).order_by('last_name', 'first_name'))
+
     def __str__(self):
         return f'{self.first_name} {self.last_name}, Party: {self.party}, Precinct: {self.precinct_num}, Score: {self.voter_score}'
 
-def load_data():
-    '''function to load data records from a csv file into django model instances.'''
-    # delete all existing voter records to avoid duplicates when reloading
-    Voter.objects.all().delete()
-    # specify the path to the csv file
-    filename = '/Users/elitsamincheva/Downloads/newton_voters.csv'
-    f = open(filename)
-    # skip the first line of the file (headers)
-    f.readline() 
-
-    # loop through each line in the csv file and create a new voter object
-    for line in f:
-
-        fields = line.split(',')
-    
-        # create a new Voter instance with the fields from the csv
-        voter = Voter(first_name=fields[2],
-                        last_name=fields[1],
-                        street_num = fields[3],
-                        street_name = fields[4],
-                        apt_num = fields[5] if fields[5] else None,
-                        zip_code = fields[6],
-                        dob = fields[7],
-                        reg_date = fields[8],
-                        party = fields[9],
-                        precinct_num = fields[10],
-                        # convert to boolean for election participation
-                        v20state = fields[11].upper() == "TRUE",
-                        v21town = fields[12].upper() == "TRUE",
-                        v21primary = fields[13].upper() == "TRUE",
-                        v22general = fields[14].upper() == "TRUE",
-                        v23town = fields[15].upper() == "TRUE",
-                        voter_score = fields[16],
-                )
-        voter.save()    # save the voter to the database
-        
-        # print(f'Created result: {voter}')
-        
+class VoterRollup(models.Model):
+    """
+    precomputed number of voters for each combination of party, birth year, precinct,
+    voter score and election participation, so analytics that only filter and group
+    on these fields can be answered without reading the individual Voter rows
+    """
+    party = models.CharField(max_length=2)
+    birth_year = models.IntegerField()
+    precinct_num = models.CharField(max_length=5)
+    voter_score = models.IntegerField()
+    v20state = models.BooleanField(default=False)
+    v21town = models.BooleanField(default=False)
+    v21primary = models.BooleanField(default=False)
+    v22general = models.BooleanField(default=False)
+    v23town = models.BooleanField(default=False)
+
+    # number of voters in this group
+    voters = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['party', 'birth_year'], name='rollup_party_year_idx'),
+            models.Index(fields=['voter_score', 'birth_year'], name='rollup_score_year_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.voters} voters, Party: {self.party}, Born: {self.birth_year}, Precinct: {self.precinct_num}, Score: {self.voter_score}'
+
+# the VoterRollup columns that voters are grouped by
+ROLLUP_DIMENSIONS = [
+    'party', 'precinct_num', 'voter_score',
+    'v20state', 'v21town', 'v21primary', 'v22general', 'v23town',
+]
+
+def rebuild_voter_rollup(using=DEFAULT_DB_ALIAS):
+    '''
+    recompute the VoterRollup table from the Voter table in the using database
+
+    the grouping query is run with INSERT ... SELECT, so the groups go straight from
+    one table into the other without passing through python
+    '''
+    groups = (Voter.objects.using(using).order_by()
+              .values(*ROLLUP_DIMENSIONS)
+              .annotate(birth_year=ExtractYear('dob'), voters=Count('id')))
+    select_sql, params = groups.query.get_compiler(using).as_sql()
+
+    # values() selects the model fields first, then the annotations in order
+    columns = ROLLUP_DIMENSIONS + ['birth_year', 'voters']
+    quote = connections[using].ops.quote_name
+    with transaction.atomic(using=using):
+        VoterRollup.objects.using(using).all().delete()
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote(VoterRollup._meta.db_table)} "
+                f"({', '.join(quote(VoterRollup._meta.get_field(c).column) for c in columns)}) {select_sql}",
+                params,
+            )
+
+# number of voters sent to the database in a single INSERT statement
+DEFAULT_BATCH_SIZE = 1000
+
+# model fields that are rewritten when a voter's row changes between reloads
+UPDATE_FIELDS = [
+    'content_hash', 'first_name', 'last_name', 'street_num', 'street_name', 'apt_num',
+    'zip_code', 'dob', 'reg_date', 'party', 'precinct_num', 'v20state', 'v21town',
+    'v21primary', 'v22general', 'v23town', 'voter_score', 'household',
+]
+
+def row_hash(fields):
+    '''return a hash of every column in a csv row except the voter id'''
+    content = '\x1f'.join(field.strip() for field in fields[1:])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def row_to_voter(fields):
+    '''build an unsaved Voter instance from one parsed row of the csv file'''
+    return Voter(voter_id=fields[0].strip(),
+                 content_hash=row_hash(fields),
+                 first_name=fields[2],
+                 last_name=fields[1],
+                 street_num=fields[3],
+                 street_name=fields[4],
+                 apt_num=fields[5] if fields[5] else None,
+                 zip_code=fields[6],
+                 dob=fields[7],
+                 reg_date=fields[8],
+                 party=fields[9],
+                 precinct_num=fields[10],
+                 # convert to boolean for election participation
+                 v20state=fields[11].upper() == "TRUE",
+                 v21town=fields[12].upper() == "TRUE",
+                 v21primary=fields[13].upper() == "TRUE",
+                 v22general=fields[14].upper() == "TRUE",
+                 v23town=fields[15].upper() == "TRUE",
+                 voter_score=int(fields[16]),
+            )
+
+class VoterRows:
+    '''
+    iterates over the parsed rows of an open voter csv file, skipping the header line,
+    blank lines and any row repeating a voter id already seen, so both loaders keep
+    the first row of a repeated voter and count the rest in duplicates
+    '''
+
+    def __init__(self, f):
+        self.reader = csv.reader(f)
+        # skip the first line of the file (headers)
+        next(self.reader, None)
+        self.seen = set()
+        self.duplicates = 0
+
+    def __iter__(self):
+        for fields in self.reader:
+            if not fields:
+                continue    # skip blank lines
+            voter_id = fields[0].strip()
+            if voter_id in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(voter_id)
+            yield fields
+
+class HouseholdIndex:
+    '''
+    maps normalized address keys to Household primary keys while the loader runs,
+    so each voter gets its household before it is written
+    '''
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.ids = dict(Household.objects.using(using).values_list('address_key', 'pk'))
+
+    def assign(self, voters):
+        '''set the household of each unsaved voter, creating the missing households in one INSERT'''
+        keys = [address_key(v.street_num, v.street_name, v.apt_num, v.zip_code) for v in voters]
+        new = {}
+        for voter, key in zip(voters, keys):
+            if key not in self.ids and key not in new:
+                new[key] = Household(address_key=key, street_num=voter.street_num, street_name=voter.street_name,
+                                     apt_num=voter.apt_num, zip_code=voter.zip_code,
+                                     precinct_num=voter.precinct_num, size=0)
+        for household in Household.objects.using(self.using).bulk_create(new.values()):
+            self.ids[household.address_key] = household.pk
+        for voter, key in zip(voters, keys):
+            voter.household_id = self.ids[key]
+
+def update_household_sizes(using=DEFAULT_DB_ALIAS):
+    '''recount the voters in every household with one UPDATE, then delete the empty households'''
+    counts = (Voter.objects.filter(household=OuterRef('pk')).order_by()
+              .values('household').annotate(voters=Count('pk')).values('voters'))
+    Household.objects.using(using).update(size=Coalesce(Subquery(counts), 0))
+    Household.objects.using(using).filter(size=0).delete()
+
+def load_data(filename, batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    function to load data records from a csv file into django model instances
+
+    the file is streamed one row at a time with the csv module and the voters are
+    written with bulk_create in batches of batch_size, all inside one transaction,
+    so a reload is a handful of INSERT statements and a single commit
+
+    Returns:
+        dict: counts of created voters and of duplicate rows skipped
+    '''
+    counts = {'created': 0, 'duplicates': 0}
+    with open(filename, newline='') as f, transaction.atomic():
+        rows = VoterRows(f)
+
+        # delete all existing voter records to avoid duplicates when reloading
+        Voter.objects.all().delete()
+
+        households = HouseholdIndex()
+        batch = []
+        for fields in rows:
+            batch.append(row_to_voter(fields))
+            if len(batch) >= batch_size:
+                households.assign(batch)
+                Voter.objects.bulk_create(batch)
+                counts['created'] += len(batch)
+                batch = []
+
+        # write whatever is left over in the last partial batch
+        if batch:
+            households.assign(batch)
+            Voter.objects.bulk_create(batch)
+            counts['created'] += len(batch)
+        counts['duplicates'] = rows.duplicates
+
+        rebuild_voter_rollup()
+        update_household_sizes()
+
+        # invalidate cached analytics once the new data is committed
+        transaction.on_commit(bump_data_version)
+
+    return counts
+
+def upsert_data(filename, batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    incrementally reload the csv file, keyed on the voter id column
+
+    new voters are inserted, voters whose row hash changed are updated, and voters
+    missing from the file are deleted. unchanged voters cost no writes, and existing
+    voters keep their primary keys so /voter_analytics/voter/<pk>/ links stay valid
+
+    Returns:
+        dict: counts of created, updated, unchanged and deleted voters, and of
+        duplicate rows skipped
+    '''
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'duplicates': 0}
+
+    with open(filename, newline='') as f, transaction.atomic():
+        # map each known voter id to its primary key and last seen row hash
+        existing = {
+            voter_id: (pk, content_hash)
+            for pk, voter_id, content_hash in
+            Voter.objects.exclude(voter_id=None).values_list('pk', 'voter_id', 'content_hash').iterator()
+        }
+        rows = VoterRows(f)
+        households = HouseholdIndex()
+
+        to_create = []
+        to_update = []
+        for fields in rows:
+            match = existing.get(fields[0].strip())
+            if match is None:
+                to_create.append(row_to_voter(fields))
+            elif match[1] != row_hash(fields):
+                voter = row_to_voter(fields)
+                voter.pk = match[0]
+                to_update.append(voter)
+            else:
+                counts['unchanged'] += 1
+
+            if len(to_create) >= batch_size:
+                households.assign(to_create)
+                Voter.objects.bulk_create(to_create)
+                counts['created'] += len(to_create)
+                to_create = []
+            if len(to_update) >= batch_size:
+                households.assign(to_update)
+                Voter.objects.bulk_update(to_update, UPDATE_FIELDS)
+                counts['updated'] += len(to_update)
+                to_update = []
+
+        # write whatever is left over in the last partial batches
+        if to_create:
+            households.assign(to_create)
+            Voter.objects.bulk_create(to_create)
+            counts['created'] += len(to_create)
+        if to_update:
+            households.assign(to_update)
+            Voter.objects.bulk_update(to_update, UPDATE_FIELDS)
+            counts['updated'] += len(to_update)
+        counts['duplicates'] = rows.duplicates
+
+        # delete voters that are no longer in the file, along with any legacy
+        # rows loaded before voter ids were stored, since they can't be matched
+        missing = [pk for voter_id, (pk, _) in existing.items() if voter_id not in rows.seen]
+        for i in range(0, len(missing), batch_size):
+            deleted, _ = Voter.objects.filter(pk__in=missing[i:i + batch_size]).delete()
+            counts['deleted'] += deleted
+        deleted, _ = Voter.objects.filter(voter_id=None).delete()
+        counts['deleted'] += deleted
+
+        # refresh the rollup and invalidate cached analytics once the changes are
+        # committed, unless nothing changed
+        if counts['created'] or counts['updated'] or counts['deleted']:
+            rebuild_voter_rollup()
+            update_household_sizes()
+            transaction.on_commit(bump_data_version)
+
+    return counts
+
 def print_all_voters():
     for voter in Voter.objects.all():
         print(voter)
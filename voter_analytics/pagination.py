@@ -0,0 +1,129 @@
+# pagination.py
+# keyset (seek) pagination for the voter list
+# instead of OFFSET, each page is fetched with a WHERE clause that starts right after
+# the last row of the previous page, so the database seeks straight to the page
+# through the (last_name, first_name, id) index no matter how deep the page is
+
+import base64
+import json
+
+from django.db.models import Q
+
+# the orderings that can be paged through, each ending in the unique id column
+KEYSET_ORDERINGS = {
+    'name': ('last_name', 'first_name', 'id'),
+    'id': ('id',),
+}
+
+# largest id a database can store (signed 64 bit)
+MAX_ID = 2**63 - 1
+
+class InvalidCursor(Exception):
+    """raised when a cursor from the url can't be decoded"""
+
+
+def encode_cursor(ordering, direction, key):
+    '''return an opaque, url safe cursor for the row with sort key values key'''
+    payload = json.dumps({'o': ordering, 'd': direction, 'k': list(key)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    '''return the (ordering, direction, key) stored in a cursor made by encode_cursor'''
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        ordering, direction, key = payload['o'], payload['d'], payload['k']
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+    if (ordering not in KEYSET_ORDERINGS or direction not in ('next', 'prev')
+            or not isinstance(key, list) or len(key) != len(KEYSET_ORDERINGS[ordering])):
+        raise InvalidCursor(cursor)
+    # every ordering is names followed by a positive 64 bit integer id; anything else
+    # would only fail later, inside the query
+    if (not all(isinstance(value, str) for value in key[:-1])
+            or not isinstance(key[-1], int) or isinstance(key[-1], bool)
+            or not 1 <= key[-1] <= MAX_ID):
+        raise InvalidCursor(cursor)
+    return ordering, direction, key
+
+def seek_filter(fields, key, forward=True):
+    '''
+    return a Q object selecting the rows that sort after (or before) key
+
+    (a, b, c) > (x, y, z) is expanded to a >= x AND (a > x OR (a = x AND (b > y OR ...)))
+    the leading a >= x lets the database start an index range scan at the cursor
+    '''
+    lookup = 'gt' if forward else 'lt'
+    condition = Q(**{f'{fields[-1]}__{lookup}': key[-1]})
+    for field, value in zip(reversed(fields[:-1]), reversed(key[:-1])):
+        condition = Q(**{f'{field}__{lookup}': value}) | (Q(**{field: value}) & condition)
+    if len(fields) > 1:
+        condition &= Q(**{f'{fields[0]}__{lookup}e': key[0]})
+    return condition
+
+
+class KeysetPage:
+    """one page of keyset pagination, with cursors pointing to its neighbors"""
+
+    def __init__(self, object_list, ordering, has_next, has_previous):
+        self.object_list = object_list
+        self.ordering = ordering
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def _key(self, obj):
+        return [getattr(obj, field) for field in KEYSET_ORDERINGS[self.ordering]]
+
+    @property
+    def next_cursor(self):
+        '''cursor for the page after this one, or None on the last page'''
+        if not self.has_next or not self.object_list:
+            return None
+        return encode_cursor(self.ordering, 'next', self._key(self.object_list[-1]))
+
+    @property
+    def previous_cursor(self):
+        '''cursor for the page before this one, or None on the first page'''
+        if not self.has_previous or not self.object_list:
+            return None
+        return encode_cursor(self.ordering, 'prev', self._key(self.object_list[0]))
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def paginate_keyset(queryset, per_page, cursor=None, ordering='name'):
+    '''
+    return the KeysetPage of queryset that follows (or precedes) cursor
+
+    without a cursor the first page in the given ordering is returned. one extra
+    row is fetched to find out whether there is another page in the same direction
+    '''
+    if cursor:
+        ordering, direction, key = decode_cursor(cursor)
+    else:
+        direction, key = 'next', None
+    if ordering not in KEYSET_ORDERINGS:
+        raise InvalidCursor(ordering)
+
+    fields = KEYSET_ORDERINGS[ordering]
+    forward = direction == 'next'
+    if key is not None:
+        queryset = queryset.filter(seek_filter(fields, key, forward=forward))
+
+    order_by = fields if forward else [f'-{field}' for field in fields]
+    rows = list(queryset.order_by(*order_by)[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if forward:
+        return KeysetPage(rows, ordering, has_next=has_more, has_previous=key is not None)
+    # previous pages are fetched backwards, so flip them into display order
+    rows.reverse()
+    return KeysetPage(rows, ordering, has_next=True, has_previous=has_more)
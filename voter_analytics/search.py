@@ -0,0 +1,90 @@
+# search.py
+# name and address search over voters (first_name, last_name, street_name)
+# on sqlite the search runs against an FTS5 index (voter_analytics_voter_fts) that
+# database triggers keep in sync with the Voter table, matching each search word as
+# a prefix. on postgres it uses pg_trgm trigram indexes, which also give fuzzy
+# matches for misspelled names, ranked by similarity. other databases fall back to
+# prefix LIKE queries
+
+import re
+
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import F, Q
+from django.dispatch import receiver
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'voter_analytics_voter_fts'
+
+# the Voter columns covered by the search
+SEARCH_FIELDS = ['first_name', 'last_name', 'street_name']
+
+def search_terms(text):
+    '''split a search string into lowercase words, dropping punctuation'''
+    return re.findall(r'\w+', (text or '').lower())
+
+# whether each database connection (by alias) has the FTS5 index, checked once per
+# connection: a new connection may be to a database that was migrated since
+_fts_connections = {}
+
+@receiver(connection_created)
+def forget_fts_available(sender, connection, **kwargs):
+    '''check for the FTS5 index again on a newly opened connection'''
+    _fts_connections.pop(connection.alias, None)
+
+def fts_available():
+    '''return True if the sqlite FTS5 index exists in the current database'''
+    if connection.vendor != 'sqlite':
+        return False
+    connection.ensure_connection()
+    if connection.alias not in _fts_connections:
+        _fts_connections[connection.alias] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_connections[connection.alias]
+
+def fts_match_expression(terms):
+    '''build an FTS5 query that requires every term as a prefix of some indexed word'''
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search_voters(queryset, text):
+    '''return queryset narrowed to voters whose name or street matches every word of text'''
+    terms = search_terms(text)
+    if not terms:
+        return queryset
+
+    if fts_available():
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [fts_match_expression(terms)],
+        ))
+
+    if connection.vendor == 'postgresql':
+        # imported here since they need the postgres driver
+        from django.contrib.postgres.lookups import TrigramSimilar
+        from django.contrib.postgres.search import TrigramSimilarity
+        from django.db.models.functions import Greatest
+
+        # both conditions can be answered from the gin trigram indexes: the prefix match
+        # as an anchored case-insensitive regex (~*), and the fuzzy match with the %
+        # operator, which compares against pg_trgm.similarity_threshold (0.3 by default).
+        # a similarity() >= threshold comparison would have to scan every voter instead
+        ranks = []
+        for term in terms:
+            condition = Q()
+            for field in SEARCH_FIELDS:
+                condition |= Q(**{f'{field}__iregex': f'^{re.escape(term)}'}) | Q(TrigramSimilar(F(field), term))
+            queryset = queryset.filter(condition)
+            ranks.append(Greatest(*[TrigramSimilarity(field, term) for field in SEARCH_FIELDS]))
+
+        # the closest matches first, summed over the search words
+        return queryset.annotate(search_rank=sum(ranks[1:], ranks[0])).order_by('-search_rank', 'pk')
+
+    for term in terms:
+        queryset = queryset.filter(prefix_filter(term))
+    return queryset
+
+def prefix_filter(term):
+    '''return a Q object matching voters with a name or street starting with term'''
+    condition = Q()
+    for field in SEARCH_FIELDS:
+        condition |= Q(**{f'{field}__istartswith': term})
+    return condition
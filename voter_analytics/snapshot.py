@@ -0,0 +1,169 @@
+# snapshot.py
+# optional in-memory, columnar copy of the Voter table for the read-only analytics pages
+# the filterable columns are loaded once into numpy arrays (party and precinct as
+# categorical codes, dob as int days, the election flags packed into a bitmask), and
+# every filter combination is evaluated as a vectorized boolean mask instead of SQL
+# the snapshot is rebuilt whenever the voter data version changes
+# enable it with VOTER_ANALYTICS_SNAPSHOT = True in settings (requires numpy)
+
+import threading
+from datetime import date
+
+from django.conf import settings
+
+from .aggregates import ELECTIONS
+from .cache import get_data_version
+from .models import Voter
+
+try:
+    import numpy as np
+except ImportError:     # the snapshot engine is optional
+    np = None
+
+class VoterSnapshot:
+    """columnar arrays of the filterable Voter fields, ordered by primary key"""
+
+    def __init__(self, version):
+        self.version = version
+
+        rows = Voter.objects.order_by('pk').values_list(
+            'pk', 'party', 'precinct_num', 'dob', 'voter_score', *ELECTIONS
+        ).iterator(chunk_size=5000)
+
+        ids, parties, precincts, dob_days, scores, bits = [], [], [], [], [], []
+        for pk, party, precinct_num, dob, voter_score, *votes in rows:
+            ids.append(pk)
+            parties.append(party)
+            precincts.append(precinct_num)
+            dob_days.append(dob.toordinal())
+            scores.append(voter_score)
+            bits.append(sum(1 << i for i, voted in enumerate(votes) if voted))
+
+        self.ids = np.array(ids, dtype=np.int64)
+        # categorical columns: the distinct values, plus an array of codes into them
+        self.parties, self.party_codes = self._categorical(parties)
+        self.precincts, self.precinct_codes = self._categorical(precincts)
+        self.dob_days = np.array(dob_days, dtype=np.int32)
+        self.birth_years = np.array([date.fromordinal(day).year for day in dob_days], dtype=np.int16)
+        self.voter_scores = np.array(scores, dtype=np.int16)
+        self.election_bits = np.array(bits, dtype=np.uint8)
+
+    @staticmethod
+    def _categorical(values):
+        '''return (categories, codes) for a list of strings'''
+        categories, codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+        return [str(category) for category in categories], codes.astype(np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def supports(self, voter_filter):
+        '''return True if every active filter can be evaluated against the snapshot'''
+        # party, birth year, voter score and election filters are all snapshot columns,
+        # but names and streets are not
+        return voter_filter.q is None
+
+    def mask(self, voter_filter):
+        '''return a boolean array selecting the voters that match voter_filter'''
+        mask = np.ones(len(self.ids), dtype=bool)
+
+        if voter_filter.party is not None:
+            if voter_filter.party not in self.parties:
+                return np.zeros(len(self.ids), dtype=bool)
+            mask &= self.party_codes == self.parties.index(voter_filter.party)
+        if voter_filter.min_dob is not None:
+            mask &= self.dob_days >= voter_filter._year_start(voter_filter.min_dob).toordinal()
+        if voter_filter.max_dob is not None:
+            mask &= self.dob_days <= voter_filter._year_end(voter_filter.max_dob).toordinal()
+        if voter_filter.voter_score is not None:
+            mask &= self.voter_scores == voter_filter.voter_score
+        required = sum(1 << ELECTIONS.index(election) for election in voter_filter.elections)
+        if required:
+            mask &= (self.election_bits & required) == required
+
+        return mask
+
+    def matching_ids(self, voter_filter):
+        '''return the primary keys of the matching voters, in primary key order'''
+        return self.ids[self.mask(voter_filter)]
+
+    @staticmethod
+    def _histogram(values, width):
+        '''return (bin start, count) pairs for an integer array, binned like aggregates.histogram'''
+        starts, counts = np.unique(values // width * width, return_counts=True)
+        return [(int(start), int(count)) for start, count in zip(starts, counts)]
+
+    def chart_data(self, voter_filter, bins):
+        '''return the same aggregated chart data as charts.get_chart_data, computed from the arrays'''
+        mask = self.mask(voter_filter)
+
+        years, year_counts = np.unique(self.birth_years[mask], return_counts=True)
+
+        party_totals = np.bincount(self.party_codes[mask], minlength=len(self.parties))
+        parties = sorted(
+            ((party, int(count)) for party, count in zip(self.parties, party_totals) if party and count),
+            key=lambda item: (-item[1], item[0]),
+        )
+
+        bits = self.election_bits[mask]
+        elections = {election: int(np.count_nonzero(bits & (1 << i))) for i, election in enumerate(ELECTIONS)}
+
+        return {
+            'birth_years': [(int(year), int(count)) for year, count in zip(years, year_counts)],
+            'parties': parties,
+            'elections': elections,
+            'bins': bins,
+            'age_bands': self._histogram(date.today().year - self.birth_years[mask].astype(np.int32), bins['age']),
+            'voter_scores': self._histogram(self.voter_scores[mask].astype(np.int32), bins['voter_score']),
+        }
+
+
+class SnapshotVoterList:
+    """
+    sequence of the voters with the given primary keys, for use as a ListView object_list
+
+    slicing it (as the paginator does for each page) loads only that page's voters
+    from the database, with a single primary key lookup
+    """
+    model = Voter
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            page_ids = [int(pk) for pk in self.ids[index]]
+            voters = Voter.objects.in_bulk(page_ids)
+            return [voters[pk] for pk in page_ids if pk in voters]
+        return Voter.objects.get(pk=int(self.ids[index]))
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def snapshot_enabled():
+    '''return True if the snapshot engine is switched on and numpy is available'''
+    return np is not None and getattr(settings, 'VOTER_ANALYTICS_SNAPSHOT', False)
+
+def get_snapshot():
+    '''return the snapshot for the current data version, building it if needed, or None if disabled'''
+    global _snapshot
+    if not snapshot_enabled():
+        return None
+
+    version = get_data_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _snapshot_lock:
+        # another thread may have rebuilt it while we waited for the lock
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = VoterSnapshot(version)
+        return _snapshot
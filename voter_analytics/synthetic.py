@@ -0,0 +1,103 @@
+# synthetic.py
+# generates fake Voter records with roughly realistic distributions for the
+# newton voter file, used by the benchmark management commands so that query
+# plans and timings can be measured without the real (private) voter data
+
+import random
+from datetime import date, timedelta
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .cache import bump_data_version
+from .models import DEFAULT_BATCH_SIZE, HouseholdIndex, Voter, rebuild_voter_rollup, update_household_sizes
+
+FIRST_NAMES = [
+    'James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda',
+    'William', 'Elizabeth', 'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica',
+    'Thomas', 'Sarah', 'Charles', 'Karen', 'Wei', 'Priya', 'Carlos', 'Elitsa',
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis',
+    'Rodriguez', 'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson',
+    'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin', 'Lee', 'Chen', 'Cohen', 'Murphy',
+]
+STREET_NAMES = [
+    'WASHINGTON ST', 'BEACON ST', 'COMMONWEALTH AVE', 'WALNUT ST', 'CENTRE ST',
+    'BOYLSTON ST', 'CHESTNUT ST', 'LEXINGTON ST', 'AUBURN ST', 'HAMMOND ST',
+]
+ZIP_CODES = ['02458', '02459', '02460', '02461', '02462', '02464', '02465', '02466', '02468']
+
+# party codes as they appear in the voter file, weighted towards unenrolled voters
+PARTIES = ['U ', 'D ', 'R ', 'J ', 'L ', 'CC', 'G ', 'X ']
+PARTY_WEIGHTS = [55, 33, 7, 1, 1, 1, 1, 1]
+
+PRECINCTS = [f'{ward}{letter}' for ward in range(1, 9) for letter in 'ABCD']
+
+# probability of voting in each election, in the order of Voter's election fields
+TURNOUT = [0.85, 0.35, 0.20, 0.70, 0.30]
+
+def generate_voters(count, seed=None):
+    '''yield count unsaved Voter instances built from a seeded random generator'''
+    rng = random.Random(seed)
+    first_dob = date(1925, 1, 1).toordinal()
+    last_dob = date(2005, 12, 31).toordinal()
+
+    for i in range(count):
+        dob = date.fromordinal(rng.randint(first_dob, last_dob))
+        # voters register some time after their 18th birthday
+        reg_date = dob.replace(year=dob.year + 18, day=1) + timedelta(days=rng.randint(0, 365 * 20))
+        votes = [rng.random() < p for p in TURNOUT]
+
+        yield Voter(
+            voter_id=f'S{i:09d}',
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            street_num=str(rng.randint(1, 999)),
+            street_name=rng.choice(STREET_NAMES),
+            apt_num=str(rng.randint(1, 12)) if rng.random() < 0.3 else None,
+            zip_code=rng.choice(ZIP_CODES),
+            dob=dob,
+            reg_date=min(reg_date, date(2023, 12, 31)),
+            party=rng.choices(PARTIES, weights=PARTY_WEIGHTS)[0],
+            precinct_num=rng.choice(PRECINCTS),
+            v20state=votes[0],
+            v21town=votes[1],
+            v21primary=votes[2],
+            v22general=votes[3],
+            v23town=votes[4],
+            voter_score=sum(votes),
+        )
+
+def load_synthetic_voters(count, seed=None, batch_size=DEFAULT_BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    '''
+    replace every voter in the using database with count synthetic voters, the same way
+    load_data does for the csv file: batched inserts with households assigned, then
+    the rollup and household sizes rebuilt, all in one transaction
+
+    Returns:
+        int: the number of voters loaded
+    '''
+    with transaction.atomic(using=using):
+        Voter.objects.using(using).all().delete()
+
+        households = HouseholdIndex(using=using)
+        batch = []
+        for voter in generate_voters(count, seed=seed):
+            batch.append(voter)
+            if len(batch) >= batch_size:
+                households.assign(batch)
+                Voter.objects.using(using).bulk_create(batch)
+                batch = []
+        if batch:
+            households.assign(batch)
+            Voter.objects.using(using).bulk_create(batch)
+
+        rebuild_voter_rollup(using=using)
+        update_household_sizes(using=using)
+
+        # invalidate cached analytics once the new data is committed. the site and its
+        # caches only read the default database, so loading any other one leaves them be
+        if using == DEFAULT_DB_ALIAS:
+            transaction.on_commit(bump_data_version, using=using)
+
+    return count
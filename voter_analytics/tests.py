@@ -1,3 +1,738 @@
-from django.test import TestCase
+# tests.py for voter_analytics
+# - SyntheticVoterTests: the synthetic voter generator and the generate_voters guard
+# - BenchmarkRegressionTests: the benchmark command's regression gate
+# - VoterFilterTests: equivalent filter parameters share a canonical cache key
+# - CrosstabTests: participation cross-tab cells against plain voter counts
+# - ChartCacheTests: the size-bounded LRU cache of rendered chart fragments
+# - GraphsDataTests: the json chart series and their ETag revalidation
+# - RollupTests: aggregates read from VoterRollup equal the same aggregates over the Voter table
+# - SnapshotTests: the in-memory snapshot finds and counts the same voters as the ORM
+# - KeysetPaginationTests: cursors round-trip, pages never skip or repeat voters, bad cursors are rejected
+# - ExportTests: csv and parquet exports round-trip the filtered voters
+# - AddressKeyTests: spellings of one address normalize to one household key
+# - VoterDetailTests: the voter detail page and its co-residents
+# - LoaderTests: the counts reported by load_data and upsert_data, and repeated voter ids
+# - SearchTests: name and street search, and the per-connection check for the FTS5 index
 
-# Create your tests here.
+import csv
+import io
+import os
+import tempfile
+from datetime import date
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import snapshot
+from .addresses import address_key
+from .aggregates import (ELECTIONS, birth_year_counts, election_counts, get_participation_crosstab, histogram,
+                         party_counts, precinct_stats)
+from .cache import bump_data_version, get_data_version
+from .charts import ChartCache, get_chart_fragments
+from .export import EXPORT_FIELDS, parquet_available
+from .filters import VoterFilter
+from .management.commands.benchmark_voter_views import find_regressions
+from .models import Household, Voter, VoterRollup, load_data, rebuild_voter_rollup, upsert_data
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, paginate_keyset
+from .search import _fts_connections, fts_available, prefix_filter, search_voters
+from .snapshot import VoterSnapshot
+from .synthetic import load_synthetic_voters
+
+# the tests never touch the file based cache the site uses
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                           'LOCATION': 'voter_analytics_tests'}}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SyntheticVoterTests(TestCase):
+    '''the synthetic voters loaded by the benchmarks'''
+    databases = {'default', 'synthetic'}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_load_synthetic_voters(self):
+        load_synthetic_voters(500, seed=1)
+        self.assertEqual(Voter.objects.count(), 500)
+        self.assertFalse(Voter.objects.filter(household=None).exists())
+        self.assertEqual(sum(Household.objects.values_list('size', flat=True)), 500)
+        self.assertEqual(sum(VoterRollup.objects.values_list('voters', flat=True)), 500)
+
+    def test_same_seed_same_voters(self):
+        load_synthetic_voters(50, seed=7)
+        first = list(Voter.objects.order_by('voter_id').values_list('last_name', 'dob', 'party'))
+        load_synthetic_voters(50, seed=7)
+        self.assertEqual(list(Voter.objects.order_by('voter_id').values_list('last_name', 'dob', 'party')), first)
+
+    def test_only_a_load_into_the_default_database_bumps_the_data_version(self):
+        version = get_data_version()
+        with self.captureOnCommitCallbacks(execute=True, using='synthetic') as callbacks:
+            load_synthetic_voters(20, seed=2, using='synthetic')
+        self.assertEqual(callbacks, [])
+        self.assertEqual(Voter.objects.using('synthetic').count(), 20)
+        self.assertFalse(Voter.objects.exists())
+        self.assertEqual(get_data_version(), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            load_synthetic_voters(20, seed=2)
+        self.assertEqual(get_data_version(), version + 1)
+
+    def test_generate_voters_refuses_the_default_database(self):
+        Voter.objects.create(voter_id='REAL', first_name='Real', last_name='Voter', street_num='1',
+                             street_name='MAIN ST', zip_code='02458', dob='1980-01-01', reg_date='2000-01-01',
+                             party='D ', precinct_num='1A', voter_score=0)
+        with self.assertRaises(CommandError):
+            call_command('generate_voters', 10, database='default')
+        with self.assertRaises(CommandError):
+            call_command('generate_voters', 10, database='missing')
+        self.assertEqual(list(Voter.objects.values_list('voter_id', flat=True)), ['REAL'])
+
+
+class BenchmarkRegressionTests(TestCase):
+    '''find_regressions decides whether benchmark_voter_views exits with an error'''
+
+    def result(self, scenario='list', status=(200,), p95_ms=10.0, queries=4):
+        return {'scenario': scenario, 'status': list(status), 'p50_ms': p95_ms / 2, 'p95_ms': p95_ms,
+                'queries': queries, 'peak_kb': 100}
+
+    def test_matching_run_passes(self):
+        self.assertEqual(find_regressions([self.result()], [self.result()]), [])
+
+    def test_slower_within_tolerance_passes(self):
+        self.assertEqual(find_regressions([self.result(p95_ms=14.0)], [self.result()], tolerance=0.5), [])
+
+    def test_more_queries_fails(self):
+        self.assertEqual(len(find_regressions([self.result(queries=5)], [self.result()])), 1)
+
+    def test_slower_than_tolerance_fails(self):
+        self.assertEqual(len(find_regressions([self.result(p95_ms=16.0)], [self.result()], tolerance=0.5)), 1)
+
+    def test_query_budget_and_status_fail_without_baseline(self):
+        regressions = find_regressions([self.result(queries=9), self.result('detail', status=(500,))],
+                                       max_queries=8)
+        self.assertEqual(len(regressions), 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class VoterFilterTests(TestCase):
+    '''VoterFilter's canonical filters and cache keys'''
+
+    def voter_filter(self, querystring):
+        return VoterFilter(QueryDict(querystring))
+
+    def test_parameter_order_does_not_change_the_key(self):
+        first = self.voter_filter('party=D+&min_dob=1950&v20state=on&max_dob=1990')
+        second = self.voter_filter('max_dob=1990&v20state=on&party=D+&min_dob=1950')
+        self.assertEqual(first.cache_key, second.cache_key)
+        self.assertEqual(first.querystring, second.querystring)
+
+    def test_empty_and_invalid_values_are_ignored(self):
+        plain = self.voter_filter('party=R+')
+        noisy = self.voter_filter('party=R+&min_dob=&max_dob=soon&voter_score=x&v21town=&page=3&order=dob')
+        self.assertEqual(noisy.cache_key, plain.cache_key)
+        self.assertEqual(self.voter_filter('party=').params, [])
+
+    def test_out_of_range_numbers_are_clamped(self):
+        huge = '9' * 30
+        voter_filter = self.voter_filter(f'min_dob=-{huge}&max_dob={huge}&voter_score={huge}')
+        self.assertEqual((voter_filter.min_dob, voter_filter.max_dob, voter_filter.voter_score), (1, 9999, 2**31 - 1))
+        clamped = self.voter_filter('min_dob=0&max_dob=10000&voter_score=3000000000')
+        self.assertEqual(voter_filter.cache_key, clamped.cache_key)
+        self.assertEqual(list(voter_filter.queryset()), [])
+        self.assertEqual(self.voter_filter(f'voter_score=-{huge}').voter_score, -2**31)
+
+    def test_search_is_normalized(self):
+        self.assertEqual(self.voter_filter('q=++Pat%20MAIN++').cache_key, self.voter_filter('q=pat+main').cache_key)
+
+    def test_different_filters_have_different_keys(self):
+        keys = {self.voter_filter(querystring).cache_key for querystring in
+                ('', 'party=D+', 'party=R+', 'min_dob=1950', 'max_dob=1950', 'voter_score=3',
+                 'v20state=on', 'v21town=on', 'q=pat')}
+        self.assertEqual(len(keys), 9)
+
+    def test_equal_keys_match_the_same_voters(self):
+        load_synthetic_voters(200, seed=5)
+        first = self.voter_filter('min_dob=1960&max_dob=1990&v22general=on&page=2')
+        second = self.voter_filter('v22general=yes&max_dob=1990&min_dob=1960&voter_score=')
+        self.assertEqual(first.cache_key, second.cache_key)
+        self.assertEqual(list(first.queryset().values_list('pk', flat=True)),
+                         list(second.queryset().values_list('pk', flat=True)))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CrosstabTests(TestCase):
+    '''get_participation_crosstab against Voter.objects.filter(...).count()'''
+
+    @classmethod
+    def setUpTestData(cls):
+        load_synthetic_voters(300, seed=29)
+
+    def setUp(self):
+        cache.clear()
+
+    def pattern_filter(self, pattern):
+        '''return the filter matching voters whose participation is exactly pattern'''
+        return {election: bool(pattern & (1 << i)) for i, election in enumerate(ELECTIONS)}
+
+    def column_filter(self, by, label, band_width):
+        '''return the filter matching voters in a party column or an age band column'''
+        if by == 'party':
+            return {'party': label}
+        low = int(label.split('-')[0])
+        year = date.today().year
+        return {'dob__year__gte': year - low - band_width + 1, 'dob__year__lte': year - low}
+
+    def assertCellsMatch(self, querystring, by, band_width=10):
+        voter_filter = VoterFilter(QueryDict(querystring))
+        voters = voter_filter.queryset()
+        self.assertTrue(voters.exists(), querystring)
+        crosstab = get_participation_crosstab(voter_filter, by=by, band_width=band_width, use_cache=False)
+        self.assertEqual(sum(row['total'] for row in crosstab['rows']), voters.count())
+        patterns = set()
+        for row in crosstab['rows']:
+            patterns.add(row['pattern'])
+            self.assertEqual(row['elections'], [e for e, voted in self.pattern_filter(row['pattern']).items() if voted])
+            for label, count in zip(crosstab['columns'], row['counts']):
+                expected = voters.filter(**self.pattern_filter(row['pattern']),
+                                         **self.column_filter(by, label, band_width)).count()
+                self.assertEqual(count, expected, (querystring, by, row['pattern'], label))
+        # every pattern left out of the table has no voters
+        for pattern in set(range(1 << len(ELECTIONS))) - patterns:
+            self.assertFalse(voters.filter(**self.pattern_filter(pattern)).exists(), pattern)
+
+    def test_crosstab_by_party(self):
+        for querystring in ('', 'min_dob=1950&max_dob=1980', 'v22general=on'):
+            self.assertCellsMatch(querystring, 'party')
+
+    def test_crosstab_by_age_band(self):
+        for band_width in (10, 7):
+            self.assertCellsMatch('', 'age_band', band_width)
+        self.assertCellsMatch('party=U+', 'age_band', 15)
+
+    def test_crosstab_without_the_rollup(self):
+        # a name search can't be answered from the rollup, so the Voter table is grouped
+        self.assertCellsMatch('q=smith', 'party')
+        self.assertCellsMatch('q=smith', 'age_band')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ChartCacheTests(TestCase):
+    '''ChartCache, and its use by get_chart_fragments'''
+
+    def setUp(self):
+        cache.clear()
+
+    def fragments(self, size):
+        return {'chart': 'x' * size}
+
+    def test_least_recently_used_entries_are_evicted_at_capacity(self):
+        chart_cache = ChartCache(max_bytes=30)
+        for key in 'abc':
+            chart_cache.set(1, key, self.fragments(10))
+        self.assertEqual((len(chart_cache), chart_cache.current_bytes), (3, 30))
+        chart_cache.set(1, 'd', self.fragments(10))
+        self.assertIsNone(chart_cache.get(1, 'a'))
+        self.assertEqual([chart_cache.get(1, key) is not None for key in 'bcd'], [True, True, True])
+        self.assertEqual(chart_cache.current_bytes, 30)
+
+    def test_a_hit_makes_an_entry_recently_used(self):
+        chart_cache = ChartCache(max_bytes=30)
+        for key in 'abc':
+            chart_cache.set(1, key, self.fragments(10))
+        self.assertEqual(chart_cache.get(1, 'a'), self.fragments(10))
+        chart_cache.set(1, 'd', self.fragments(15))
+        # b and c were used least recently, and both have to go to make room
+        self.assertIsNone(chart_cache.get(1, 'b'))
+        self.assertIsNone(chart_cache.get(1, 'c'))
+        self.assertIsNotNone(chart_cache.get(1, 'a'))
+        self.assertEqual(chart_cache.current_bytes, 25)
+
+    def test_replacing_and_oversized_entries_keep_the_size_right(self):
+        chart_cache = ChartCache(max_bytes=30)
+        chart_cache.set(1, 'a', self.fragments(10))
+        chart_cache.set(1, 'a', self.fragments(20))
+        self.assertEqual((len(chart_cache), chart_cache.current_bytes), (1, 20))
+        chart_cache.set(1, 'b', self.fragments(31))
+        self.assertIsNone(chart_cache.get(1, 'b'))
+        self.assertIsNotNone(chart_cache.get(1, 'a'))
+
+    def test_a_new_data_version_drops_the_older_entries(self):
+        chart_cache = ChartCache(max_bytes=30)
+        chart_cache.set(1, 'a', self.fragments(10))
+        self.assertIsNone(chart_cache.get(2, 'a'))
+        chart_cache.set(2, 'b', self.fragments(10))
+        self.assertEqual((len(chart_cache), chart_cache.current_bytes), (1, 10))
+        self.assertIsNone(chart_cache.get(1, 'a'))
+
+    def test_fragments_are_rendered_again_after_a_data_version_bump(self):
+        voter_filter = VoterFilter(QueryDict('party=D+'))
+        with mock.patch('voter_analytics.charts.chart_cache', ChartCache(max_bytes=10**6)), \
+                mock.patch('voter_analytics.charts.render_charts', return_value={'chart': 'html'}) as render:
+            get_chart_fragments(voter_filter, voter_filter.queryset())
+            get_chart_fragments(voter_filter, voter_filter.queryset())
+            self.assertEqual(render.call_count, 1)
+            bump_data_version()
+            get_chart_fragments(voter_filter, voter_filter.queryset())
+            self.assertEqual(render.call_count, 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class GraphsDataTests(TestCase):
+    '''GraphsDataView and graphs_data_etag'''
+
+    @classmethod
+    def setUpTestData(cls):
+        load_synthetic_voters(200, seed=23)
+
+    def setUp(self):
+        cache.clear()
+        self.url = f"{reverse('graphs_data')}?party=D+&age_bin_width=20"
+
+    def test_series_shape(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        data = response.json()
+        self.assertEqual(set(data), {'birth_years', 'parties', 'elections', 'age_bands', 'voter_scores'})
+        for name, series in data.items():
+            self.assertEqual(set(series), {'labels', 'counts'}, name)
+            self.assertEqual(len(series['labels']), len(series['counts']), name)
+
+        democrats = Voter.objects.filter(party='D ')
+        self.assertEqual(data['parties'], {'labels': ['D '], 'counts': [democrats.count()]})
+        self.assertEqual(data['elections']['labels'], ELECTIONS)
+        self.assertEqual(sum(data['birth_years']['counts']), democrats.count())
+        self.assertEqual(sum(data['age_bands']['counts']), democrats.count())
+        self.assertTrue(all(label.endswith(str(int(label.split('-')[0]) + 19))
+                            for label in data['age_bands']['labels']))
+
+    def test_etag_revalidation(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertTrue(etag)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # another filter, or the same one after a reload, has a different ETag
+        self.assertNotEqual(self.client.get(reverse('graphs_data'))['ETag'], etag)
+        bump_data_version()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+# filter combinations the aggregates are compared under, including ones matching nobody
+FILTER_QUERYSTRINGS = [
+    '', 'party=D+', 'party=R+&v22general=on', 'min_dob=1950&max_dob=1979', 'max_dob=1940&voter_score=1',
+    'v20state=on&v21town=on&v21primary=on', 'voter_score=5&party=U+', 'party=ZZ', 'min_dob=2050',
+]
+
+def aggregates(queryset):
+    '''return every chart aggregate of queryset'''
+    return {
+        'birth_years': birth_year_counts(queryset),
+        'parties': party_counts(queryset),
+        'elections': election_counts(queryset),
+        'age_bands': histogram(queryset, 'age', 7),
+        'voter_scores': histogram(queryset, 'voter_score', 2),
+    }
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RollupTests(TestCase):
+    '''the VoterRollup table against live aggregates over Voter'''
+
+    @classmethod
+    def setUpTestData(cls):
+        load_synthetic_voters(400, seed=11)
+
+    def setUp(self):
+        # cached results are keyed by a data version that other tests may have cached
+        cache.clear()
+
+    def assertRollupMatches(self):
+        for querystring in FILTER_QUERYSTRINGS:
+            voter_filter = VoterFilter(QueryDict(querystring))
+            self.assertEqual(aggregates(voter_filter.rollup_queryset()), aggregates(voter_filter.queryset()),
+                             querystring)
+        self.assertEqual(precinct_stats(), precinct_stats(Voter.objects.all()))
+
+    def test_rollup_matches_live_aggregates(self):
+        self.assertRollupMatches()
+
+    def test_rebuild_follows_changes_to_the_voters(self):
+        Voter.objects.filter(party='U ', voter_score__gte=3).update(party='D ', v23town=True)
+        Voter.objects.filter(pk__in=Voter.objects.order_by('pk').values('pk')[:40]).delete()
+        rebuild_voter_rollup()
+        self.assertRollupMatches()
+
+    def test_search_is_not_answered_from_the_rollup(self):
+        self.assertIsNone(VoterFilter(QueryDict('q=smith&party=D+')).rollup_queryset())
+
+    def test_out_of_range_years_are_clamped(self):
+        huge = '1' + '0' * 20
+        for url in (reverse('graphs_data'), reverse('crosstab_data')):
+            for querystring, same_as in ((f'min_dob={huge}', 'min_dob=9999'), (f'max_dob=-{huge}', 'max_dob=1'),
+                                         (f'max_dob={huge}&party=D+', 'party=D+')):
+                response = self.client.get(f'{url}?{querystring}')
+                self.assertEqual(response.status_code, 200, (url, querystring))
+                self.assertEqual(response.json(), self.client.get(f'{url}?{same_as}').json(), (url, querystring))
+        self.assertEqual(self.client.get(f"{reverse('crosstab')}?min_dob={huge}").status_code, 200)
+
+
+@skipUnless(snapshot.np is not None, 'the snapshot engine needs numpy')
+@override_settings(CACHES=TEST_CACHES)
+class SnapshotTests(TestCase):
+    '''VoterSnapshot against the ORM queries it replaces'''
+
+    @classmethod
+    def setUpTestData(cls):
+        load_synthetic_voters(400, seed=13)
+
+    def setUp(self):
+        # the process-wide snapshot and data version may be left over from other tests
+        cache.clear()
+        snapshot._snapshot = None
+        self.addCleanup(setattr, snapshot, '_snapshot', None)
+
+    def test_matching_ids_and_chart_data_match_the_orm(self):
+        voter_snapshot = VoterSnapshot(version=None)
+        self.assertEqual(len(voter_snapshot), 400)
+        for querystring in FILTER_QUERYSTRINGS:
+            voter_filter = VoterFilter(QueryDict(querystring))
+            queryset = voter_filter.queryset()
+            self.assertEqual(voter_snapshot.matching_ids(voter_filter).tolist(),
+                             list(queryset.order_by('pk').values_list('pk', flat=True)), querystring)
+            data = voter_snapshot.chart_data(voter_filter, {'age': 7, 'voter_score': 2})
+            data.pop('bins')
+            self.assertEqual(data, aggregates(queryset), querystring)
+
+    def test_search_is_left_to_the_orm(self):
+        self.assertFalse(VoterSnapshot(version=None).supports(VoterFilter(QueryDict('q=smith'))))
+
+    def test_voter_list_pages_match_the_orm(self):
+        for querystring in ('party=D+&v20state=on', 'max_dob=1960&page=2', 'party=ZZ'):
+            pages = []
+            for enabled in (False, True):
+                with self.settings(VOTER_ANALYTICS_SNAPSHOT=enabled):
+                    response = self.client.get(f"{reverse('voters')}?{querystring}")
+                self.assertEqual(response.status_code, 200)
+                page = response.context['page_obj']
+                pages.append((page.paginator.count, [voter.pk for voter in page.object_list]))
+            self.assertEqual(pages[1], pages[0], querystring)
+        self.assertIsNotNone(snapshot._snapshot)
+
+    def test_snapshot_is_rebuilt_after_a_data_reload(self):
+        with self.settings(VOTER_ANALYTICS_SNAPSHOT=True):
+            first = snapshot.get_snapshot()
+            self.assertIs(snapshot.get_snapshot(), first)
+            Voter.objects.order_by('pk').first().delete()
+            bump_data_version()
+            self.assertEqual(len(snapshot.get_snapshot()), len(first) - 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class KeysetPaginationTests(TestCase):
+    '''paginate_keyset and the cursors in the voter list urls'''
+
+    @classmethod
+    def setUpTestData(cls):
+        # few distinct names, so most pages start and end in the middle of a run of equal sort keys
+        names = [('Smith', 'Pat'), ('Smith', 'Alex'), ('Jones', 'Pat'), ('Smith', 'Pat')]
+        Voter.objects.bulk_create([
+            Voter(last_name=names[i % len(names)][0], first_name=names[i % len(names)][1], street_num='1',
+                  street_name='MAIN ST', zip_code='02458', dob='1980-01-01', reg_date='2000-01-01',
+                  party='D ', precinct_num='1A', voter_score=0)
+            for i in range(37)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def page_through(self, ordering, per_page):
+        '''follow the next cursors from the first page, then the previous cursors back'''
+        forward, backward, pages = [], [], []
+        page = paginate_keyset(Voter.objects.all(), per_page, ordering=ordering)
+        while True:
+            pages.append(page)
+            forward.extend(voter.pk for voter in page)
+            if page.next_cursor is None:
+                break
+            page = paginate_keyset(Voter.objects.all(), per_page, cursor=page.next_cursor)
+        while page.previous_cursor is not None:
+            page = paginate_keyset(Voter.objects.all(), per_page, cursor=page.previous_cursor)
+            backward = [voter.pk for voter in page] + backward
+        return forward, backward, pages
+
+    def test_cursor_round_trip(self):
+        for ordering, key in (('name', ['Smith', 'Pat', 12]), ('id', [12])):
+            for direction in ('next', 'prev'):
+                self.assertEqual(decode_cursor(encode_cursor(ordering, direction, key)), (ordering, direction, key))
+
+    def test_pages_with_ties_neither_skip_nor_repeat(self):
+        expected = {
+            'name': list(Voter.objects.order_by('last_name', 'first_name', 'id').values_list('pk', flat=True)),
+            'id': list(Voter.objects.order_by('id').values_list('pk', flat=True)),
+        }
+        for ordering, pks in expected.items():
+            for per_page in (1, 5, 10, 37, 50):
+                forward, backward, pages = self.page_through(ordering, per_page)
+                self.assertEqual(forward, pks, (ordering, per_page))
+                self.assertEqual(backward, pks[:len(pks) - len(pages[-1])], (ordering, per_page))
+                self.assertTrue(all(len(page) == per_page for page in pages[:-1]))
+
+    def test_invalid_cursors_are_rejected(self):
+        cursors = [
+            'not a cursor', '!!!!', encode_cursor('name', 'next', ['Smith', 'Pat', 12])[:-3] + 'x',
+            encode_cursor('age', 'next', [12]), encode_cursor('id', 'sideways', [12]),
+            encode_cursor('name', 'next', [12]), encode_cursor('id', 'next', ['12']),
+            encode_cursor('id', 'next', [None]), encode_cursor('id', 'next', [True]),
+            encode_cursor('name', 'next', [None, 'Pat', 12]),
+            encode_cursor('id', 'next', [10**20]), encode_cursor('id', 'prev', [2**63]),
+            encode_cursor('name', 'next', ['Smith', 'Pat', -1]), encode_cursor('id', 'next', [0]),
+        ]
+        for cursor in cursors:
+            with self.assertRaises(InvalidCursor, msg=cursor):
+                decode_cursor(cursor)
+
+    def test_tampered_cursor_in_the_url_is_not_found(self):
+        for key in (['12'], [10**20]):
+            response = self.client.get(reverse('voters'), {'cursor': encode_cursor('id', 'next', key)})
+            self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('voters'), {'cursor': encode_cursor('id', 'next', [12])})
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ExportTests(TestCase):
+    '''VoterExportView with stream_csv and stream_parquet'''
+
+    @classmethod
+    def setUpTestData(cls):
+        load_synthetic_voters(250, seed=19)
+
+    def export(self, querystring):
+        response = self.client.get(f"{reverse('export_voters')}?{querystring}")
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def expected_rows(self, querystring):
+        queryset = VoterFilter(QueryDict(querystring)).queryset().order_by('pk')
+        return [dict(zip(EXPORT_FIELDS, row)) for row in queryset.values_list(*EXPORT_FIELDS)]
+
+    def test_csv_round_trip(self):
+        # a small chunk size, so the rows are read in several chunks
+        with mock.patch('voter_analytics.export.EXPORT_CHUNK_SIZE', 7):
+            response, content = self.export('party=D+&v20state=on&format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="voters.csv"')
+
+        reader = csv.DictReader(io.StringIO(content.decode('utf-8')))
+        self.assertEqual(reader.fieldnames, EXPORT_FIELDS)
+        expected = [{field: '' if value is None else str(value) for field, value in row.items()}
+                    for row in self.expected_rows('party=D+&v20state=on')]
+        self.assertTrue(expected)
+        self.assertEqual(list(reader), expected)
+
+    @skipUnless(parquet_available(), 'parquet export needs pyarrow')
+    def test_parquet_round_trip(self):
+        import pyarrow.parquet as pq
+
+        with mock.patch('voter_analytics.export.EXPORT_CHUNK_SIZE', 7):
+            response, content = self.export('format=parquet&max_dob=1970')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="voters.parquet"')
+
+        parquet_file = pq.ParquetFile(io.BytesIO(content))
+        self.assertGreater(parquet_file.num_row_groups, 1)
+        expected = self.expected_rows('max_dob=1970')
+        self.assertTrue(expected)
+        self.assertEqual(parquet_file.read().to_pylist(), expected)
+
+    def test_empty_export_still_has_a_header(self):
+        _, content = self.export('party=ZZ')
+        self.assertEqual(content.decode('utf-8').splitlines(), [','.join(EXPORT_FIELDS)])
+
+    def test_unknown_format_is_a_bad_request(self):
+        response = self.client.get(reverse('export_voters'), {'format': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('Content-Disposition'))
+
+
+class AddressKeyTests(TestCase):
+    '''address_key'''
+
+    def test_spellings_of_one_address_share_a_key(self):
+        variants = [
+            ('12', 'Beacon Street', 'Apt 2B', '02458'),
+            ('012', 'BEACON ST', '#2b', '02458-1234'),
+            (' 12 ', 'beacon  st.', 'Unit 02B', '02458'),
+            ('12', 'Beacon Str', 'apartment 2-B', ' 02458'),
+        ]
+        self.assertEqual(len({address_key(*variant) for variant in variants}), 1)
+        self.assertEqual(address_key(*variants[0]), '12|BEACON ST|2B|02458')
+
+    def test_different_addresses_keep_different_keys(self):
+        keys = {
+            address_key('12', 'Beacon St', 'Apt 2B', '02458'),
+            address_key('12', 'Beacon St', 'Apt 3B', '02458'),
+            address_key('12', 'Beacon St', None, '02458'),
+            address_key('14', 'Beacon St', 'Apt 2B', '02458'),
+            address_key('12', 'Beacon Ave', 'Apt 2B', '02458'),
+            address_key('12', 'Beacon St', 'Apt 2B', '02459'),
+        }
+        self.assertEqual(len(keys), 6)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class VoterDetailTests(TestCase):
+    '''VoterDetailView'''
+
+    @classmethod
+    def setUpTestData(cls):
+        load_synthetic_voters(60, seed=17)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_page_is_cached_until_the_data_version_changes(self):
+        voter = Voter.objects.order_by('pk').first()
+        url = reverse('voter', args=[voter.pk])
+        self.assertContains(self.client.get(url), voter.last_name)
+        Voter.objects.filter(pk=voter.pk).update(last_name='Renamed')
+        with self.assertNumQueries(0):
+            self.assertNotContains(self.client.get(url), 'Renamed')
+        bump_data_version()
+        self.assertContains(self.client.get(url), 'Renamed')
+
+    def test_co_residents_are_the_rest_of_the_household(self):
+        rows = [voter_row('H1', last_name='Adams', street_num='5'), voter_row('H2', last_name='Baker', street_num='05'),
+                voter_row('H3', last_name='Clark', street_num='5'), voter_row('H4', last_name='Davis', street_num='7')]
+        rows[2][4] = 'Main Street'
+        load_data(write_voter_csv(self, rows))
+
+        voters = {voter.voter_id: voter for voter in Voter.objects.all()}
+        self.assertEqual([v.voter_id for v in voters['H1'].get_co_residents()], ['H2', 'H3'])
+        self.assertEqual([v.voter_id for v in voters['H3'].get_co_residents()], ['H1', 'H2'])
+        self.assertNotIn(voters['H2'], voters['H2'].get_co_residents())
+        self.assertFalse(voters['H4'].get_co_residents().exists())
+        self.assertFalse(Voter(household=None).get_co_residents().exists())
+
+        response = self.client.get(reverse('voter', args=[voters['H1'].pk]))
+        self.assertEqual([v.voter_id for v in response.context['co_residents']], ['H2', 'H3'])
+        self.assertContains(self.client.get(reverse('voter', args=[voters['H4'].pk])), 'No other voters')
+
+
+def voter_row(voter_id, last_name='Smith', street_num='1', score=2):
+    '''return one row of the newton voter file'''
+    return [voter_id, last_name, 'Pat', street_num, 'MAIN ST', '', '02458', '1980-01-01', '2000-01-01',
+            'D ', '1A', 'TRUE', 'FALSE', 'FALSE', 'TRUE', 'FALSE', str(score)]
+
+def write_voter_csv(test, rows):
+    '''write rows after a header line to a temporary csv file, removed after test, and return its path'''
+    f = tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False)
+    test.addCleanup(os.remove, f.name)
+    with f:
+        writer = csv.writer(f)
+        writer.writerow(['Voter ID Number', 'Last Name', 'First Name'])
+        writer.writerows(rows)
+    return f.name
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LoaderTests(TestCase):
+    '''load_data and upsert_data against small csv files'''
+
+    def test_load_then_upsert_counts(self):
+        path = write_voter_csv(self, [voter_row('A1'), voter_row('A2'), voter_row('A3'), voter_row('A4')])
+        self.assertEqual(load_data(path), {'created': 4, 'duplicates': 0})
+        pks = dict(Voter.objects.values_list('voter_id', 'pk'))
+
+        # A1 unchanged, A2 changed, A3 removed, A4 unchanged, A5 new
+        path = write_voter_csv(self, [voter_row('A1'), voter_row('A2', last_name='Jones'), voter_row('A4'),
+                               voter_row('A5', street_num='9')])
+        counts = upsert_data(path)
+        self.assertEqual(counts, {'created': 1, 'updated': 1, 'unchanged': 2, 'deleted': 1, 'duplicates': 0})
+        self.assertEqual(Voter.objects.get(voter_id='A2').last_name, 'Jones')
+        self.assertEqual(Voter.objects.get(voter_id='A2').pk, pks['A2'])
+        self.assertFalse(Voter.objects.filter(voter_id='A3').exists())
+        self.assertEqual(sum(Household.objects.values_list('size', flat=True)), 4)
+
+        # a second pass over the same file writes nothing
+        self.assertEqual(upsert_data(path),
+                         {'created': 0, 'updated': 0, 'unchanged': 4, 'deleted': 0, 'duplicates': 0})
+
+    def test_upsert_into_an_empty_table_creates_everyone(self):
+        path = write_voter_csv(self, [voter_row('A1'), voter_row('A2')])
+        self.assertEqual(upsert_data(path),
+                         {'created': 2, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'duplicates': 0})
+        self.assertEqual(sum(VoterRollup.objects.values_list('voters', flat=True)), 2)
+
+    def test_repeated_voter_ids_keep_the_first_row_in_both_loaders(self):
+        path = write_voter_csv(self, [voter_row('A1'), voter_row('A2'), voter_row('A1', last_name='Jones'),
+                               [], voter_row('A2', score=5)])
+        self.assertEqual(load_data(path), {'created': 2, 'duplicates': 2})
+        loaded = list(Voter.objects.order_by('voter_id').values_list('voter_id', 'last_name', 'voter_score'))
+        self.assertEqual(loaded, [('A1', 'Smith', 2), ('A2', 'Smith', 2)])
+
+        Voter.objects.all().delete()
+        self.assertEqual(upsert_data(path),
+                         {'created': 2, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'duplicates': 2})
+        self.assertEqual(
+            list(Voter.objects.order_by('voter_id').values_list('voter_id', 'last_name', 'voter_score')), loaded)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SearchTests(TestCase):
+    '''search_voters and fts_available'''
+
+    @classmethod
+    def setUpTestData(cls):
+        load_synthetic_voters(300, seed=3)
+
+    def test_search_matches_every_word_as_a_prefix(self):
+        voter = Voter.objects.order_by('pk').first()
+        first, street = voter.first_name[:3], voter.street_name.split()[0].lower()
+        # the synthetic names and streets are single words, so prefix LIKE queries find the same voters
+        expected = Voter.objects.filter(prefix_filter(first)).filter(prefix_filter(street))
+        found = search_voters(Voter.objects.all(), f'{first} {street}')
+        self.assertIn(voter, found)
+        self.assertEqual(set(found.values_list('pk', flat=True)), set(expected.values_list('pk', flat=True)))
+
+    def test_postgres_search_uses_indexable_conditions(self):
+        from django.contrib.postgres.lookups import TrigramSimilar
+
+        # the query is only built, not run, so the sqlite connection can stand in
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            queryset = search_voters(Voter.objects.all(), 'Pat  Beacon')
+        lookups = []
+        nodes = [queryset.query.where]
+        while nodes:
+            node = nodes.pop()
+            if hasattr(node, 'children'):
+                nodes.extend(node.children)
+            else:
+                lookups.append(node)
+        trigram = [lookup for lookup in lookups if isinstance(lookup, TrigramSimilar)]
+        prefix = [lookup for lookup in lookups if lookup.lookup_name == 'iregex']
+        # one of each per search word and field, and no other conditions
+        self.assertEqual(len(trigram), 6)
+        self.assertEqual(sorted({lookup.rhs.value for lookup in trigram}), ['beacon', 'pat'])
+        self.assertEqual(sorted({lookup.rhs for lookup in prefix}), ['^beacon', '^pat'])
+        self.assertEqual(len(lookups), 12)
+        self.assertEqual(queryset.query.order_by, ('-search_rank', 'pk'))
+
+    def test_fts_check_is_repeated_on_a_new_connection(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('the FTS5 index only exists on sqlite')
+        # a connection opened before the FTS migration ran remembers that it is missing
+        _fts_connections[connection.alias] = False
+        self.assertFalse(fts_available())
+        connection_created.send(sender=connection.__class__, connection=connection)
+        self.assertTrue(fts_available())
@@ -4,6 +4,10 @@
 # - the root url displays a list of voters
 # - the 'voter' url shows details for a specific voter
 # - the 'graphs' url shows various graphs related to voter data
+# - the 'graphs/data' url returns the aggregated data behind the graphs as json
+# - the 'export' url downloads the filtered voter list as csv or parquet
+# - the 'precincts' url shows per-precinct registration, turnout and party statistics
+# - the 'crosstab' urls count voters by election participation pattern and party or age band
 
 from django.urls import path
 from .views import *
@@ -12,4 +16,9 @@ urlpatterns = [
     path('', VoterListView.as_view(), name='voters'),   # root url serves voter list
     path('voter/<int:pk>/', VoterDetailView.as_view(), name='voter'),   # voter details for a specific voter
     path('graphs/', GraphsView.as_view(), name='graphs'),   # displays voter-related graphs
+    path('graphs/data/', GraphsDataView.as_view(), name='graphs_data'),   # aggregated graph data as json
+    path('export/', VoterExportView.as_view(), name='export_voters'),   # filtered voters as csv/parquet
+    path('precincts/', PrecinctDashboardView.as_view(), name='precincts'),   # per-precinct statistics
+    path('crosstab/', CrosstabView.as_view(), name='crosstab'),   # participation pattern cross-tab
+    path('crosstab/data/', CrosstabDataView.as_view(), name='crosstab_data'),   # cross-tab as json
 ]
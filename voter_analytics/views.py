@@ -1,32 +1,43 @@
 # views.py
 
 # This file contains the views for the voter analytics application which include:
-# 1. VoterListView: list view to display a paginated list of voters with filters for party affiliation, date of birth range, voter score, and election participation
-# 2. VoterDetailView: detail view for displaying individual voter information
+# 1. VoterListView: list view to display a paginated list of voters with name/street search and filters for party affiliation, date of birth range, voter score, and election participation
+# 2. VoterDetailView: detail view for displaying individual voter information and the other voters in their household
 # 3. GraphsView: list view for displaying various voter analytics graphs:
 #    - voter distribution by year of birth (bar chart)
 #    - voter distribution by party affiliation (pie chart)
 #    - voter participation in elections (histogram)
+#    - voters by age band and by voter score bucket (histograms with adjustable bin widths)
+# 4. GraphsDataView: json endpoint with the aggregated series behind the graphs, drawn in the browser
+# 5. VoterExportView: streams the filtered voter list as a csv or parquet download
+# 6. PrecinctDashboardView: side by side registration, turnout, voter score and party mix per precinct
+# 7. CrosstabView / CrosstabDataView: voters per election participation pattern, crossed with party or age band
 
-# the views utilize django generic views (ListView, DetailView) and Plotly for generating the charts
+# the views utilize django generic views (ListView, DetailView); the Plotly charts are built in charts.py
 # context data is dynamically generated based on query parameters and voter data from the database
 
-from django.shortcuts import render
-from django.views.generic import ListView, DetailView
+from django.conf import settings
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.generic import ListView, DetailView, TemplateView, View
+from cs412.versioning import versioned_cache_page
 from .models import Voter
-from django.db.models import Min, Max
-from datetime import datetime
-import plotly
-import plotly.graph_objects as go
-import plotly.express as px
-from django.utils.safestring import mark_safe
-import pandas as pd
+from .aggregates import (CROSSTAB_DIMENSIONS, ELECTIONS, get_filter_metadata, get_participation_crosstab,
+                         get_precinct_stats, histogram_bins, parse_bin_width)
+from .cache import APP_LABEL, get_data_version
+from .charts import chart_series, get_chart_data, get_chart_fragments, plotly_js
+from .export import parquet_available, stream_csv, stream_parquet
+from .filters import VoterFilter, VoterFilterPaginator
+from .pagination import InvalidCursor, KEYSET_ORDERINGS, paginate_keyset
+from .snapshot import SnapshotVoterList, get_snapshot
 
 class VoterListView(ListView):
     """
     view for displaying a paginated list of voters with filtering options based on query parameters
 
     filters available:
+    - name or street search
     - party affiliation
     - minimum and maximum DOB
     - voter score
@@ -46,48 +57,56 @@ class VoterListView(ListView):
         
         The filters include party affiliation, date of birth range (min/max), 
         voter score, and election participation. Each filter corresponds to 
-        a specific GET parameter
+        a specific GET parameter and is parsed by VoterFilter
         
         Returns:
             queryset: A filtered queryset of Voter objects
         """
-        queryset = Voter.objects.all()
-
-        # party affiliation filter
-        party_filter = self.request.GET.get("party")
-        if party_filter:
-            queryset = queryset.filter(party=party_filter)
-
-        # minimum date of birth filter
-        min_dob_filter = self.request.GET.get("min_dob")
-        if min_dob_filter:
-            try:
-                min_dob_date = datetime.strptime(min_dob_filter, '%Y').date()
-                queryset = queryset.filter(dob__gte=min_dob_date)
-            except ValueError:
-                pass  # invalid date format, ignore filter
-
-        # maximum date of birth filter
-        max_dob_filter = self.request.GET.get("max_dob")
-        if max_dob_filter:
-            try:
-                # assume max_dob is a year and set it to the last day of the year (12-31)
-                max_dob_date = datetime.strptime(max_dob_filter, '%Y').date().replace(month=12, day=31)
-                queryset = queryset.filter(dob__lte=max_dob_date)
-            except ValueError:
-                pass  # invalid date format, ignore filter
-        # voter score filter
-        voter_score_filter = self.request.GET.get("voter_score")
-        if voter_score_filter:
-            queryset = queryset.filter(voter_score=voter_score_filter)
-
-        # election participation filter (check multiple elections)
-        elections = ['v20state', 'v21town', 'v21primary', 'v22general', 'v23town']
-        for election in elections:
-            if self.request.GET.get(election):
-                queryset = queryset.filter(**{election: True})
-
-        return queryset
+        self.voter_filter = VoterFilter(self.request.GET)
+
+        # with the in-memory snapshot enabled, the matching voters are found without SQL
+        # and only the voters on the requested page are loaded from the database
+        snapshot = None if self.use_keyset_pagination() else get_snapshot()
+        if snapshot is not None and snapshot.supports(self.voter_filter):
+            return SnapshotVoterList(snapshot.matching_ids(self.voter_filter))
+
+        # order by id so offset pagination is stable across pages, unless the search
+        # already ranks the voters (by similarity, then id)
+        queryset = self.voter_filter.queryset()
+        return queryset if queryset.ordered else queryset.order_by('pk')
+
+    def use_keyset_pagination(self):
+        """keyset pagination is opt-in, with ?pagination=keyset or a cursor in the url"""
+        return self.request.GET.get('pagination') == 'keyset' or bool(self.request.GET.get('cursor'))
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        paginates with opaque next/previous cursors when keyset pagination is requested
+        so deep pages cost the same as the first one, otherwise uses page numbers
+        """
+        if not self.use_keyset_pagination():
+            return super().paginate_queryset(queryset, page_size)
+
+        ordering = self.request.GET.get('order', 'name')
+        if ordering not in KEYSET_ORDERINGS:
+            ordering = 'name'
+        try:
+            page = paginate_keyset(queryset, page_size, cursor=self.request.GET.get('cursor'), ordering=ordering)
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        return (None, page, page.object_list, page.has_other_pages())
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        """
+        returns a paginator that reuses the cached count for this filter, so paging
+        through the same filtered results doesn't run COUNT(*) on every page
+        """
+        if isinstance(queryset, SnapshotVoterList):
+            # the snapshot already knows how many voters matched
+            return super().get_paginator(queryset, per_page, orphans=orphans,
+                                         allow_empty_first_page=allow_empty_first_page, **kwargs)
+        return VoterFilterPaginator(queryset, per_page, self.voter_filter, orphans=orphans,
+                                    allow_empty_first_page=allow_empty_first_page, **kwargs)
 
     def get_context_data(self, **kwargs):
         """
@@ -104,37 +123,38 @@ class VoterListView(ListView):
         """
         context = super().get_context_data(**kwargs)
 
-        # get the available party affiliations
-        parties = Voter.objects.values_list('party', flat=True).distinct()
-
-        # get the minimum and maximum birth years from the dataset
-        min_birth_year = Voter.objects.aggregate(Min('dob'))['dob__min'].year
-        max_birth_year = Voter.objects.aggregate(Max('dob'))['dob__max'].year
-
-        # create a list of years from min to max birth years
-        years = list(range(min_birth_year, max_birth_year + 1))
-
-        context['parties'] = parties
-        context['min_birth_year'] = min_birth_year
-        context['max_birth_year'] = max_birth_year
-        context['years'] = years
-        context['elections'] = ['v20state', 'v21town', 'v21primary', 'v22general', 'v23town']
+        # get the available party affiliations and the range of birth years, cached
+        # until the voter file is reloaded
+        context.update(get_filter_metadata())
+        context['elections'] = ELECTIONS
+        context['voter_filter'] = self.voter_filter
+        context['keyset_pagination'] = self.use_keyset_pagination()
+        context['parquet_available'] = parquet_available()
 
         return context
     
 
+# voter pages only change when the loader reloads the data, which bumps the data version;
+# the version lives in the database, so culling these pages never resets it
+@method_decorator(versioned_cache_page(APP_LABEL), name='dispatch')
 class VoterDetailView(DetailView):
     """
     view that displays the details of a single voter
 
     This view retrieves a specific Voter object from the database and renders
     its detailed information in a template. The template is expected to display
-    the voter's personal details
+    the voter's personal details and the other voters registered at the same address
     """
     model = Voter
     template_name = 'voter_analytics/voter_detail.html' 
     context_object_name = 'voter' 
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # co-residents come from the household index built by the loader
+        context['co_residents'] = self.object.get_co_residents()
+        return context
+
 
 class GraphsView(ListView):
     """
@@ -142,9 +162,11 @@ class GraphsView(ListView):
     - voter distribution by year of birth (bar chart)
     - voter distribution by party affiliation (pie chart)
     - voter participation in elections (histogram)
+    - voters by age band and by voter score bucket (histograms)
     
     filters can be applied to the voter data, such as party affiliation, date of birth, 
-    voter score, and election participation
+    voter score, and election participation. the histogram bin widths are chosen with
+    ?age_bin_width= and ?score_bin_width=
     """
     model = Voter
     template_name = 'voter_analytics/graphs.html'
@@ -163,44 +185,9 @@ class GraphsView(ListView):
         Returns:
             queryset: A filtered queryset of voters.
         """
-        # start with all voters
-        queryset = Voter.objects.all()
-
-        # filter voters by party affiliation if provided
-        party_filter = self.request.GET.get("party")
-        if party_filter:
-            queryset = queryset.filter(party=party_filter)
-
-        # filter voters by minimum date of birth if provided
-        min_dob_filter = self.request.GET.get("min_dob")
-        if min_dob_filter:
-            try:
-                min_dob_date = datetime.strptime(min_dob_filter, '%Y').date()
-                queryset = queryset.filter(dob__gte=min_dob_date)
-            except ValueError:
-                pass  # invalid date format, just ignore it
-
-        # filter voters by maximum date of birth if provided
-        max_dob_filter = self.request.GET.get("max_dob")
-        if max_dob_filter:
-            try:
-                max_dob_date = datetime.strptime(max_dob_filter, '%Y').date().replace(month=12, day=31)
-                queryset = queryset.filter(dob__lte=max_dob_date)
-            except ValueError:
-                pass  # invalid date format, just ignore it
-
-        # filter voters by voter score if provided
-        voter_score_filter = self.request.GET.get("voter_score")
-        if voter_score_filter:
-            queryset = queryset.filter(voter_score=voter_score_filter)
-
-        # filter voters by election participation if provided
-        elections = ['v20state', 'v21town', 'v21primary', 'v22general', 'v23town']
-        for election in elections:
-            if self.request.GET.get(election):
-                queryset = queryset.filter(**{election: True})
-
-        return queryset
+        self.voter_filter = VoterFilter(self.request.GET)
+        self.bins = histogram_bins(self.request.GET)
+        return self.voter_filter.queryset()
 
     def get_context_data(self, **kwargs):
         """
@@ -216,96 +203,128 @@ class GraphsView(ListView):
         """
         context = super().get_context_data(**kwargs)
 
-        # get all available party affiliations
-        parties = Voter.objects.values_list('party', flat=True).distinct()
-
-        # get the minimum and maximum birth years from the voters
-        min_birth_year = Voter.objects.aggregate(Min('dob'))['dob__min'].year
-        max_birth_year = Voter.objects.aggregate(Max('dob'))['dob__max'].year
-
-        # create a list of all years between the min and max birth years
-        years = list(range(min_birth_year, max_birth_year + 1))
-
-        elections = ['v20state', 'v21town', 'v21primary', 'v22general', 'v23town']
-
-        context['parties'] = parties
-        context['min_birth_year'] = min_birth_year
-        context['max_birth_year'] = max_birth_year
-        context['years'] = years
-        context['elections'] = elections
-
-        # --- voter distribution by year of birth (bar chart) ---
-        birth_years = self.get_queryset().values_list('dob', flat=True)
-        birth_years = [dob.year for dob in birth_years if dob]  # extract years from birth dates
-
-        if birth_years:
-            # creating a DataFrame from the birth years
-            df_years = pd.DataFrame({'year': birth_years})
-            birth_year_counts = df_years['year'].value_counts().reset_index()
-            birth_year_counts.columns = ['year', 'count']
-            birth_year_counts = birth_year_counts.sort_values(by='year')  # sort by year
-
-            # creating the bar chart
-            fig_bar = px.bar(
-                birth_year_counts,
-                x='year', 
-                y='count', 
-                title="Voter Distribution by Year of Birth",
-                labels={'year': 'Year of Birth', 'count': 'Count'}
-            )
-
-            # adding the bar chart to the context
-            context['birth_year_graph'] = mark_safe(fig_bar.to_html(full_html=False))
-        else:
-            context['birth_year_graph'] = "<p>No data available.</p>"
-
-        # --- voter distribution by party affiliation (pie chart) ---
-        parties = self.get_queryset().values_list('party', flat=True)
-        parties = [p for p in parties if p]  
-
-        if parties:
-            # creating a DataFrame for party data
-            df_parties = pd.DataFrame({'party': parties})
-            party_counts = df_parties['party'].value_counts().reset_index()
-            party_counts.columns = ['party', 'count']
-
-            # creating the pie chart
-            fig_pie = px.pie(
-                party_counts,
-                names='party', 
-                values='count', 
-                title="Voter Distribution by Party Affiliation",
-                width=900,  
-                height=700  
-            )
-
-            # adding the pie chart to the context
-            context['party_pie_chart'] = mark_safe(fig_pie.to_html(full_html=False))
-        else:
-            context['party_pie_chart'] = "<p>No data available.</p>"
-
-        # --- voter participation in elections (histogram) ---
-        # counting how many voters participated in each election
-        election_counts = {election: self.get_queryset().filter(**{election: True}).count() for election in elections}
-
-        if any(election_counts.values()):  # check if there's any participation data
-            # creating a DataFrame for election participation data
-            df_elections = pd.DataFrame(list(election_counts.items()), columns=['Election', 'Count'])
-
-            # creating the histogram
-            fig_hist = px.bar(
-                df_elections,
-                x='Election',
-                y='Count',
-                title="Voter Participation in Elections",
-                labels={'Election': 'Election', 'Count': 'Number of Voters'},
-                text_auto=True,  
-                color='Election'
-            )
-
-            # adding the histogram to the context
-            context['election_histogram'] = mark_safe(fig_hist.to_html(full_html=False))
+        # get the available party affiliations and the range of birth years, cached
+        # until the voter file is reloaded
+        context.update(get_filter_metadata())
+        context['elections'] = ELECTIONS
+        context['voter_filter'] = self.voter_filter
+        context['bins'] = self.bins
+
+        # in client rendering mode the browser fetches the chart data from GraphsDataView
+        context['client_rendering'] = getattr(settings, 'VOTER_GRAPHS_CLIENT_RENDERING', False)
+        if not context['client_rendering']:
+            # the charts are built from database-side aggregates and the rendered
+            # fragments are cached per filter until the next data reload
+            context.update(get_chart_fragments(self.voter_filter, self.object_list, self.bins))
+            context['plotly_js'] = plotly_js()
+
+        return context
+
+
+def graphs_data_etag(request, *args, **kwargs):
+    """the chart data only changes with the filters, the bin widths and the voter data version"""
+    bins = histogram_bins(request.GET)
+    return f"{get_data_version()}-{VoterFilter(request.GET).cache_key}-{bins['age']}-{bins['voter_score']}"
+
+
+@method_decorator(condition(etag_func=graphs_data_etag), name='get')
+class GraphsDataView(View):
+    """
+    json endpoint returning only the aggregated series behind the voter graphs:
+    birth year counts, party counts, election participation counts and the age band
+    and voter score histograms
+
+    accepts the same filters as GraphsView. responses carry an ETag built from the
+    data version and the canonical filter, so browsers can revalidate with a 304
+    """
+
+    def get(self, request, *args, **kwargs):
+        voter_filter = VoterFilter(request.GET)
+        data = get_chart_data(voter_filter, voter_filter.queryset(), histogram_bins(request.GET))
+        response = JsonResponse(chart_series(data))
+        # let the browser reuse the response, but check the ETag before each use
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+
+class VoterExportView(View):
+    """
+    streams every voter matching the VoterListView filters as a download
+
+    ?format=csv (the default) returns a csv file, and ?format=parquet returns a
+    parquet file when pyarrow is installed. rows are streamed in chunks, so the
+    whole result set is never held in memory
+    """
+
+    def get(self, request, *args, **kwargs):
+        queryset = VoterFilter(request.GET).queryset()
+        export_format = request.GET.get('format', 'csv')
+
+        if export_format == 'csv':
+            response = StreamingHttpResponse(stream_csv(queryset), content_type='text/csv')
+        elif export_format == 'parquet':
+            if not parquet_available():
+                return HttpResponseBadRequest("Parquet export requires pyarrow to be installed")
+            response = StreamingHttpResponse(stream_parquet(queryset), content_type='application/vnd.apache.parquet')
         else:
-            context['election_histogram'] = "<p>No data available.</p>"
+            return HttpResponseBadRequest(f"Unknown export format: {export_format}")
+
+        response['Content-Disposition'] = f'attachment; filename="voters.{export_format}"'
+        return response
 
+
+class PrecinctDashboardView(TemplateView):
+    """
+    view that compares all precincts side by side:
+    - registered voters
+    - participation rate in each of the five elections
+    - mean voter score
+    - party mix
+
+    the statistics are computed with one grouped query and cached until the next data reload
+    """
+    template_name = 'voter_analytics/precincts.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['precincts'] = get_precinct_stats()
+        context['elections'] = ELECTIONS
         return context
+
+
+class CrosstabMixin:
+    """parses the cross-tab parameters shared by the html and json cross-tab views"""
+
+    def get_crosstab(self):
+        """
+        returns the participation cross-tab for the request's parameters:
+        - by: 'party' (default) or 'age_band'
+        - band_width: width of the age bands in years (default 10)
+        - the usual voter filters (party, min_dob, max_dob, voter_score, elections)
+        """
+        by = self.request.GET.get('by', 'party')
+        if by not in CROSSTAB_DIMENSIONS:
+            by = 'party'
+        band_width = parse_bin_width(self.request.GET.get('band_width'), 10)
+        return get_participation_crosstab(VoterFilter(self.request.GET), by=by, band_width=band_width)
+
+
+class CrosstabView(CrosstabMixin, TemplateView):
+    """
+    view that shows how many voters follow each of the 32 possible participation
+    patterns across the five elections, crossed with party or age band
+    """
+    template_name = 'voter_analytics/crosstab.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['crosstab'] = self.get_crosstab()
+        context['dimensions'] = CROSSTAB_DIMENSIONS
+        return context
+
+
+class CrosstabDataView(CrosstabMixin, View):
+    """json endpoint returning the same participation cross-tab as CrosstabView"""
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(self.get_crosstab())